@@ -0,0 +1,270 @@
+"""
+In-process LRU + TTL cache for chat answers.
+
+The legal-assistant avatar answers the same handful of questions all day.
+Caching the final answer for an identical (normalized) conversation skips
+the Azure Search + GPT round trip entirely. Entries are bounded by count and
+by bytes, expire after a TTL, and may be served stale for a grace period
+while a single background refresh replaces them.
+
+With a shared cache (cache_backend.py) this is the worker's L1: answers
+generated by other workers or nodes are adopted on a local miss, keeping
+the age they had there.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text) -> str:
+    """Collapse whitespace and case so trivially different questions share a key."""
+    if not isinstance(text, str):
+        # Multimodal content parts: normalize their canonical JSON form
+        text = json.dumps(text, sort_keys=True, ensure_ascii=False)
+    return _WHITESPACE_RE.sub(" ", text).strip().casefold()
+
+
+def answer_cache_key(
+    messages: List[Dict[str, object]],
+    use_search: bool,
+    deployment: str,
+    index_name: str,
+    system_prompt: str,
+    max_tokens: int,
+    temperature: float,
+) -> str:
+    """
+    Build the cache key for a chat turn.
+
+    Args:
+        messages: Conversation as role/content dicts
+        use_search: Whether Azure Search grounding is used
+        deployment: Azure OpenAI deployment name
+        index_name: Azure Search index name
+        system_prompt: System prompt in effect
+        max_tokens: Completion token limit
+        temperature: Sampling temperature
+
+    Returns:
+        Hex SHA-256 digest identifying the request.
+    """
+    material = {
+        "messages": [[m["role"], normalize_text(m["content"])] for m in messages],
+        "use_search": bool(use_search),
+        "deployment": deployment or "",
+        "index_name": index_name or "",
+        "system_prompt": system_prompt or "",
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+    }
+    encoded = json.dumps(material, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class CacheEntry:
+    """A cached answer with its bookkeeping."""
+
+    __slots__ = ("key", "response", "total_tokens", "label", "size", "created_at", "hits")
+
+    def __init__(self, key: str, response: str, total_tokens: int, label: str):
+        self.key = key
+        self.response = response
+        self.total_tokens = total_tokens
+        self.label = label
+        self.size = len(key) + len(response.encode("utf-8")) + len(label.encode("utf-8"))
+        self.created_at = time.monotonic()
+        self.hits = 0
+
+
+class AnswerCache:
+    """Bounded LRU cache with TTL expiry and stale-while-revalidate."""
+
+    def __init__(
+        self,
+        max_entries: int = 512,
+        max_bytes: int = 8 * 1024 * 1024,
+        ttl: float = 3600.0,
+        stale_ttl: float = 600.0,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        self._refreshing = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.refreshes = 0
+        self.tokens_saved = 0
+        self.latency_saved = 0.0
+        self._upstream_latency_ewma: Optional[float] = None
+
+    @classmethod
+    def from_config(cls, config) -> "AnswerCache":
+        """Build a cache from the ANSWER_CACHE_* settings of a config object."""
+        return cls(
+            max_entries=config.ANSWER_CACHE_MAX_ENTRIES,
+            max_bytes=config.ANSWER_CACHE_MAX_BYTES,
+            ttl=config.ANSWER_CACHE_TTL,
+            stale_ttl=config.ANSWER_CACHE_STALE_TTL,
+        )
+
+    def get(self, key: str) -> Tuple[Optional[CacheEntry], bool]:
+        """
+        Look up an answer.
+
+        Returns:
+            Tuple of (entry or None, stale). A stale entry is past its TTL but
+            still inside the stale window and should be refreshed.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None, False
+        age = time.monotonic() - entry.created_at
+        if age > self.ttl + self.stale_ttl:
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None, False
+        self._entries.move_to_end(key)
+        entry.hits += 1
+        self.tokens_saved += entry.total_tokens
+        if self._upstream_latency_ewma is not None:
+            self.latency_saved += self._upstream_latency_ewma
+        stale = age > self.ttl
+        if stale:
+            self.stale_hits += 1
+        else:
+            self.hits += 1
+        return entry, stale
+
+    def set(self, key: str, response: str, total_tokens: int = 0, label: str = "") -> None:
+        """Store an answer, evicting least recently used entries to fit."""
+        entry = CacheEntry(key, response, total_tokens, label[:120])
+        if entry.size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def adopt(self, key: str, response: str, total_tokens: int, label: str,
+              age: float) -> Tuple[Optional[CacheEntry], bool]:
+        """
+        Store an answer found in the shared cache after a local miss and serve it.
+
+        Args:
+            age: Seconds since the answer was generated, by whichever worker
+
+        Returns:
+            Tuple of (entry, stale), or (None, False) if it is past the stale window.
+        """
+        if age > self.ttl + self.stale_ttl:
+            return None, False
+        self.set(key, response, total_tokens, label)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, False
+        entry.created_at -= age
+        entry.hits += 1
+        self.shared_hits += 1
+        self.tokens_saved += total_tokens
+        if self._upstream_latency_ewma is not None:
+            self.latency_saved += self._upstream_latency_ewma
+        return entry, age > self.ttl
+
+    def delete(self, key: str) -> bool:
+        """Invalidate one entry. Returns True if it existed."""
+        if key not in self._entries:
+            return False
+        self._remove(key)
+        return True
+
+    def clear(self) -> int:
+        """Invalidate every entry. Returns the number removed."""
+        count = len(self._entries)
+        self._entries.clear()
+        self._bytes = 0
+        return count
+
+    def begin_refresh(self, key: str) -> bool:
+        """Claim the background refresh of a stale key; False if one is running."""
+        if key in self._refreshing:
+            return False
+        self._refreshing.add(key)
+        self.refreshes += 1
+        return True
+
+    def end_refresh(self, key: str) -> None:
+        """Release a refresh claim taken with `begin_refresh`."""
+        self._refreshing.discard(key)
+
+    def record_upstream_latency(self, seconds: float) -> None:
+        """Feed the latency of an uncached answer into the savings estimate."""
+        if self._upstream_latency_ewma is None:
+            self._upstream_latency_ewma = seconds
+        else:
+            self._upstream_latency_ewma += 0.2 * (seconds - self._upstream_latency_ewma)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def stats(self) -> Dict[str, object]:
+        """Counters and occupancy for monitoring."""
+        # Shared hits follow a local miss
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.stale_hits + self.shared_hits) / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "refreshes": self.refreshes,
+            "refreshing": len(self._refreshing),
+            "tokens_saved": self.tokens_saved,
+            "latency_saved_seconds": round(self.latency_saved, 3),
+        }
+
+    def entries(self) -> List[Dict[str, object]]:
+        """Describe cached entries, most recently used first."""
+        now = time.monotonic()
+        return [
+            {
+                "key": entry.key,
+                "label": entry.label,
+                "bytes": entry.size,
+                "age_seconds": round(now - entry.created_at, 1),
+                "stale": now - entry.created_at > self.ttl,
+                "hits": entry.hits,
+                "total_tokens": entry.total_tokens,
+            }
+            for entry in reversed(self._entries.values())
+        ]
@@ -0,0 +1,232 @@
+"""
+Fingerprinted, precompressed static assets for /css, /js and /image.
+
+At startup every asset is read once and given a content-hashed name
+(`js/chat.js` -> `js/chat.3f9a1c0b2e.js`). HTML pages are rewritten to use
+the hashed URLs, which are served from memory with
+`Cache-Control: public, max-age=31536000, immutable`, so repeat page loads
+make no asset requests at all. A new deploy changes the hash and therefore
+the URL.
+
+Compressible assets get gzip and brotli variants chosen by
+`Accept-Encoding`. Precompressed `.br`/`.gz` siblings on disk (for example
+produced at build time) are used instead of compressing at startup.
+Original, unhashed URLs keep working through `StaticFiles`.
+"""
+
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+from typing import Dict, Iterable, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+
+from config_snapshot import etag_matches
+from page_cache import ENCODINGS, negotiate_encoding
+
+try:
+    import brotli
+except ImportError:  # optional: gzip variants only
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Content types worth compressing (images are already compressed)
+COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".json", ".svg", ".txt", ".map", ".html"}
+
+# Sibling suffix -> content coding
+PRECOMPRESSED_SUFFIXES = {".br": "br", ".gz": "gzip"}
+
+HASH_LENGTH = 10
+
+# src="./js/chat.js", href='/css/style.css', src="image/attachment.jpg"
+_REFERENCE_RE = re.compile(
+    r"""(?P<attr>\b(?:src|href)\s*=\s*)(?P<quote>["'])(?P<prefix>\./|/)?(?P<path>(?:css|js|image)/[^"'?#]+)(?P=quote)"""
+)
+
+
+def fingerprinted_name(rel_path: str, digest: str) -> str:
+    """`js/chat.js` + digest -> `js/chat.<digest>.js`."""
+    base, ext = os.path.splitext(rel_path)
+    return f"{base}.{digest}{ext}"
+
+
+class Asset:
+    """One asset in memory with its encoded variants."""
+
+    __slots__ = ("path", "url", "media_type", "digest", "bodies")
+
+    def __init__(self, path: str, url: str, media_type: str, digest: str, bodies: Dict[Optional[str], bytes]):
+        self.path = path
+        self.url = url
+        self.media_type = media_type
+        self.digest = digest
+        self.bodies = bodies
+
+    def etag_for(self, coding: Optional[str]) -> str:
+        return f'"{self.digest}-{coding}"' if coding else f'"{self.digest}"'
+
+
+class AssetManifest:
+    """Content-hash manifest of the static directories."""
+
+    def __init__(self, directories: Iterable[str] = ("css", "js", "image")):
+        self.directories = tuple(directories)
+        # Original relative path ("js/chat.js") -> fingerprinted one
+        self.manifest: Dict[str, str] = {}
+        # Fingerprinted relative path -> asset
+        self._assets: Dict[str, Asset] = {}
+        self.hits = 0
+        self.not_modified = 0
+
+    def build(self) -> int:
+        """(Re)hash every asset; returns the number of assets."""
+        manifest, assets = {}, {}
+        for directory in self.directories:
+            for root, _, files in os.walk(directory):
+                for name in sorted(files):
+                    if os.path.splitext(name)[1] in PRECOMPRESSED_SUFFIXES:
+                        continue
+                    path = os.path.join(root, name)
+                    rel_path = os.path.relpath(path, ".").replace(os.sep, "/")
+                    try:
+                        asset = self._load(path, rel_path)
+                    except OSError as e:
+                        logger.warning(f"Asset {rel_path} skipped: {str(e)}")
+                        continue
+                    manifest[rel_path] = asset.url
+                    assets[asset.url] = asset
+        # Swap in one step so concurrent requests see either build
+        self.manifest, self._assets = manifest, assets
+        logger.info(f"Asset manifest built ({len(assets)} assets)")
+        return len(assets)
+
+    def _load(self, path: str, rel_path: str) -> Asset:
+        with open(path, "rb") as f:
+            content = f.read()
+        digest = hashlib.sha256(content).hexdigest()[:HASH_LENGTH]
+        media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        bodies: Dict[Optional[str], bytes] = {None: content}
+        if os.path.splitext(path)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+            bodies.update(self._variants(path, content))
+        return Asset(path, fingerprinted_name(rel_path, digest), media_type, digest, bodies)
+
+    @staticmethod
+    def _variants(path: str, content: bytes) -> Dict[str, bytes]:
+        variants = {}
+        mtime = os.stat(path).st_mtime
+        for suffix, coding in PRECOMPRESSED_SUFFIXES.items():
+            sibling = path + suffix
+            if os.path.exists(sibling) and os.stat(sibling).st_mtime >= mtime:
+                with open(sibling, "rb") as f:
+                    variants[coding] = f.read()
+        if "gzip" not in variants:
+            variants["gzip"] = gzip.compress(content, compresslevel=9, mtime=0)
+        if "br" not in variants and brotli is not None:
+            variants["br"] = brotli.compress(content, quality=11)
+        return {coding: body for coding, body in variants.items() if len(body) < len(content)}
+
+    def url_for(self, rel_path: str) -> str:
+        """Fingerprinted relative path for an asset, or the path itself if unknown."""
+        return self.manifest.get(rel_path, rel_path)
+
+    def rewrite_html(self, path: str, content: bytes) -> bytes:
+        """Point asset references of an HTML page at their fingerprinted URLs."""
+        def replace(match: "re.Match") -> str:
+            hashed = self.manifest.get(match.group("path"))
+            if hashed is None:
+                return match.group(0)
+            quote = match.group("quote")
+            return f"{match.group('attr')}{quote}{match.group('prefix') or ''}{hashed}{quote}"
+
+        return _REFERENCE_RE.sub(replace, content.decode("utf-8")).encode("utf-8")
+
+    def lookup(self, rel_path: str) -> Optional[Asset]:
+        return self._assets.get(rel_path)
+
+    def response(self, asset: Asset, request: Request) -> Response:
+        """Serve an asset with immutable caching and the best accepted encoding."""
+        coding = negotiate_encoding(request.headers.get("accept-encoding"),
+                                    [c for c in ENCODINGS if c in asset.bodies])
+        etag = asset.etag_for(coding)
+        headers = {"Cache-Control": IMMUTABLE_CACHE_CONTROL, "ETag": etag}
+        if len(asset.bodies) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        self.hits += 1
+        if coding:
+            headers["Content-Encoding"] = coding
+        body = asset.bodies[coding]
+        if request.method == "HEAD":
+            headers["Content-Length"] = str(len(body))
+            return Response(status_code=200, media_type=asset.media_type, headers=headers)
+        return Response(content=body, media_type=asset.media_type, headers=headers)
+
+    def stats(self) -> Dict[str, object]:
+        """Manifest and counters for monitoring."""
+        return {
+            "assets": len(self._assets),
+            "brotli": brotli is not None,
+            "hits": self.hits,
+            "not_modified": self.not_modified,
+            "manifest": dict(self.manifest),
+        }
+
+
+class FingerprintedStaticFiles(StaticFiles):
+    """StaticFiles that serves fingerprinted names from an AssetManifest."""
+
+    def __init__(self, *, directory: str, manifest: AssetManifest, **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.prefix = os.path.normpath(directory).replace(os.sep, "/")
+        self.assets = manifest
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if scope["method"] in ("GET", "HEAD"):
+            asset = self.assets.lookup(f"{self.prefix}/{path}")
+            if asset is not None:
+                return self.assets.response(asset, Request(scope))
+        return await super().get_response(path, scope)
+
+
+def write_precompressed(directories: Iterable[str] = ("css", "js", "image")) -> int:
+    """
+    Build step: write `.gz` (and `.br` when brotli is installed) siblings
+    next to every compressible asset, for servers started without brotli.
+
+    Returns:
+        Number of files written.
+    """
+    written = 0
+    for directory in directories:
+        for root, _, files in os.walk(directory):
+            for name in files:
+                path = os.path.join(root, name)
+                ext = os.path.splitext(name)[1].lower()
+                if ext in PRECOMPRESSED_SUFFIXES or ext not in COMPRESSIBLE_EXTENSIONS:
+                    continue
+                with open(path, "rb") as f:
+                    content = f.read()
+                variants = {".gz": gzip.compress(content, compresslevel=9, mtime=0)}
+                if brotli is not None:
+                    variants[".br"] = brotli.compress(content, quality=11)
+                for suffix, body in variants.items():
+                    with open(path + suffix, "wb") as f:
+                        f.write(body)
+                    written += 1
+    return written
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logger.info(f"Wrote {write_precompressed()} precompressed asset files")
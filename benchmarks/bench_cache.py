@@ -0,0 +1,172 @@
+"""
+Check and time the shared cache backends.
+
+Runs the same round trips through every backend: the in-process
+`MemoryBackend`, `SQLiteBackend` on a temporary file, and `RedisBackend`
+against the stand-in RESP server (started here on a free port) or a real
+server given with --redis-url. Each backend first passes a behaviour check
+(get/set/get_many/delete/TTL expiry/namespace clear, and for Redis an
+unreachable server reading as misses), then reports microseconds per
+operation for an answer-sized value and a 1536-float embedding, and the
+`TieredCache` L1 hit for comparison.
+
+Usage:
+    python benchmarks/bench_cache.py [--operations 2000] [--redis-url redis://127.0.0.1:6379/0]
+"""
+
+import argparse
+import array
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cache_backend import (  # noqa: E402
+    MemoryBackend, Namespace, RedisBackend, SQLiteBackend, TieredCache, pack, unpack
+)
+import resp_server  # noqa: E402
+
+ANSWER = {
+    "response": "Согласно статье 1154 Гражданского кодекса, наследство может быть принято в течение "
+                "шести месяцев со дня открытия наследства. " * 3,
+    "tokens": 412,
+    "label": "Какой срок принятия наследства?",
+    "created": 1700000000.25,
+}
+
+
+def embedding() -> bytes:
+    rng = random.Random(0)
+    return array.array("f", (rng.uniform(-1, 1) for _ in range(1536))).tobytes()
+
+
+def check(condition: bool, message: str) -> None:
+    if not condition:
+        raise AssertionError(message)
+
+
+def check_serializer() -> None:
+    values = [None, True, False, 0, -1, 2 ** 70, -(2 ** 70), 1.5, "", "текст", b"\x00\xff",
+              [1, [2, "x"], {"a": None}], {"nested": {"list": [1.25, -3]}}, ANSWER, embedding()]
+    for value in values:
+        check(unpack(pack(value)) == value, f"round trip of {value!r:.40}")
+    check(len(pack(ANSWER)) < len(repr(ANSWER).encode("utf-8")), "packed answer is compact")
+
+
+async def check_backend(backend, namespace: Namespace) -> None:
+    cache = TieredCache(backend, namespace, l1_ttl=0.05)
+    await cache.clear("answer")
+    await cache.clear("embedding")
+    check(await cache.get("answer", "missing") is None, "miss")
+    await cache.set("answer", "k1", ANSWER, ttl=60)
+    check(await cache.get("answer", "k1") == ANSWER, "hit after set")
+    await asyncio.sleep(0.06)  # past the L1 TTL: served by the L2
+    check(await cache.get("answer", "k1") == ANSWER, "L2 hit")
+    await cache.set_many("embedding", [("e1", b"\x01"), ("e2", b"\x02")], ttl=60)
+    check(await cache.get_many("embedding", ["e1", "nope", "e2"]) == [b"\x01", None, b"\x02"], "get_many")
+    check(await cache.delete("answer", "k1"), "delete existing")
+    check(await cache.get("answer", "k1") is None, "miss after delete")
+    await cache.set("answer", "short", ANSWER, ttl=0.05)
+    await asyncio.sleep(0.1)
+    check(await cache.get("answer", "short") is None, "expired")
+    await cache.set("answer", "a", 1, ttl=60)
+    await cache.set("answer", "b", 2, ttl=60)
+    check(await cache.clear("answer") == 2, "clear removes the kind's keys")
+    check(await cache.get_many("embedding", ["e1"]) == [b"\x01"], "clear keeps other kinds")
+    long_key = "x" * 1000
+    await cache.set("answer", long_key, 3, ttl=60)
+    check(await cache.get("answer", long_key) == 3, "long keys are hashed")
+    await cache.clear("answer")
+    await cache.clear("embedding")
+
+
+async def check_unreachable() -> None:
+    backend = RedisBackend("redis://127.0.0.1:1/0", timeout=0.2, retry_after=60)
+    cache = TieredCache(backend, Namespace("bench"))
+    await cache.set("answer", "k", ANSWER, ttl=60)
+    await asyncio.sleep(0.01)
+    check(await cache.get("answer", "other") is None, "unreachable server reads as a miss")
+    check(backend.stats()["available"] is False and backend.skipped >= 1, "unreachable server is skipped")
+
+
+async def time_backend(label: str, backend, operations: int):
+    namespace = Namespace("bench")
+    cache = TieredCache(backend, namespace, l1_ttl=0.0)
+    vector = embedding()
+    rows = []
+    for kind, value in (("answer", ANSWER), ("embedding", vector)):
+        keys = [f"{kind}-{i}" for i in range(operations)]
+        started = time.perf_counter()
+        for key in keys:
+            await cache.set(kind, key, value, ttl=300)
+        set_us = (time.perf_counter() - started) / operations * 1e6
+        started = time.perf_counter()
+        for key in keys:
+            await cache.get(kind, key)
+        get_us = (time.perf_counter() - started) / operations * 1e6
+        started = time.perf_counter()
+        for start in range(0, operations, 16):
+            await cache.get_many(kind, keys[start:start + 16])
+        many_us = (time.perf_counter() - started) / operations * 1e6
+        rows.append((label, kind, len(pack(value)), set_us, get_us, many_us))
+        await cache.clear(kind)
+    return rows
+
+
+async def time_l1(operations: int):
+    cache = TieredCache(MemoryBackend(), Namespace("bench"), l1_ttl=300)
+    await cache.set("answer", "hot", ANSWER, ttl=300)
+    started = time.perf_counter()
+    for _ in range(operations):
+        await cache.get("answer", "hot")
+    return (time.perf_counter() - started) / operations * 1e6
+
+
+async def run(args: argparse.Namespace) -> None:
+    check_serializer()
+    with tempfile.TemporaryDirectory() as directory:
+        server = None
+        redis_url = args.redis_url
+        if not redis_url:
+            _, server = await resp_server.start("127.0.0.1", 0, password="bench")
+            port = server.sockets[0].getsockname()[1]
+            redis_url = f"redis://:bench@127.0.0.1:{port}/1"
+        backends = [
+            ("memory", lambda: MemoryBackend(max_entries=10 * args.operations, max_bytes=1 << 30)),
+            ("sqlite", lambda: SQLiteBackend(os.path.join(directory, "cache.sqlite3"))),
+            ("redis" if args.redis_url else "redis (stand-in)", lambda: RedisBackend(redis_url, timeout=5.0)),
+        ]
+        rows = []
+        for label, build in backends:
+            backend = build()
+            await check_backend(backend, Namespace("bench-check"))
+            print(f"{label}: behaviour checks passed", file=sys.stderr)
+            rows.extend(await time_backend(label, backend, args.operations))
+            await backend.close()
+        await check_unreachable()
+        print("unreachable redis: reads as misses and is skipped", file=sys.stderr)
+        l1_us = await time_l1(args.operations)
+        if server is not None:
+            server.close()
+            await server.wait_closed()
+
+    print(f"{'backend':<18} {'value':<10} {'bytes':>6} {'set us':>9} {'get us':>9} {'get_many/16 us':>15}")
+    for label, kind, size, set_us, get_us, many_us in rows:
+        print(f"{label:<18} {kind:<10} {size:>6} {set_us:>9.1f} {get_us:>9.1f} {many_us:>15.1f}")
+    print(f"{'L1 hit':<18} {'answer':<10} {len(pack(ANSWER)):>6} {'':>9} {l1_us:>9.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--operations", type=int, default=2000)
+    parser.add_argument("--redis-url", help="Real Redis-protocol server instead of the stand-in")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Offline load test: the service against the mock upstream, per worker count.
+
+Starts benchmarks/mock_upstream.py, then for each worker count starts the
+app the way startup.sh does (gunicorn with UvicornWorker, or plain
+uvicorn with --server uvicorn) pointed at the mock, waits for /health,
+drives it with benchmarks/loadgen.py and stops it. Prints p50/p95/p99
+latency, TTFB and RPS per scenario and worker count. Nothing leaves the
+machine: Azure Search grounding is answered by the mock as well.
+
+Usage:
+    python benchmarks/bench_load.py [--workers 1,2,4] [--server gunicorn|uvicorn]
+        [--rate 20] [--duration 30] [--mix ...] [--mock-args "--latency lognormal:600:0.5"]
+        [--json results.json]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadgen import add_load_arguments, format_report, run_load  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_until_up(url: str, timeout: float, process: subprocess.Popen) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url}: process exited with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+def stop(process: subprocess.Popen) -> None:
+    if process.poll() is None:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def server_command(server: str, workers: int, port: int):
+    if server == "gunicorn":
+        return [sys.executable, "-m", "gunicorn", "-w", str(workers), "-k", "uvicorn.workers.UvicornWorker",
+                "main:app", "--bind", f"127.0.0.1:{port}", "--timeout", "600"]
+    return [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(workers), "--no-access-log"]
+
+
+def server_env(mock_port: int, metrics_dir: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "ENVIRONMENT": "production",
+        "AZURE_OPENAI_ENDPOINT": f"http://127.0.0.1:{mock_port}",
+        "AZURE_OPENAI_KEY": "mock-key",
+        "AZURE_OPENAI_DEPLOYMENT": env.get("AZURE_OPENAI_DEPLOYMENT") or "gpt-4o",
+        # Grounding is answered by the chat mock; the search endpoint only serves health probes
+        "AZURE_SEARCH_ENDPOINT": f"http://127.0.0.1:{mock_port}",
+        "AZURE_SEARCH_API_KEY": "mock-key",
+        "AZURE_SEARCH_INDEX_NAME": "mock-index",
+        "AZURE_SPEECH_KEY": env.get("AZURE_SPEECH_KEY") or "mock-key",
+        "AZURE_SPEECH_REGION": env.get("AZURE_SPEECH_REGION") or "westeurope",
+        "METRICS_MULTIPROCESS_DIR": metrics_dir,
+    })
+    return env
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", default="1,2,4", help="Comma-separated worker counts")
+    parser.add_argument("--server", choices=("gunicorn", "uvicorn"), default="gunicorn")
+    parser.add_argument("--port", type=int, default=8100, help="Port of the app under test")
+    parser.add_argument("--mock-port", type=int, default=9100)
+    parser.add_argument("--mock-args", default="", help="Extra arguments for mock_upstream.py")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Seconds of unrecorded load first")
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--json", help="Also write the summaries to this file")
+    add_load_arguments(parser)
+    args = parser.parse_args(argv)
+
+    mock = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "benchmarks", "mock_upstream.py"), "--port", str(args.mock_port),
+         *shlex.split(args.mock_args)],
+    )
+    rows = []
+    try:
+        wait_until_up(f"http://127.0.0.1:{args.mock_port}/stats", args.startup_timeout, mock)
+        for workers in [int(value) for value in args.workers.split(",")]:
+            with tempfile.TemporaryDirectory(prefix="bench-metrics-") as metrics_dir:
+                server = subprocess.Popen(server_command(args.server, workers, args.port), cwd=ROOT,
+                                          env=server_env(args.mock_port, metrics_dir),
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                try:
+                    base_url = f"http://127.0.0.1:{args.port}"
+                    wait_until_up(f"{base_url}/ready", args.startup_timeout, server)
+                    print(f"{args.server}, {workers} worker(s): {args.rate:g} req/s for {args.duration:g}s",
+                          file=sys.stderr)
+                    if args.warmup:
+                        asyncio.run(run_load(base_url, args.rate, args.warmup, args.mix, args.question_pool,
+                                             args.max_in_flight, args.poisson, args.timeout, args.seed + 1))
+                    results = asyncio.run(run_load(base_url, args.rate, args.duration, args.mix,
+                                                   args.question_pool, args.max_in_flight, args.poisson,
+                                                   args.timeout, args.seed))
+                    rows.extend({"workers": workers, **row} for row in results)
+                finally:
+                    stop(server)
+    finally:
+        stop(mock)
+
+    print(format_report(rows))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as handle:
+            json.dump({"server": args.server, "rate": args.rate, "duration": args.duration, "mix": args.mix,
+                       "results": rows}, handle, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Micro-benchmark: per-request cost of logging on the chat hot path.
+
+"before" replays the log calls a grounded /chat turn used to make (eager
+f-strings, citation and answer dumps) through `logging.basicConfig`'s
+blocking stream handler. "after" makes the current calls through
+`configure_logging` with the production settings: queue handler, JSON
+lines, sampled chat.request/chat.route/chat.citations events and no
+content dumps. Only the time spent on the calling thread (the event
+loop in the service) is measured; output goes to a file, and
+--sink-delay-ms slows every write down like a congested log pipe.
+
+Usage:
+    python benchmarks/bench_logging.py [--requests 20000] [--sink-delay-ms 0]
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from structured_logging import configure_logging  # noqa: E402
+
+CITATIONS = [
+    {"content": "Наследство может быть принято в течение шести месяцев со дня открытия наследства. " * 3,
+     "title": f"Гражданский кодекс, статья {1154 + i}"}
+    for i in range(5)
+]
+ANSWER = "Согласно статье 1154 Гражданского кодекса, наследство может быть принято в течение шести месяцев. " * 4
+MESSAGES = 7
+
+
+class SlowFile:
+    """File wrapper whose writes take `delay` seconds."""
+
+    def __init__(self, handle, delay: float):
+        self.handle = handle
+        self.delay = delay
+
+    def write(self, text: str) -> int:
+        if self.delay:
+            time.sleep(self.delay)
+        return self.handle.write(text)
+
+    def flush(self) -> None:
+        self.handle.flush()
+
+
+def turn_before(logger: logging.Logger) -> None:
+    logger.info(f"Processing chat request with {MESSAGES} messages")
+    logger.info("Adding Azure Search data source")
+    logger.info(f"Azure Search found {len(CITATIONS)} citations")
+    for i, citation in enumerate(CITATIONS[:3]):
+        logger.info(f"Citation {i+1}: {citation.get('content', '')[:100]}...")
+        logger.info(f"Citation {i+1} title: {citation.get('title', 'No title')}")
+    logger.info(f"Search intent: {['наследство срок']}")
+    logger.info(f"Full response content: {ANSWER[:200]}...")
+    logger.info(f"Successfully processed chat request. Response length: {len(ANSWER)}")
+
+
+def turn_after(logger: logging.Logger, log_content: bool = False) -> None:
+    logger.info("Processing chat request with %d messages", MESSAGES,
+                extra={"event": "chat.request", "messages": MESSAGES})
+    logger.info("Adding Azure Search data source", extra={"event": "chat.route", "route": "azure_search"})
+    logger.info("Azure Search found %d citations", len(CITATIONS),
+                extra={"event": "chat.citations", "citations": len(CITATIONS)})
+    if log_content and logger.isEnabledFor(logging.DEBUG):
+        for i, citation in enumerate(CITATIONS[:3]):
+            logger.debug("Citation %d: %s... (%s)", i + 1, citation.get('content', '')[:100],
+                         citation.get('title', 'No title'))
+    logger.info("Successfully processed chat request. Response length: %d", len(ANSWER),
+                extra={"event": "chat.answer", "cached": False})
+
+
+def production_config(**overrides) -> types.SimpleNamespace:
+    settings = dict(LOG_LEVEL="INFO", LOG_FORMAT="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                    LOG_QUEUE=True, LOG_JSON=True, LOG_SAMPLE_RATES="chat.request=0.1,chat.route=0.1,chat.citations=0.1",
+                    LOG_RATE_LIMIT=50.0, LOG_CONTENT_DEBUG=False)
+    settings.update(overrides)
+    return types.SimpleNamespace(**settings)
+
+
+def redirect_output(stream) -> None:
+    """Point the root logger's stream handlers (direct or behind the queue) at `stream`."""
+    for handler in logging.getLogger().handlers:
+        listener_handlers = getattr(getattr(handler, "listener", None), "handlers", ())
+        for target in (handler, *listener_handlers):
+            if isinstance(target, logging.StreamHandler):
+                target.setStream(stream)
+
+
+def measure(turn, logger: logging.Logger, requests: int) -> float:
+    started = time.perf_counter()
+    for _ in range(requests):
+        turn(logger)
+    return (time.perf_counter() - started) / requests
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--sink-delay-ms", type=float, default=0.0,
+                        help="Added latency of every write to the log output")
+    args = parser.parse_args()
+    logger = logging.getLogger("main")
+    delay = args.sink_delay_ms / 1000.0
+
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "before.log"), "w", encoding="utf-8") as handle:
+            root = logging.getLogger()
+            for handler in list(root.handlers):
+                root.removeHandler(handler)
+            logging.basicConfig(level=logging.INFO, stream=SlowFile(handle, delay),
+                                format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", force=True)
+            before = measure(turn_before, logger, args.requests)
+
+        with open(os.path.join(directory, "after.log"), "w", encoding="utf-8") as handle:
+            variants = [("after, rate limit off", production_config(LOG_RATE_LIMIT=0.0)),
+                        ("after (production defaults)", production_config())]
+            results = []
+            for label, settings in variants:
+                pipeline = configure_logging(settings)
+                pipeline.listener.handlers[0].setStream(SlowFile(handle, delay))
+                results.append((label, measure(turn_after, logger, args.requests)))
+                flush_started = time.perf_counter()
+                pipeline.stop()
+                results.append(("  listener drain after the run (s)", time.perf_counter() - flush_started))
+
+    print(f"{args.requests} requests, sink delay {args.sink_delay_ms:g} ms per write")
+    print(f"{'before (basicConfig, f-strings, dumps)':<40} {before * 1e6:9.1f} us/request")
+    for label, value in results:
+        if label.startswith("  "):
+            print(f"{label:<40} {value:9.3f}")
+        else:
+            print(f"{label:<40} {value * 1e6:9.1f} us/request  ({before / value:.1f}x less)")
+
+
+if __name__ == "__main__":
+    main()
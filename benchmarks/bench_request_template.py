@@ -0,0 +1,81 @@
+"""
+Micro-benchmark: per-turn cost of building the upstream request body.
+
+Compares the previous path (rebuild the payload dict, including the Azure
+Search `data_sources` block, then serialize with stdlib json as aiohttp's
+`json=` does) with the precompiled template spliced with the turn's
+messages, using each available codec.
+
+Usage:
+    python benchmarks/bench_request_template.py [--turns 12] [--repeat 20000]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import codec  # noqa: E402
+from request_template import RequestTemplate, azure_search_data_source  # noqa: E402
+
+
+def sample_messages(turns: int):
+    messages = []
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"Вопрос {i}: как расторгнуть договор аренды квартиры досрочно?"})
+        messages.append({"role": "assistant", "content": f"Ответ {i}: договор можно расторгнуть по соглашению сторон " * 4})
+    messages.append({"role": "user", "content": "А если арендодатель против?"})
+    return messages
+
+
+def legacy_body(messages):
+    """The payload as it was assembled on every turn before templates."""
+    endpoint, deployment = "https://example.openai.azure.com", "gpt-4o"
+    api_url = f"{endpoint}/openai/deployments/{deployment}/chat/completions?api-version=2024-10-21"
+    headers = {"api-key": "key", "Content-Type": "application/json"}
+    request_body = {
+        "messages": [{"role": m["role"], "content": m["content"]} for m in messages],
+        "stream": False,
+        "max_tokens": 500,
+        "temperature": 0.7,
+    }
+    request_body["data_sources"] = [azure_search_data_source("https://search.example.net", "search-key", "legal-index")]
+    return api_url, headers, json.dumps(request_body).encode("utf-8")
+
+
+def bench(label, fn, repeat):
+    fn()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    elapsed = time.perf_counter() - started
+    per_call = elapsed / repeat * 1e6
+    print(f"{label:<32} {per_call:8.2f} us/turn")
+    return per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--turns", type=int, default=12, help="Conversation turns in the history")
+    parser.add_argument("--repeat", type=int, default=20000, help="Iterations per variant")
+    args = parser.parse_args()
+
+    messages = sample_messages(args.turns)
+    print(f"{len(messages)} messages, {len(legacy_body(messages)[2])} byte body, {args.repeat} iterations\n")
+
+    baseline = bench("legacy dict + json", lambda: legacy_body(messages), args.repeat)
+    for name in codec.CODECS:
+        codec.use_codec(name)
+        template = RequestTemplate(data_sources=[
+            azure_search_data_source("https://search.example.net", "search-key", "legal-index")
+        ])
+        assert json.loads(template.render(messages)) == json.loads(legacy_body(messages)[2])
+        cost = bench(f"template + {name}", lambda: template.render(messages), args.repeat)
+        print(f"{'':<32} {baseline / cost:8.2f}x faster")
+
+
+if __name__ == "__main__":
+    main()
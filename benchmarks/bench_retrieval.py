@@ -0,0 +1,79 @@
+"""
+Micro-benchmark: query latency of the local hybrid retrieval index.
+
+Builds a synthetic corpus (Russian-like vocabulary, embeddings with a
+low-rank structure like real text embeddings) and times BM25, vector
+search with and without the coarse PCA stage, and the fused hybrid query.
+
+Usage:
+    python benchmarks/bench_retrieval.py [--chunks 30000] [--dimensions 1536] [--repeat 200]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from retrieval import LocalIndex, write_index  # noqa: E402
+
+
+def synthetic_corpus(chunks: int, dimensions: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    words = [f"слово{i}" for i in range(20000)]
+    weights = 1.0 / np.arange(1, len(words) + 1)  # Zipf-like term frequencies
+    pick = random.Random(seed)
+    records = [
+        {"id": str(i), "title": f"Документ {i // 20}", "filepath": f"doc{i // 20}.pdf",
+         "content": " ".join(pick.choices(words, weights=weights, k=180))}
+        for i in range(chunks)
+    ]
+    latent = rng.normal(size=(chunks, 128)).astype(np.float32) * np.linspace(3, 0.2, 128, dtype=np.float32)
+    embeddings = latent @ rng.normal(size=(128, dimensions)).astype(np.float32)
+    embeddings += 0.3 * rng.normal(size=embeddings.shape).astype(np.float32)
+    return records, embeddings
+
+
+def bench(label, fn, repeat):
+    fn()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    per_call = (time.perf_counter() - started) / repeat * 1e3
+    print(f"{label:<32} {per_call:8.3f} ms/query")
+    return per_call
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--chunks", type=int, default=30000, help="Chunks in the synthetic corpus")
+    parser.add_argument("--dimensions", type=int, default=1536, help="Embedding dimensions")
+    parser.add_argument("--repeat", type=int, default=200, help="Queries per variant")
+    args = parser.parse_args()
+
+    records, embeddings = synthetic_corpus(args.chunks, args.dimensions)
+    with tempfile.TemporaryDirectory() as path:
+        started = time.perf_counter()
+        manifest = write_index(path, records, embeddings)
+        print(f"{manifest['chunks']} chunks, {manifest['terms']} terms, {manifest['dimensions']} dimensions, "
+              f"built in {time.perf_counter() - started:.1f}s\n")
+        index = LocalIndex(path)
+        query_text = "слово3 слово17 слово250 слово4000"
+        query_vector = embeddings[7] + 0.5 * np.random.default_rng(1).normal(size=args.dimensions)
+
+        bench("bm25", lambda: index.bm25(query_text), args.repeat)
+        bench("vector (coarse + rerank)", lambda: index.nearest(query_vector), args.repeat)
+        coarse, index.coarse = index.coarse, None
+        bench("vector (brute force)", lambda: index.nearest(query_vector), args.repeat)
+        index.coarse = coarse
+        bench("hybrid (rrf, top 10)", lambda: index.search(query_text, query_vector, 10), args.repeat)
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
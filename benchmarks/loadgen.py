@@ -0,0 +1,255 @@
+"""
+Open-loop load generator for the service.
+
+Requests are sent at a fixed arrival rate (evenly spaced, or Poisson with
+--poisson) regardless of how fast the server answers, and each latency is
+measured from the request's scheduled start. A slow server therefore
+shows up as latency rather than as a lower request rate (no coordinated
+omission). Requests that would exceed --max-in-flight are counted as
+dropped instead of being queued in the client.
+
+Scenarios, mixed by weight with --mix:
+
+    chat         POST /chat (Azure Search grounded, JSON answer)
+    chat_stream  POST /chat with "stream": true (TTFB = first body chunk)
+    speech       POST /chat/speech-stream (the avatar's sentence stream)
+    simple       POST /simple-chat
+    config       GET /config
+    pages        GET /, /chat, /chat-simple
+
+Questions are unique per request unless --question-pool is set, so the
+answer cache does not short-circuit the upstream.
+
+Usage:
+    python benchmarks/loadgen.py --base-url http://127.0.0.1:8000 [--rate 20] [--duration 30]
+        [--mix chat=3,chat_stream=3,speech=2,simple=1,config=1,pages=1]
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import aiohttp
+
+DEFAULT_MIX = "chat=3,chat_stream=3,speech=2,simple=1,config=1,pages=1"
+
+QUESTIONS = [
+    "Какой срок принятия наследства?",
+    "Как расторгнуть договор аренды досрочно?",
+    "Сколько длится испытательный срок при приёме на работу?",
+    "Можно ли вернуть товар надлежащего качества?",
+    "Как оформить налоговый вычет за лечение?",
+    "Что делать, если работодатель задерживает зарплату?",
+]
+
+PAGES = ("/", "/chat", "/chat-simple")
+
+
+def parse_mix(spec: str) -> List[Tuple[str, float]]:
+    """Scenario weights from `name=weight,...`."""
+    mix = []
+    for part in spec.split(","):
+        name, _, weight = part.strip().partition("=")
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario {name!r}; expected one of {', '.join(SCENARIOS)}")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def percentile(values: Sequence[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of unsorted values, or None if empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100.0 * len(ordered)) - 1))]
+
+
+class ScenarioResult:
+    """Outcomes of one scenario's requests."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: List[float] = []
+        self.ttfbs: List[float] = []
+        self.statuses: Dict[str, int] = {}
+        self.dropped = 0
+
+    def record(self, status: str, latency: float, ttfb: Optional[float]) -> None:
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if status == "200":
+            self.latencies.append(latency)
+            if ttfb is not None:
+                self.ttfbs.append(ttfb)
+
+    def summary(self, duration: float) -> Dict[str, object]:
+        sent = sum(self.statuses.values())
+        ok = self.statuses.get("200", 0)
+
+        def ms(value: Optional[float]) -> Optional[float]:
+            return None if value is None else round(value * 1000, 1)
+        return {
+            "scenario": self.name,
+            "sent": sent,
+            "ok": ok,
+            "errors": {status: count for status, count in self.statuses.items() if status != "200"},
+            "dropped": self.dropped,
+            "rps": round(ok / duration, 2) if duration else None,
+            "p50_ms": ms(percentile(self.latencies, 50)),
+            "p95_ms": ms(percentile(self.latencies, 95)),
+            "p99_ms": ms(percentile(self.latencies, 99)),
+            "ttfb_p50_ms": ms(percentile(self.ttfbs, 50)),
+            "ttfb_p95_ms": ms(percentile(self.ttfbs, 95)),
+            "ttfb_p99_ms": ms(percentile(self.ttfbs, 99)),
+        }
+
+
+class LoadGenerator:
+    """Drives the scenario mix against one base URL."""
+
+    def __init__(self, base_url: str, mix: List[Tuple[str, float]], question_pool: int = 0,
+                 timeout: float = 60.0, seed: int = 0):
+        self.base_url = base_url.rstrip("/")
+        self.mix = mix
+        self.question_pool = question_pool
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.sequence = 0
+
+    def question(self) -> str:
+        self.sequence += 1
+        if self.question_pool:
+            return QUESTIONS[self.rng.randrange(min(self.question_pool, len(QUESTIONS)))]
+        # Unique wording, so every turn reaches the upstream
+        return f"{self.rng.choice(QUESTIONS)} (вопрос {self.sequence})"
+
+    def request_for(self, scenario: str) -> Tuple[str, str, Optional[dict]]:
+        """(method, path, JSON body) of a scenario's next request."""
+        if scenario == "chat":
+            return "POST", "/chat", {"messages": [{"role": "user", "content": self.question()}]}
+        if scenario == "chat_stream":
+            return "POST", "/chat", {"messages": [{"role": "user", "content": self.question()}], "stream": True}
+        if scenario == "speech":
+            return "POST", "/chat/speech-stream", {"messages": [{"role": "user", "content": self.question()}]}
+        if scenario == "simple":
+            return "POST", "/simple-chat", {"message": self.question()}
+        if scenario == "config":
+            return "GET", "/config", None
+        return "GET", self.rng.choice(PAGES), None
+
+    async def one(self, session: aiohttp.ClientSession, scenario: str, scheduled: float,
+                  result: ScenarioResult) -> None:
+        method, path, body = self.request_for(scenario)
+        ttfb = None
+        try:
+            async with session.request(method, self.base_url + path, json=body) as response:
+                async for _ in response.content.iter_any():
+                    if ttfb is None:
+                        ttfb = time.perf_counter() - scheduled
+                status = str(response.status)
+        except asyncio.TimeoutError:
+            status = "timeout"
+        except aiohttp.ClientError as e:
+            status = type(e).__name__
+        result.record(status, time.perf_counter() - scheduled, ttfb)
+
+    async def run(self, rate: float, duration: float, max_in_flight: int = 1000,
+                  poisson: bool = False) -> Dict[str, ScenarioResult]:
+        """Send `rate` requests per second for `duration` seconds and wait for them."""
+        results = {name: ScenarioResult(name) for name, _ in self.mix}
+        names = [name for name, _ in self.mix]
+        weights = [weight for _, weight in self.mix]
+        tasks = set()
+        connector = aiohttp.TCPConnector(limit=max_in_flight)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            started = time.perf_counter()
+            scheduled = started
+            while scheduled - started < duration:
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                scenario = self.rng.choices(names, weights)[0]
+                if len(tasks) >= max_in_flight:
+                    results[scenario].dropped += 1
+                else:
+                    task = asyncio.ensure_future(self.one(session, scenario, scheduled, results[scenario]))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                scheduled += self.rng.expovariate(rate) if poisson else 1.0 / rate
+            if tasks:
+                await asyncio.gather(*tasks)
+        return results
+
+
+def format_report(rows: List[Dict[str, object]]) -> str:
+    """Fixed-width table of summaries (rows may carry `run` and `workers` columns)."""
+    columns = [("run", 8), ("workers", 7), ("scenario", 12), ("sent", 6), ("ok", 6), ("rps", 7), ("p50_ms", 8),
+               ("p95_ms", 8), ("p99_ms", 8), ("ttfb_p50_ms", 11), ("ttfb_p95_ms", 11), ("ttfb_p99_ms", 11),
+               ("dropped", 7), ("errors", 0)]
+    columns = [(name, width) for name, width in columns if any(name in row for row in rows)]
+
+    def cell(value) -> str:
+        if value is None:
+            return "-"
+        if isinstance(value, dict):
+            return ",".join(f"{key}:{count}" for key, count in value.items()) or "-"
+        return str(value)
+    lines = ["  ".join(name.rjust(width) for name, width in columns)]
+    for row in rows:
+        lines.append("  ".join(cell(row.get(name)).rjust(width) for name, width in columns))
+    return "\n".join(lines)
+
+
+async def run_load(base_url: str, rate: float, duration: float, mix: str = DEFAULT_MIX,
+                   question_pool: int = 0, max_in_flight: int = 1000, poisson: bool = False,
+                   timeout: float = 60.0, seed: int = 0) -> List[Dict[str, object]]:
+    """Run one load test and return a summary per scenario plus an `all` row."""
+    generator = LoadGenerator(base_url, parse_mix(mix), question_pool, timeout, seed)
+    results = await generator.run(rate, duration, max_in_flight, poisson)
+    rows = [result.summary(duration) for result in results.values()]
+    combined = ScenarioResult("all")
+    for result in results.values():
+        combined.latencies += result.latencies
+        combined.ttfbs += result.ttfbs
+        combined.dropped += result.dropped
+        for status, count in result.statuses.items():
+            combined.statuses[status] = combined.statuses.get(status, 0) + count
+    rows.append(combined.summary(duration))
+    return rows
+
+
+SCENARIOS = ("chat", "chat_stream", "speech", "simple", "config", "pages")
+
+
+def add_load_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--rate", type=float, default=20.0, help="Requests per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of load")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Scenario weights, name=weight,...")
+    parser.add_argument("--question-pool", type=int, default=0,
+                        help="Repeat this many fixed questions (exercises the answer cache); 0 = unique")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="Client-side concurrency cap")
+    parser.add_argument("--poisson", action="store_true", help="Poisson arrivals instead of even spacing")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout (s)")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--json", help="Also write the summaries to this file")
+    add_load_arguments(parser)
+    args = parser.parse_args(argv)
+    rows = asyncio.run(run_load(args.base_url, args.rate, args.duration, args.mix, args.question_pool,
+                                args.max_in_flight, args.poisson, args.timeout, args.seed))
+    print(format_report(rows))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as handle:
+            json.dump(rows, handle, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
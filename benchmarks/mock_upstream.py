@@ -0,0 +1,225 @@
+"""
+Mock Azure OpenAI upstream for offline load tests.
+
+Emulates `/openai/deployments/{deployment}/chat/completions` in JSON and
+SSE streaming modes, the way the service calls it: Azure Search grounded
+requests (with `data_sources`) get `context.citations` and extra search
+latency, and a share of the calls can be throttled (429 with
+`retry-after-ms`) or fail (500). `/openai/deployments/{d}/embeddings`
+returns deterministic vectors for the local retrieval backend, the
+model list and empty index queries answer the service's health probes,
+and `/stats` reports what was served.
+
+Latencies are drawn from a distribution spec:
+
+    fixed:MS              always MS milliseconds
+    uniform:LO:HI         uniform between LO and HI ms
+    lognormal:MEDIAN:SIGMA
+                          log-normal with the given median (ms) and sigma,
+                          the usual shape of LLM response times
+
+Usage:
+    python benchmarks/mock_upstream.py [--port 9100] [--latency lognormal:600:0.5]
+        [--search-latency lognormal:400:0.6] [--tokens 60] [--token-interval-ms 15]
+        [--rate-429 0.0] [--rate-500 0.0] [--citations search]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import time
+from typing import Callable, Dict
+
+from aiohttp import web
+
+SAMPLE_ANSWER = ("Согласно статье 1154 Гражданского кодекса, наследство может быть принято в течение "
+                 "шести месяцев со дня открытия наследства [doc1]. Если срок пропущен, его можно "
+                 "восстановить в суде при наличии уважительных причин [doc2].")
+
+SAMPLE_CITATIONS = [
+    {"content": "Наследство может быть принято в течение шести месяцев со дня открытия наследства.",
+     "title": "Гражданский кодекс, статья 1154", "url": "", "filepath": "gk_part3.pdf", "chunk_id": "0"},
+    {"content": "Суд может восстановить срок, если наследник не знал и не должен был знать об открытии наследства.",
+     "title": "Гражданский кодекс, статья 1155", "url": "", "filepath": "gk_part3.pdf", "chunk_id": "1"},
+]
+
+
+def parse_distribution(spec: str, rng: random.Random) -> Callable[[], float]:
+    """Sampler of delays in seconds from a `kind:params` spec (see the module docstring)."""
+    kind, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(":") if value]
+    if kind == "fixed" and len(values) == 1:
+        return lambda: values[0] / 1000.0
+    if kind == "uniform" and len(values) == 2:
+        return lambda: rng.uniform(values[0], values[1]) / 1000.0
+    if kind == "lognormal" and len(values) == 2:
+        mu = math.log(values[0])
+        return lambda: rng.lognormvariate(mu, values[1]) / 1000.0
+    raise ValueError(f"Invalid latency distribution: {spec!r}")
+
+
+class MockUpstream:
+    """Request handlers and counters of the mock."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.rng = random.Random(args.seed)
+        self.latency = parse_distribution(args.latency, self.rng)
+        self.search_latency = parse_distribution(args.search_latency, self.rng)
+        self.tokens = args.tokens
+        self.token_interval = args.token_interval_ms / 1000.0
+        self.rate_429 = args.rate_429
+        self.rate_500 = args.rate_500
+        self.retry_after_ms = args.retry_after_ms
+        self.citations = args.citations
+        self.counters: Dict[str, int] = {"requests": 0, "streamed": 0, "grounded": 0, "throttled": 0, "failed": 0,
+                                         "aborted": 0, "embeddings": 0, "probes": 0, "in_flight": 0,
+                                         "max_in_flight": 0}
+        self.started = time.monotonic()
+
+    def answer_tokens(self):
+        words = SAMPLE_ANSWER.split(" ")
+        count = max(1, self.tokens)
+        return [(" " if i else "") + words[i % len(words)] for i in range(count)]
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.counters["requests"] += 1
+        roll = self.rng.random()
+        if roll < self.rate_429:
+            self.counters["throttled"] += 1
+            return web.json_response(
+                {"error": {"code": "429", "message": "Rate limit is exceeded. Try again later."}},
+                status=429, headers={"retry-after-ms": str(self.retry_after_ms),
+                                     "retry-after": str(max(1, math.ceil(self.retry_after_ms / 1000)))}
+            )
+        if roll < self.rate_429 + self.rate_500:
+            self.counters["failed"] += 1
+            return web.json_response({"error": {"code": "InternalServerError", "message": "Mock failure"}},
+                                     status=500)
+
+        grounded = "data_sources" in body
+        context = None
+        if self.citations == "always" or (self.citations == "search" and grounded):
+            context = {"citations": SAMPLE_CITATIONS, "intent": "[]"}
+        self.counters["in_flight"] += 1
+        self.counters["max_in_flight"] = max(self.counters["max_in_flight"], self.counters["in_flight"])
+        try:
+            delay = self.latency()
+            if grounded:
+                self.counters["grounded"] += 1
+                delay += self.search_latency()
+            if body.get("stream"):
+                self.counters["streamed"] += 1
+                return await self.stream(request, delay, context)
+            tokens = self.answer_tokens()
+            # The whole answer is generated before a JSON response is sent
+            await asyncio.sleep(delay + len(tokens) * self.token_interval)
+            message = {"role": "assistant", "content": "".join(tokens)}
+            if context:
+                message["context"] = context
+            return web.json_response({
+                "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()),
+                "model": request.match_info["deployment"],
+                "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 200, "completion_tokens": len(tokens), "total_tokens": 200 + len(tokens)},
+            })
+        finally:
+            self.counters["in_flight"] -= 1
+
+    async def stream(self, request: web.Request, delay: float, context) -> web.StreamResponse:
+        # Like Azure, the status line arrives once the prompt is processed,
+        # followed by the prompt filter results and the first delta
+        await asyncio.sleep(delay)
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+
+        async def send(chunk: dict) -> None:
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+        first = {"role": "assistant", "content": ""}
+        if context:
+            first["context"] = context
+        try:
+            await response.prepare(request)
+            await send({"choices": [], "prompt_filter_results": [{"prompt_index": 0, "content_filter_results": {}}]})
+            await send({"choices": [{"index": 0, "delta": first}]})
+            for token in self.answer_tokens():
+                await send({"choices": [{"index": 0, "delta": {"content": token}}]})
+                if self.token_interval:
+                    await asyncio.sleep(self.token_interval)
+            await send({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+        except ConnectionResetError:
+            # The service closed the stream early (client gone, deadline, hedge lost)
+            self.counters["aborted"] += 1
+        return response
+
+    async def embeddings(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        inputs = body.get("input") or []
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        self.counters["embeddings"] += 1
+        await asyncio.sleep(self.latency() / 10)
+        data = []
+        for index, text in enumerate(inputs):
+            seed = int.from_bytes(hashlib.blake2b(str(text).encode("utf-8"), digest_size=8).digest(), "little")
+            vector_rng = random.Random(seed)
+            data.append({"object": "embedding", "index": index,
+                         "embedding": [vector_rng.uniform(-1, 1) for _ in range(1536)]})
+        return web.json_response({"object": "list", "data": data})
+
+    async def models(self, request: web.Request) -> web.Response:
+        self.counters["probes"] += 1
+        return web.json_response({"object": "list", "data": [{"id": "gpt-4o", "object": "model"}]})
+
+    async def index_docs(self, request: web.Request) -> web.Response:
+        self.counters["probes"] += 1
+        index = request.match_info["index"]
+        return web.json_response({"@odata.context": f"{request.url.origin()}/indexes('{index}')/$metadata#docs(*)",
+                                  "value": []})
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({**self.counters, "uptime": round(time.monotonic() - self.started, 1)})
+
+
+def build_app(args: argparse.Namespace) -> web.Application:
+    mock = MockUpstream(args)
+    app = web.Application(client_max_size=16 * 1024 * 1024)
+    app.router.add_post("/openai/deployments/{deployment}/chat/completions", mock.chat_completions)
+    app.router.add_post("/openai/deployments/{deployment}/embeddings", mock.embeddings)
+    app.router.add_get("/openai/models", mock.models)
+    app.router.add_get("/indexes/{index}/docs", mock.index_docs)
+    app.router.add_get("/stats", mock.stats)
+    return app
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", default="lognormal:600:0.5", help="Time to the first token (the response headers)")
+    parser.add_argument("--search-latency", default="lognormal:400:0.6",
+                        help="Extra latency of Azure Search grounded calls")
+    parser.add_argument("--tokens", type=int, default=60, help="Tokens per answer")
+    parser.add_argument("--token-interval-ms", type=float, default=15.0, help="Delay between streamed tokens")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Share of calls throttled with 429")
+    parser.add_argument("--rate-500", type=float, default=0.0, help="Share of calls failing with 500")
+    parser.add_argument("--retry-after-ms", type=int, default=1000, help="Retry hint sent with 429")
+    parser.add_argument("--citations", choices=("search", "always", "never"), default="search",
+                        help="When answers carry context.citations")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    for spec in (args.latency, args.search_latency):
+        parse_distribution(spec, random.Random())
+    web.run_app(build_app(args), host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == "__main__":
+    main()
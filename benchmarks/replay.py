@@ -0,0 +1,255 @@
+"""
+Replay captured chat traffic against a target and compare latencies.
+
+Reads the JSONL files written with CAPTURE_ENABLED (files or directories,
+several workers' files are merged by arrival time) and re-issues every
+request with its captured method, path, headers and body, in the captured
+order. Requests keep their captured inter-arrival times, compressed by
+--speed (2 = twice as fast); --speed 0 sends them back to back with at
+most --concurrency in flight. Latency is measured from each request's
+scheduled time, so a target that falls behind shows it.
+
+Captured session ids are mapped to the ids the target returns for them,
+so replayed sessions build up history like the originals did.
+
+With --local the mock upstream and the app are started here (as in
+bench_load.py) and nothing leaves the machine, so runs before and after a
+change can be compared offline.
+
+The report has the replayed latency distribution per path (streamed and
+JSON /chat separately) next to the one recorded in the capture.
+
+Usage:
+    python benchmarks/replay.py captures/ --target http://127.0.0.1:8000 [--speed 1]
+    python benchmarks/replay.py captures/capture-123-20250101-120000.jsonl --local [--speed 4]
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_load import server_command, server_env, stop, wait_until_up  # noqa: E402
+from loadgen import ScenarioResult, format_report  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_capture(paths: List[str], limit: int = 0) -> List[dict]:
+    """Capture records from files and directories, ordered by arrival time."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "capture-*.jsonl"))))
+        else:
+            files.append(path)
+    records = []
+    for name in files:
+        with open(name, encoding="utf-8") as handle:
+            for line in handle:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by a crash
+                if isinstance(record, dict) and "ts" in record and "path" in record:
+                    records.append(record)
+    records.sort(key=lambda record: record["ts"])
+    return records[:limit] if limit else records
+
+
+def scenario_of(record: dict) -> str:
+    body = record.get("body")
+    streamed = isinstance(body, dict) and body.get("stream")
+    return f"{record['path']} stream" if streamed else record["path"]
+
+
+class Replayer:
+    """Re-issues capture records against one base URL."""
+
+    def __init__(self, base_url: str, timeout: float = 120.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        # captured session id -> the id the target gave that session
+        self.sessions: Dict[str, str] = {}
+
+    def prepare(self, record: dict):
+        body = record.get("body")
+        captured_session = None
+        if isinstance(body, dict) and body.get("session_id"):
+            captured_session = body["session_id"]
+            if captured_session in self.sessions:
+                body = {**body, "session_id": self.sessions[captured_session]}
+        url = self.base_url + record["path"]
+        if record.get("query"):
+            url = f"{url}?{record['query']}"
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8") if body is not None else None
+        headers = dict(record.get("headers") or {})
+        if data is not None:
+            headers.setdefault("content-type", "application/json")
+        return url, headers, data, captured_session
+
+    async def one(self, session: aiohttp.ClientSession, record: dict, scheduled: float,
+                  result: ScenarioResult) -> None:
+        url, headers, data, captured_session = self.prepare(record)
+        ttfb = None
+        chunks = []
+        try:
+            async with session.request(record.get("method", "POST"), url, headers=headers, data=data) as response:
+                async for chunk in response.content.iter_any():
+                    if ttfb is None:
+                        ttfb = time.perf_counter() - scheduled
+                    if captured_session and len(chunks) < 64:
+                        chunks.append(chunk)
+                status = str(response.status)
+                if captured_session and captured_session not in self.sessions:
+                    self.remember_session(captured_session, response, b"".join(chunks))
+        except asyncio.TimeoutError:
+            status = "timeout"
+        except aiohttp.ClientError as e:
+            status = type(e).__name__
+        result.record(status, time.perf_counter() - scheduled, ttfb)
+
+    def remember_session(self, captured: str, response: aiohttp.ClientResponse, body: bytes) -> None:
+        session_id = response.headers.get("X-Session-Id")
+        if not session_id and response.content_type == "application/json":
+            try:
+                session_id = json.loads(body).get("session_id")
+            except (ValueError, AttributeError):
+                session_id = None
+        if session_id:
+            self.sessions[captured] = session_id
+
+    async def run(self, records: List[dict], speed: float = 1.0, concurrency: int = 32,
+                  max_in_flight: int = 1000) -> Dict[str, ScenarioResult]:
+        results: Dict[str, ScenarioResult] = {}
+        for record in records:
+            key = scenario_of(record)
+            results.setdefault(key, ScenarioResult(key))
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        connector = aiohttp.TCPConnector(limit=max(concurrency, max_in_flight))
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            if speed <= 0:
+                semaphore = asyncio.Semaphore(concurrency)
+
+                async def bounded(record):
+                    async with semaphore:
+                        await self.one(session, record, time.perf_counter(), results[scenario_of(record)])
+                await asyncio.gather(*(bounded(record) for record in records))
+                return results
+
+            tasks = set()
+            first = records[0]["ts"] if records else 0.0
+            started = time.perf_counter()
+            for record in records:
+                scheduled = started + (record["ts"] - first) / speed
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                result = results[scenario_of(record)]
+                if len(tasks) >= max_in_flight:
+                    result.dropped += 1
+                    continue
+                task = asyncio.ensure_future(self.one(session, record, scheduled, result))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        return results
+
+
+def captured_results(records: List[dict]) -> Dict[str, ScenarioResult]:
+    """The latencies recorded in the capture, in the same shape as a replay."""
+    results: Dict[str, ScenarioResult] = {}
+    for record in records:
+        key = scenario_of(record)
+        result = results.setdefault(key, ScenarioResult(key))
+        ttfb = record.get("ttfb_ms")
+        result.record(str(record.get("status")), record.get("duration_ms", 0) / 1000.0,
+                      ttfb / 1000.0 if ttfb is not None else None)
+    return results
+
+
+def report_rows(run: str, results: Dict[str, ScenarioResult], duration: float) -> List[dict]:
+    rows = []
+    for key in sorted(results):
+        rows.append({"run": run, **results[key].summary(duration)})
+    return rows
+
+
+def replay(records: List[dict], base_url: str, speed: float, concurrency: int, max_in_flight: int,
+           timeout: float) -> List[dict]:
+    """Replay `records` and return report rows for the capture and the replay."""
+    span = (records[-1]["ts"] - records[0]["ts"]) if records else 0.0
+    replayer = Replayer(base_url, timeout)
+    started = time.perf_counter()
+    results = asyncio.run(replayer.run(records, speed, concurrency, max_in_flight))
+    elapsed = time.perf_counter() - started
+    return report_rows("captured", captured_results(records), span) + report_rows("replayed", results, elapsed)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("capture", nargs="+", help="Capture files or directories")
+    parser.add_argument("--target", default="http://127.0.0.1:8000", help="Base URL of the app under test")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Replay speed; 1 keeps the captured timing, 0 sends back to back")
+    parser.add_argument("--concurrency", type=int, default=32, help="In-flight requests with --speed 0")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="Client-side cap, beyond it requests drop")
+    parser.add_argument("--limit", type=int, default=0, help="Replay only the first N requests")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout (s)")
+    parser.add_argument("--local", action="store_true", help="Start the mock upstream and the app here")
+    parser.add_argument("--server", choices=("gunicorn", "uvicorn"), default="gunicorn")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--mock-port", type=int, default=9100)
+    parser.add_argument("--mock-args", default="", help="Extra arguments for mock_upstream.py")
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--json", help="Also write the report rows to this file")
+    args = parser.parse_args(argv)
+
+    records = load_capture(args.capture, args.limit)
+    if not records:
+        parser.error("no capture records found")
+    print(f"Replaying {len(records)} requests spanning {records[-1]['ts'] - records[0]['ts']:.1f}s "
+          f"at speed {args.speed:g}", file=sys.stderr)
+
+    processes = []
+    try:
+        base_url = args.target
+        if args.local:
+            mock = subprocess.Popen([sys.executable, os.path.join(ROOT, "benchmarks", "mock_upstream.py"),
+                                     "--port", str(args.mock_port), *shlex.split(args.mock_args)])
+            processes.append(mock)
+            wait_until_up(f"http://127.0.0.1:{args.mock_port}/stats", args.startup_timeout, mock)
+            metrics_dir = tempfile.mkdtemp(prefix="replay-metrics-")
+            server = subprocess.Popen(server_command(args.server, args.workers, args.port), cwd=ROOT,
+                                      env=server_env(args.mock_port, metrics_dir),
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            processes.append(server)
+            base_url = f"http://127.0.0.1:{args.port}"
+            wait_until_up(f"{base_url}/ready", args.startup_timeout, server)
+        rows = replay(records, base_url, args.speed, args.concurrency, args.max_in_flight, args.timeout)
+    finally:
+        for process in reversed(processes):
+            stop(process)
+
+    print(format_report(rows))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as handle:
+            json.dump({"speed": args.speed, "requests": len(records), "results": rows}, handle,
+                      ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Stand-in Redis-protocol (RESP2) server for testing the shared cache offline.
+
+Implements the commands `cache_backend.RedisBackend` uses, with Redis
+semantics: PING, AUTH, SELECT, GET, MGET, SET (EX/PX/NX/XX), DEL/UNLINK,
+EXISTS, SCAN (MATCH/COUNT), DBSIZE, FLUSHDB and QUIT. Keys expire lazily
+on access and in a periodic sweep. --latency-ms delays every reply, like
+the round trip to a managed cache in another zone.
+
+Usage:
+    python benchmarks/resp_server.py [--port 6399] [--password secret] [--latency-ms 0]
+
+Then run the app with CACHE_BACKEND=redis CACHE_REDIS_URL=redis://:secret@127.0.0.1:6399/0.
+"""
+
+import argparse
+import asyncio
+import fnmatch
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class RespServer:
+    """In-memory key/value store behind the Redis protocol."""
+
+    def __init__(self, password: Optional[str] = None, latency: float = 0.0):
+        self.password = password
+        self.latency = latency
+        self.databases: Dict[int, Dict[bytes, Tuple[bytes, Optional[float]]]] = {}
+        self.commands = 0
+        self.clients = 0
+
+    def db(self, index: int) -> Dict[bytes, Tuple[bytes, Optional[float]]]:
+        return self.databases.setdefault(index, {})
+
+    @staticmethod
+    def alive(db: Dict[bytes, Tuple[bytes, Optional[float]]], key: bytes) -> Optional[bytes]:
+        item = db.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= time.monotonic():
+            del db[key]
+            return None
+        return item[0]
+
+    def sweep(self) -> None:
+        now = time.monotonic()
+        for db in self.databases.values():
+            for key in [key for key, (_, expires) in db.items() if expires is not None and expires <= now]:
+                del db[key]
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.clients += 1
+        state = {"db": 0, "authenticated": self.password is None}
+        try:
+            while True:
+                command = await read_command(reader)
+                if command is None:
+                    break
+                self.commands += 1
+                reply = self.execute(command, state)
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                writer.write(encode(reply))
+                await writer.drain()
+                if command[0].upper() == b"QUIT":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def execute(self, command: List[bytes], state: dict):
+        name = command[0].upper().decode("ascii", "replace")
+        args = command[1:]
+        if name == "AUTH":
+            if self.password is None:
+                return Error("ERR AUTH <password> called without any password configured")
+            if args and args[-1].decode("utf-8") == self.password:
+                state["authenticated"] = True
+                return Status("OK")
+            return Error("WRONGPASS invalid username-password pair or user is disabled.")
+        if not state["authenticated"]:
+            return Error("NOAUTH Authentication required.")
+        if name == "PING":
+            return Status("PONG") if not args else args[0]
+        if name == "QUIT":
+            return Status("OK")
+        if name == "SELECT":
+            state["db"] = int(args[0])
+            return Status("OK")
+        db = self.db(state["db"])
+        if name == "GET":
+            return self.alive(db, args[0])
+        if name == "MGET":
+            return [self.alive(db, key) for key in args]
+        if name == "SET":
+            return self.set(db, args)
+        if name in ("DEL", "UNLINK"):
+            removed = 0
+            for key in args:
+                if self.alive(db, key) is not None:
+                    del db[key]
+                    removed += 1
+            return removed
+        if name == "EXISTS":
+            return sum(1 for key in args if self.alive(db, key) is not None)
+        if name == "SCAN":
+            return self.scan(db, args)
+        if name == "DBSIZE":
+            self.sweep()
+            return len(db)
+        if name == "FLUSHDB":
+            db.clear()
+            return Status("OK")
+        return Error(f"ERR unknown command '{name}'")
+
+    def set(self, db, args: List[bytes]):
+        key, value = args[0], args[1]
+        expires = None
+        only_new = only_existing = False
+        options = [arg.upper() for arg in args[2:]]
+        position = 0
+        while position < len(options):
+            option = options[position]
+            if option in (b"EX", b"PX"):
+                amount = int(args[2 + position + 1])
+                expires = time.monotonic() + (amount if option == b"EX" else amount / 1000.0)
+                position += 2
+                continue
+            if option == b"NX":
+                only_new = True
+            elif option == b"XX":
+                only_existing = True
+            else:
+                return Error("ERR syntax error")
+            position += 1
+        exists = self.alive(db, key) is not None
+        if (only_new and exists) or (only_existing and not exists):
+            return None
+        db[key] = (value, expires)
+        return Status("OK")
+
+    def scan(self, db, args: List[bytes]):
+        cursor = int(args[0])
+        pattern = b"*"
+        count = 10
+        for position in range(1, len(args) - 1, 2):
+            option = args[position].upper()
+            if option == b"MATCH":
+                pattern = args[position + 1]
+            elif option == b"COUNT":
+                count = int(args[position + 1])
+        # Cursor = position in the sorted key list; good enough for a stand-in
+        keys = sorted(db)
+        batch = keys[cursor:cursor + count]
+        following = cursor + count if cursor + count < len(keys) else 0
+        matched = [key for key in batch
+                   if self.alive(db, key) is not None
+                   and fnmatch.fnmatchcase(key.decode("latin-1"), pattern.decode("latin-1"))]
+        return [str(following).encode("ascii"), matched]
+
+
+class Status(str):
+    """Simple string reply."""
+
+
+class Error(str):
+    """Error reply."""
+
+
+async def read_command(reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        # Inline command (redis-cli, telnet)
+        return line.strip().split()
+    args = []
+    for _ in range(int(line[1:-2])):
+        header = await reader.readuntil(b"\r\n")
+        size = int(header[1:-2])
+        args.append((await reader.readexactly(size + 2))[:-2])
+    return args
+
+
+def encode(reply) -> bytes:
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, Error):
+        return f"-{reply}\r\n".encode("utf-8")
+    if isinstance(reply, Status):
+        return f"+{reply}\r\n".encode("utf-8")
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, bytes):
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+    if isinstance(reply, list):
+        return b"*%d\r\n" % len(reply) + b"".join(encode(item) for item in reply)
+    raise TypeError(f"Cannot encode {type(reply).__name__}")
+
+
+async def start(host: str = "127.0.0.1", port: int = 6399, password: Optional[str] = None,
+                latency: float = 0.0) -> Tuple[RespServer, asyncio.AbstractServer]:
+    """Start a stand-in server on the running loop (port 0 picks a free port)."""
+    resp = RespServer(password, latency)
+    server = await asyncio.start_server(resp.serve, host, port)
+    return resp, server
+
+
+async def main(args: argparse.Namespace) -> None:
+    resp, server = await start(args.host, args.port, args.password, args.latency_ms / 1000.0)
+    print(f"RESP stand-in listening on {args.host}:{args.port}", flush=True)
+    async with server:
+        while True:
+            await asyncio.sleep(1.0)
+            resp.sweep()
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6399)
+    parser.add_argument("--password", help="Require AUTH with this password")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Delay before every reply")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(parse_args()))
+    except KeyboardInterrupt:
+        pass
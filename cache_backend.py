@@ -0,0 +1,753 @@
+"""
+Shared cache backends: one cache for all workers of a host, or all nodes.
+
+gunicorn runs four workers per instance, and the per-worker caches
+(answer_cache.py, the query embeddings) are duplicated and warmed in every
+worker and never shared between App Service instances. `TieredCache` puts
+a small in-process L1 in front of a shared L2 backend:
+
+    memory  `MemoryBackend`, per worker; only used as the L1 (the default
+            CACHE_BACKEND=memory keeps the per-worker caches as they were)
+    sqlite  `SQLiteBackend`, a WAL-mode SQLite file shared by the workers
+            of one host
+    redis   `RedisBackend`, any server speaking the Redis protocol (RESP),
+            e.g. Azure Cache for Redis, shared by every node; a stand-in
+            server for tests is `benchmarks/resp_server.py`
+
+Keys are namespaced as `<prefix>:v<format>:<kind>:<key>`, so several apps
+can share a server and a format change never reads old entries. Values are
+packed with a compact binary format (`pack`/`unpack`): typed tags, varint
+lengths and integers, raw bytes for vectors, and zlib for structured
+values above 1 KiB.
+
+The L1 keeps an entry for at most CACHE_L1_TTL seconds, which bounds how
+long another worker's invalidation takes to be seen. A cache never fails a
+request: errors and timeouts of the L2 are counted and read as misses, and
+an unreachable Redis is skipped for a few seconds instead of being retried
+on every call.
+"""
+
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import ssl
+import struct
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import unquote, urlsplit
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+_COMPRESSED = 0x80
+COMPRESS_THRESHOLD = 1024
+
+# Value tags of the binary format
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _STR, _BYTES, _LIST, _DICT = range(9)
+_DOUBLE = struct.Struct("<d")
+
+# Longer keys are replaced by their hash
+MAX_KEY_LENGTH = 200
+
+# How often expired rows are purged from SQLite
+PURGE_INTERVAL = 60.0
+
+
+class SerializationError(ValueError):
+    """A value cannot be packed, or packed data is malformed."""
+
+
+def _write_varint(value: int, out: bytearray) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _pack(value: Any, out: bytearray) -> None:
+    # bool before int: True is an int
+    if value is None:
+        out.append(_NONE)
+    elif value is True:
+        out.append(_TRUE)
+    elif value is False:
+        out.append(_FALSE)
+    elif isinstance(value, int):
+        out.append(_INT)
+        _write_varint(value << 1 if value >= 0 else ((-value) << 1) - 1, out)
+    elif isinstance(value, float):
+        out.append(_FLOAT)
+        out += _DOUBLE.pack(value)
+    elif isinstance(value, str):
+        data = value.encode("utf-8")
+        out.append(_STR)
+        _write_varint(len(data), out)
+        out += data
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        out.append(_BYTES)
+        _write_varint(len(value), out)
+        out += value
+    elif isinstance(value, (list, tuple)):
+        out.append(_LIST)
+        _write_varint(len(value), out)
+        for item in value:
+            _pack(item, out)
+    elif isinstance(value, dict):
+        out.append(_DICT)
+        _write_varint(len(value), out)
+        for key, item in value.items():
+            _pack(key, out)
+            _pack(item, out)
+    else:
+        raise SerializationError(f"Cannot pack {type(value).__name__}")
+
+
+def pack(value: Any) -> bytes:
+    """Encode None, bool, int, float, str, bytes and lists/dicts of them."""
+    out = bytearray()
+    _pack(value, out)
+    # Raw bytes are vectors and the like, which do not compress
+    if len(out) >= COMPRESS_THRESHOLD and not isinstance(value, (bytes, bytearray, memoryview)):
+        compressed = zlib.compress(bytes(out), 1)
+        if len(compressed) < len(out):
+            return bytes((FORMAT_VERSION | _COMPRESSED,)) + compressed
+    return bytes((FORMAT_VERSION,)) + out
+
+
+class _Reader:
+    __slots__ = ("data", "pos")
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def varint(self) -> int:
+        result = shift = 0
+        while True:
+            byte = self.data[self.pos]
+            self.pos += 1
+            result |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+
+    def take(self, size: int) -> bytes:
+        end = self.pos + size
+        if end > len(self.data):
+            raise SerializationError("Truncated value")
+        chunk = self.data[self.pos:end]
+        self.pos = end
+        return chunk
+
+    def value(self) -> Any:
+        tag = self.data[self.pos]
+        self.pos += 1
+        if tag == _NONE:
+            return None
+        if tag == _TRUE:
+            return True
+        if tag == _FALSE:
+            return False
+        if tag == _INT:
+            zigzag = self.varint()
+            return zigzag >> 1 if not zigzag & 1 else -((zigzag + 1) >> 1)
+        if tag == _FLOAT:
+            return _DOUBLE.unpack(self.take(8))[0]
+        if tag == _STR:
+            return self.take(self.varint()).decode("utf-8")
+        if tag == _BYTES:
+            return self.take(self.varint())
+        if tag == _LIST:
+            return [self.value() for _ in range(self.varint())]
+        if tag == _DICT:
+            result = {}
+            for _ in range(self.varint()):
+                key = self.value()
+                result[key] = self.value()
+            return result
+        raise SerializationError(f"Unknown tag {tag}")
+
+
+def unpack(data: bytes) -> Any:
+    """Decode bytes produced by `pack`."""
+    if not data:
+        raise SerializationError("Empty value")
+    header = data[0]
+    if header & ~_COMPRESSED != FORMAT_VERSION:
+        raise SerializationError(f"Unsupported format {header & ~_COMPRESSED}")
+    try:
+        body = zlib.decompress(data[1:]) if header & _COMPRESSED else bytes(data[1:])
+        reader = _Reader(body)
+        value = reader.value()
+    except (IndexError, UnicodeDecodeError, zlib.error, TypeError) as e:
+        raise SerializationError(f"Malformed value: {str(e)}") from e
+    if reader.pos != len(body):
+        raise SerializationError("Trailing data")
+    return value
+
+
+class Namespace:
+    """Builds the shared keys of one application and format version."""
+
+    def __init__(self, prefix: str, version: int = FORMAT_VERSION):
+        self.prefix = prefix
+        self.version = version
+
+    def prefix_of(self, kind: str) -> str:
+        """Common prefix of every key of a kind (`answer`, `embedding`, ...)."""
+        return f"{self.prefix}:v{self.version}:{kind}:"
+
+    def key(self, kind: str, key: str) -> str:
+        if len(key) > MAX_KEY_LENGTH:
+            key = hashlib.blake2b(key.encode("utf-8"), digest_size=20).hexdigest()
+        return self.prefix_of(kind) + key
+
+
+class CacheBackend:
+    """Byte-valued store with per-entry TTL; misses and errors read as None."""
+
+    name = "base"
+
+    async def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    async def get_many(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        return [await self.get(key) for key in keys]
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        raise NotImplementedError
+
+    async def set_many(self, items: Sequence[Tuple[str, bytes]], ttl: float) -> None:
+        for key, value in items:
+            await self.set(key, value, ttl)
+
+    async def delete(self, key: str) -> bool:
+        raise NotImplementedError
+
+    async def clear(self, prefix: str) -> int:
+        """Remove every key starting with `prefix`. Returns the number removed."""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, object]:
+        return {"backend": self.name}
+
+
+class MemoryBackend(CacheBackend):
+    """In-process LRU bounded by entries and bytes."""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(self, key: str) -> Optional[bytes]:
+        item = self._entries.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        if item[1] <= time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        size = len(key) + len(value)
+        if ttl <= 0 or size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    async def delete(self, key: str) -> bool:
+        if key not in self._entries:
+            return False
+        self._remove(key)
+        return True
+
+    async def clear(self, prefix: str) -> int:
+        keys = [key for key in self._entries if key.startswith(prefix)]
+        for key in keys:
+            self._remove(key)
+        return len(keys)
+
+    def _remove(self, key: str) -> None:
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(key) + len(value)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "backend": self.name,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    A SQLite file in WAL mode, shared by the workers of one host.
+
+    sqlite3 blocks (a write waits for the lock up to its busy timeout), so
+    every call runs on a single thread that owns the connection, keeping
+    the event loop free as the Redis backend's streams do.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str, max_entries: int = 100000):
+        self.path = path
+        self.max_entries = max_entries
+        # Readers never wait on WAL writers; a write waiting longer than this is skipped
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=0.5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL) WITHOUT ROWID"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)")
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-cache")
+        self._last_purge = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.purged = 0
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return (await self.get_many([key]))[0]
+
+    async def get_many(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        if not keys:
+            return []
+        try:
+            found = await self._run(self._select, list(keys), time.time())
+        except sqlite3.Error as e:
+            self._failed("read", e)
+            return [None] * len(keys)
+        values = [found.get(key) for key in keys]
+        hits = len(found)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return values
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await self.set_many([(key, value)], ttl)
+
+    async def set_many(self, items: Sequence[Tuple[str, bytes]], ttl: float) -> None:
+        if not items or ttl <= 0:
+            return
+        expires = time.time() + ttl
+        try:
+            await self._run(self._insert, [(key, value, expires) for key, value in items])
+        except sqlite3.Error as e:
+            self._failed("write", e)
+            return
+        now = time.time()
+        if now - self._last_purge >= PURGE_INTERVAL:
+            self._last_purge = now
+            try:
+                self.purged += await self._run(self._purge, now)
+            except sqlite3.Error as e:
+                self._failed("purge", e)
+
+    async def delete(self, key: str) -> bool:
+        try:
+            return await self._run(self._delete, key)
+        except sqlite3.Error as e:
+            self._failed("delete", e)
+            return False
+
+    async def clear(self, prefix: str) -> int:
+        try:
+            return await self._run(self._clear, prefix, time.time())
+        except sqlite3.Error as e:
+            self._failed("clear", e)
+            return 0
+
+    # Database calls below run on the backend's thread
+
+    def _select(self, keys: List[str], now: float) -> Dict[str, bytes]:
+        return dict(self._db.execute(
+            f"SELECT key, value FROM cache WHERE key IN ({','.join('?' * len(keys))}) AND expires > ?",
+            (*keys, now)
+        ).fetchall())
+
+    def _insert(self, rows: List[Tuple[str, bytes, float]]) -> None:
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self._db.executemany("INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)", rows)
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+    def _delete(self, key: str) -> bool:
+        return self._db.execute("DELETE FROM cache WHERE key = ?", (key,)).rowcount > 0
+
+    def _clear(self, prefix: str, now: float) -> int:
+        # A range over the primary key, so only the namespace is scanned;
+        # expired rows go too but are not counted, as in Redis
+        bounds = (prefix, prefix + "\U0010ffff")
+        self._db.execute("DELETE FROM cache WHERE key >= ? AND key < ? AND expires <= ?", (*bounds, now))
+        return self._db.execute("DELETE FROM cache WHERE key >= ? AND key < ?", bounds).rowcount
+
+    def _purge(self, now: float) -> int:
+        """Drop expired rows, then the rows closest to expiry beyond max_entries (outside any write)."""
+        purged = self._db.execute("DELETE FROM cache WHERE expires <= ?", (now,)).rowcount
+        excess = self._db.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_entries
+        if excess > 0:
+            purged += self._db.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires LIMIT ?)", (excess,)
+            ).rowcount
+        return purged
+
+    def _failed(self, operation: str, error: Exception) -> None:
+        self.errors += 1
+        logger.warning(f"Shared cache {operation} failed: {str(error)}")
+
+    async def close(self) -> None:
+        await self._run(self._db.close)
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "backend": self.name,
+            "path": self.path,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "purged": self.purged,
+        }
+
+
+class RespError(Exception):
+    """Error reply of a Redis-protocol server."""
+
+
+class RespConnection:
+    """One connection speaking RESP2, with pipelined commands."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @staticmethod
+    def encode(args: Sequence[Any]) -> bytes:
+        out = bytearray(b"*%d\r\n" % len(args))
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode("utf-8")
+            elif isinstance(arg, (int, float)):
+                arg = str(arg).encode("ascii")
+            out += b"$%d\r\n" % len(arg)
+            out += arg
+            out += b"\r\n"
+        return bytes(out)
+
+    async def pipeline(self, commands: Sequence[Sequence[Any]]) -> List[Any]:
+        """Send the commands in one write and read their replies; error replies are returned as RespError."""
+        self.writer.write(b"".join(self.encode(command) for command in commands))
+        await self.writer.drain()
+        return [await self.read_reply() for _ in commands]
+
+    async def read_reply(self) -> Any:
+        line = await self.reader.readuntil(b"\r\n")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            return RespError(payload.decode("utf-8", "replace"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            size = int(payload)
+            if size < 0:
+                return None
+            return (await self.reader.readexactly(size + 2))[:-2]
+        if kind == b"*":
+            size = int(payload)
+            if size < 0:
+                return None
+            return [await self.read_reply() for _ in range(size)]
+        raise ConnectionError(f"Unexpected RESP reply {line[:20]!r}")
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+def _escape_pattern(text: str) -> str:
+    """Escape glob characters for SCAN MATCH."""
+    return "".join("\\" + char if char in "*?[]\\" else char for char in text)
+
+
+class RedisBackend(CacheBackend):
+    """Redis-protocol server shared by every node (redis:// or rediss:// URL)."""
+
+    name = "redis"
+
+    def __init__(self, url: str, timeout: float = 0.25, max_connections: int = 8, retry_after: float = 5.0):
+        parts = urlsplit(url)
+        if parts.scheme not in ("redis", "rediss"):
+            raise ValueError(f"Unsupported cache URL scheme {parts.scheme!r}")
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or 6379
+        self.username = unquote(parts.username) if parts.username else None
+        self.password = unquote(parts.password) if parts.password else None
+        self.db = int(parts.path.strip("/") or 0)
+        self.ssl = ssl.create_default_context() if parts.scheme == "rediss" else None
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._semaphore = asyncio.Semaphore(max_connections)
+        self._idle: List[RespConnection] = []
+        self._down_until = 0.0
+        self.connections = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.skipped = 0
+
+    @property
+    def address(self) -> str:
+        """Server address without credentials, for logs."""
+        return f"{'rediss' if self.ssl else 'redis'}://{self.host}:{self.port}/{self.db}"
+
+    async def _connect(self) -> RespConnection:
+        reader, writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        connection = RespConnection(reader, writer)
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.username, self.password) if self.username else ("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            for reply in await connection.pipeline(setup):
+                if isinstance(reply, RespError):
+                    connection.close()
+                    raise ConnectionError(f"Cache server rejected the connection: {reply}")
+        self.connections += 1
+        return connection
+
+    async def _execute(self, commands: Sequence[Sequence[Any]]) -> List[Any]:
+        async with self._semaphore:
+            connection = self._idle.pop() if self._idle else await self._connect()
+            try:
+                replies = await connection.pipeline(commands)
+            except BaseException:
+                # Cancelled or failed mid-reply: the connection's state is unknown
+                connection.close()
+                raise
+            self._idle.append(connection)
+            return replies
+
+    async def _run(self, commands: Sequence[Sequence[Any]]) -> Optional[List[Any]]:
+        """Replies to the commands, or None when the server is unavailable."""
+        if time.monotonic() < self._down_until:
+            self.skipped += 1
+            return None
+        try:
+            replies = await asyncio.wait_for(self._execute(commands), self.timeout)
+        except (OSError, EOFError, ConnectionError, ValueError, asyncio.TimeoutError) as e:
+            self.errors += 1
+            self._down_until = time.monotonic() + self.retry_after
+            logger.warning(f"Shared cache {self.address} unavailable, skipping it for "
+                           f"{self.retry_after:.0f}s: {str(e) or type(e).__name__}")
+            return None
+        for reply in replies:
+            if isinstance(reply, RespError):
+                self.errors += 1
+                logger.warning(f"Shared cache command failed: {reply}")
+        return replies
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return (await self.get_many([key]))[0]
+
+    async def get_many(self, keys: Sequence[str]) -> List[Optional[bytes]]:
+        if not keys:
+            return []
+        replies = await self._run([("MGET", *keys)])
+        if replies is None or not isinstance(replies[0], list):
+            return [None] * len(keys)
+        values = replies[0]
+        hits = sum(1 for value in values if value is not None)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return values
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await self.set_many([(key, value)], ttl)
+
+    async def set_many(self, items: Sequence[Tuple[str, bytes]], ttl: float) -> None:
+        if items and ttl > 0:
+            milliseconds = max(1, int(ttl * 1000))
+            await self._run([("SET", key, value, "PX", milliseconds) for key, value in items])
+
+    async def delete(self, key: str) -> bool:
+        replies = await self._run([("DEL", key)])
+        return bool(replies and replies[0] == 1)
+
+    async def clear(self, prefix: str) -> int:
+        removed = 0
+        cursor = "0"
+        pattern = _escape_pattern(prefix) + "*"
+        while True:
+            replies = await self._run([("SCAN", cursor, "MATCH", pattern, "COUNT", 1000)])
+            if replies is None or not isinstance(replies[0], list):
+                return removed
+            cursor, keys = replies[0][0].decode("ascii"), replies[0][1]
+            if keys:
+                deleted = await self._run([("DEL", *keys)])
+                if deleted and isinstance(deleted[0], int):
+                    removed += deleted[0]
+            if cursor == "0":
+                return removed
+
+    async def close(self) -> None:
+        while self._idle:
+            self._idle.pop().close()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "backend": self.name,
+            "address": self.address,
+            "available": time.monotonic() >= self._down_until,
+            "connections": self.connections,
+            "idle": len(self._idle),
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "skipped": self.skipped,
+        }
+
+
+class TieredCache:
+    """In-process L1 in front of a shared L2, for packed values under a namespace."""
+
+    def __init__(self, l2: CacheBackend, namespace: Namespace, l1_ttl: float = 5.0, l1_entries: int = 1024):
+        self.l1 = MemoryBackend(l1_entries)
+        self.l2 = l2
+        self.namespace = namespace
+        self.l1_ttl = l1_ttl
+        self.l1_hits = 0
+        self.l2_hits = 0
+        self.misses = 0
+        self.corrupt = 0
+
+    @classmethod
+    def from_config(cls, config) -> Optional["TieredCache"]:
+        """Build the cache from the CACHE_* settings; None for the default per-worker caches."""
+        backend = config.CACHE_BACKEND.strip().lower()
+        if backend == "memory":
+            return None
+        try:
+            if backend == "sqlite":
+                l2: CacheBackend = SQLiteBackend(config.CACHE_SQLITE_PATH, config.CACHE_SQLITE_MAX_ENTRIES)
+                where = config.CACHE_SQLITE_PATH
+            elif backend == "redis":
+                l2 = RedisBackend(config.CACHE_REDIS_URL, config.CACHE_TIMEOUT, config.CACHE_MAX_CONNECTIONS)
+                where = l2.address
+            else:
+                raise ValueError(f"Unknown cache backend {backend!r}")
+        except (ValueError, OSError, sqlite3.Error) as e:
+            logger.warning(f"Shared cache disabled: {str(e)}")
+            return None
+        logger.info(f"Shared cache: {backend} at {where}, L1 {config.CACHE_L1_TTL:g}s")
+        return cls(l2, Namespace(config.CACHE_NAMESPACE), config.CACHE_L1_TTL, config.CACHE_L1_MAX_ENTRIES)
+
+    def _unpack(self, data: Optional[bytes]) -> Any:
+        if data is None:
+            return None
+        try:
+            return unpack(data)
+        except SerializationError:
+            self.corrupt += 1
+            return None
+
+    async def get(self, kind: str, key: str) -> Any:
+        """Cached value, or None on a miss."""
+        return (await self.get_many(kind, [key]))[0]
+
+    async def get_many(self, kind: str, keys: Sequence[str]) -> List[Any]:
+        full_keys = [self.namespace.key(kind, key) for key in keys]
+        values: List[Any] = [None] * len(keys)
+        missing = []
+        for position, full_key in enumerate(full_keys):
+            data = await self.l1.get(full_key)
+            if data is None:
+                missing.append(position)
+            else:
+                values[position] = self._unpack(data)
+                self.l1_hits += 1
+        if not missing:
+            return values
+        found = await self.l2.get_many([full_keys[position] for position in missing])
+        for position, data in zip(missing, found):
+            value = self._unpack(data)
+            if value is None:
+                self.misses += 1
+                continue
+            values[position] = value
+            self.l2_hits += 1
+            await self.l1.set(full_keys[position], data, self.l1_ttl)
+        return values
+
+    async def set(self, kind: str, key: str, value: Any, ttl: float) -> None:
+        await self.set_many(kind, [(key, value)], ttl)
+
+    async def set_many(self, kind: str, items: Sequence[Tuple[str, Any]], ttl: float) -> None:
+        packed = [(self.namespace.key(kind, key), pack(value)) for key, value in items]
+        for full_key, data in packed:
+            await self.l1.set(full_key, data, min(self.l1_ttl, ttl))
+        await self.l2.set_many(packed, ttl)
+
+    async def delete(self, kind: str, key: str) -> bool:
+        """Remove an entry (other workers' L1 copies expire within CACHE_L1_TTL)."""
+        full_key = self.namespace.key(kind, key)
+        in_l1 = await self.l1.delete(full_key)
+        return await self.l2.delete(full_key) or in_l1
+
+    async def clear(self, kind: str) -> int:
+        prefix = self.namespace.prefix_of(kind)
+        await self.l1.clear(prefix)
+        return await self.l2.clear(prefix)
+
+    async def close(self) -> None:
+        await self.l2.close()
+
+    def stats(self) -> Dict[str, object]:
+        lookups = self.l1_hits + self.l2_hits + self.misses
+        return {
+            "namespace": self.namespace.prefix_of("*"),
+            "l1_ttl": self.l1_ttl,
+            "l1_hits": self.l1_hits,
+            "l2_hits": self.l2_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.l1_hits + self.l2_hits) / lookups, 4) if lookups else 0.0,
+            "corrupt": self.corrupt,
+            "l1": self.l1.stats(),
+            "l2": self.l2.stats(),
+        }
@@ -0,0 +1,341 @@
+"""
+Persistent WebSocket channel for avatar conversations (/ws/chat).
+
+Every avatar turn used to be a separate POST carrying the whole history,
+with no way for the server to push anything but the reply. A `ChatSocket`
+keeps one connection per avatar session: the client sends only its new
+messages, the server pushes the answer as it is generated and the client
+can cancel it. Frames are JSON text, each with a `type`:
+
+    client -> server
+        message    a new user turn: `text` (or multimodal `content`), an
+                   optional `id`, `include_ssml`, `tokens`, `use_search`,
+                   `max_tokens`, `temperature`, `deadline_ms`. A message
+                   while a turn is running cancels that turn (barge-in).
+        cancel     stop the running turn (`id` optional)
+        ping       keep-alive while the avatar is speaking; answered by `pong`
+
+    server -> client
+        ready      `session_id`, `idle_timeout`, `heartbeat_interval`
+        session    the session expired and a new one (`session_id`) took over
+        start      the turn's first token arrived (`degraded` if grounding was skipped)
+        token      raw reply delta (`text`), unless the message set `tokens: false`
+        citations  documents the answer is grounded on
+        sentence   ready-to-speak sentence (`index`, `text`, `ssml`)
+        done       the full `response`; the turn is in the session history
+        cancelled  the turn was stopped and is not kept in the history
+        error      `status` and `detail`, as the HTTP endpoints would return
+        heartbeat  sent when nothing else was for `heartbeat_interval` seconds
+        idle       the connection closes: no client frame for `idle_timeout`
+        replaced   the session was opened on another connection
+
+Turn frames carry the turn `id`. The idle timeout matches the avatar's own
+(`checkLastSpeak` disconnects 15 s after it last spoke): it runs from the
+last client frame or the end of the last turn, so the client pings while
+the avatar speaks a long answer.
+
+Backpressure is per connection: frames go through a bounded queue drained
+by one writer. When the client reads slower than the answer is generated,
+queued token frames are merged, other frames wait for room (which pauses
+the turn and its upstream stream), and a client that does not take a frame
+for WS_SEND_TIMEOUT seconds is disconnected.
+"""
+
+import asyncio
+import json
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+from starlette.exceptions import HTTPException
+from starlette.websockets import WebSocket
+
+logger = logging.getLogger(__name__)
+
+# Close codes (4000-4999 are for applications)
+CLOSE_NORMAL = 1000
+CLOSE_REPLACED = 4000
+CLOSE_SLOW_CLIENT = 4008
+
+
+class FrameQueue:
+    """Bounded outgoing frames of one connection; token frames merge when full."""
+
+    def __init__(self, max_frames: int = 64):
+        self.max_frames = max(1, max_frames)
+        self._frames: Deque[Optional[dict]] = deque()
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self._closed = False
+        self.merged = 0
+        self.waits = 0
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    async def put(self, frame: dict) -> None:
+        """Queue a frame, waiting while the queue is full (dropped once closed)."""
+        while not self._closed and len(self._frames) >= self.max_frames:
+            last = self._frames[-1]
+            if (frame["type"] == "token" and last is not None and last["type"] == "token"
+                    and last.get("id") == frame.get("id")):
+                last["text"] += frame["text"]
+                self.merged += 1
+                return
+            self.waits += 1
+            self._writable.clear()
+            await self._writable.wait()
+        if self._closed:
+            return
+        self._frames.append(frame)
+        self._readable.set()
+
+    def push(self, frame: dict) -> None:
+        """Queue a control frame without waiting; it may exceed the bound by one."""
+        if not self._closed:
+            self._frames.append(frame)
+            self._readable.set()
+
+    async def get(self) -> Optional[dict]:
+        """Next frame, or None once the queue is closed and drained."""
+        while not self._frames:
+            self._readable.clear()
+            await self._readable.wait()
+        frame = self._frames.popleft()
+        self._writable.set()
+        return frame
+
+    def close(self) -> None:
+        """Stop accepting frames; the writer gets None after the queued ones."""
+        if not self._closed:
+            self._closed = True
+            self._frames.append(None)
+            self._readable.set()
+            self._writable.set()
+
+
+class ChatSocketRegistry:
+    """Open connections of this worker by session, and counters for monitoring."""
+
+    def __init__(self):
+        self.sockets: Dict[str, "ChatSocket"] = {}
+        self.opened = 0
+        self.turns = 0
+        self.cancelled = 0
+        self.idle_closed = 0
+        self.replaced = 0
+        self.slow_closed = 0
+        self.bad_frames = 0
+        self.merged_tokens = 0
+
+    def attach(self, socket: "ChatSocket") -> None:
+        """Register a connection, replacing an older one of the same session."""
+        previous = self.sockets.get(socket.session_id)
+        if previous is not None and previous is not socket:
+            self.replaced += 1
+            previous.shutdown(CLOSE_REPLACED, "replaced", {"type": "replaced"})
+        self.sockets[socket.session_id] = socket
+
+    def detach(self, socket: "ChatSocket") -> None:
+        if self.sockets.get(socket.session_id) is socket:
+            del self.sockets[socket.session_id]
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "open": len(self.sockets),
+            "opened": self.opened,
+            "turns": self.turns,
+            "cancelled": self.cancelled,
+            "idle_closed": self.idle_closed,
+            "replaced": self.replaced,
+            "slow_closed": self.slow_closed,
+            "bad_frames": self.bad_frames,
+            "merged_tokens": self.merged_tokens,
+        }
+
+
+class ChatSocket:
+    """One avatar session's connection: reads client frames, runs turns, writes frames."""
+
+    def __init__(self, websocket: WebSocket, session_id: str,
+                 run_turn: Callable[["ChatSocket", str, dict], Awaitable[None]],
+                 registry: ChatSocketRegistry,
+                 keepalive: Optional[Callable[[str], Awaitable[None]]] = None,
+                 idle_timeout: float = 15.0, heartbeat_interval: float = 5.0,
+                 max_queue: int = 64, send_timeout: float = 10.0, max_frame_bytes: int = 64 * 1024):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.run_turn = run_turn
+        self.registry = registry
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.send_timeout = send_timeout
+        self.max_frame_bytes = max_frame_bytes
+        self.frames = FrameQueue(max_queue)
+        self._loop = asyncio.get_running_loop()
+        self._last_activity = self._loop.time()
+        self._last_sent = self._loop.time()
+        self._reader: Optional[asyncio.Task] = None
+        self._turn: Optional[asyncio.Task] = None
+        self._turn_id: Optional[str] = None
+        self._turns = 0
+        self._close: Optional[Tuple[int, str]] = None
+
+    async def send(self, frame: dict) -> None:
+        """Queue a frame for the client (waits while the client is behind)."""
+        await self.frames.put(frame)
+
+    async def adopt_session(self, session_id: str) -> None:
+        """Switch to a new session after the previous one expired."""
+        self.registry.detach(self)
+        self.session_id = session_id
+        self.registry.attach(self)
+        await self.send({"type": "session", "session_id": session_id})
+
+    def shutdown(self, code: int, reason: str, frame: Optional[dict] = None) -> None:
+        """Close the connection from outside, after sending `frame`."""
+        self._close = (code, reason)
+        if frame is not None:
+            self.frames.push(frame)
+        if self._reader is not None:
+            self._reader.cancel()
+
+    async def serve(self) -> None:
+        """Run the connection until the client leaves, goes idle or is replaced."""
+        self.registry.opened += 1
+        self.registry.attach(self)
+        self._reader = asyncio.ensure_future(self._read())
+        writer = asyncio.ensure_future(self._write())
+        heartbeat = asyncio.ensure_future(self._heartbeat())
+        try:
+            await self.send({"type": "ready", "session_id": self.session_id, "idle_timeout": self.idle_timeout,
+                             "heartbeat_interval": self.heartbeat_interval})
+            await asyncio.wait({self._reader, writer}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self.registry.detach(self)
+            self.registry.merged_tokens += self.frames.merged
+            await self._cancel_turn(notify=False)
+            self._reader.cancel()
+            heartbeat.cancel()
+            # Let the writer flush the last frames (idle, replaced) before closing
+            self.frames.close()
+            try:
+                await asyncio.wait_for(asyncio.shield(writer), self.send_timeout)
+            except Exception:
+                writer.cancel()
+            await asyncio.gather(self._reader, writer, heartbeat, return_exceptions=True)
+            if self._close is not None:
+                try:
+                    await self.websocket.close(*self._close)
+                except Exception:
+                    pass  # already closed by the client
+
+    async def _read(self) -> None:
+        while True:
+            remaining = self._last_activity + self.idle_timeout - self._loop.time()
+            if remaining <= 0 and not self._turn_running():
+                self.registry.idle_closed += 1
+                self._close = (CLOSE_NORMAL, "idle")
+                await self.send({"type": "idle", "idle_timeout": self.idle_timeout})
+                return
+            try:
+                message = await asyncio.wait_for(self.websocket.receive(),
+                                                 remaining if remaining > 0 else self.idle_timeout)
+            except asyncio.TimeoutError:
+                continue
+            if message["type"] == "websocket.disconnect":
+                return
+            self._last_activity = self._loop.time()
+            await self._dispatch(message)
+
+    async def _dispatch(self, message: dict) -> None:
+        text = message.get("text")
+        if text is None or len(text) > self.max_frame_bytes:
+            await self._reject(f"Expected a JSON text frame of at most {self.max_frame_bytes} bytes")
+            return
+        try:
+            frame = json.loads(text)
+        except ValueError:
+            frame = None
+        if not isinstance(frame, dict):
+            await self._reject("Frames must be JSON objects")
+            return
+        kind = frame.get("type")
+        if kind == "message":
+            await self._start_turn(frame)
+        elif kind == "cancel":
+            turn_id = frame.get("id")
+            if not await self._cancel_turn(str(turn_id) if turn_id is not None else None):
+                await self._reject("No turn to cancel", turn_id, status=409)
+        elif kind == "ping":
+            if self.keepalive is not None:
+                await self.keepalive(self.session_id)
+            await self.send({"type": "pong"})
+        else:
+            await self._reject(f"Unknown frame type {kind!r}")
+
+    async def _reject(self, detail: str, turn_id=None, status: int = 400) -> None:
+        self.registry.bad_frames += 1
+        await self.send({"type": "error", "id": turn_id, "status": status, "detail": detail})
+
+    def _turn_running(self) -> bool:
+        return self._turn is not None and not self._turn.done()
+
+    async def _start_turn(self, frame: dict) -> None:
+        # Barge-in: the user spoke again, the previous answer is no longer wanted
+        await self._cancel_turn()
+        self._turns += 1
+        self.registry.turns += 1
+        self._turn_id = str(frame.get("id") or f"turn-{self._turns}")
+        self._turn = asyncio.ensure_future(self._run(self._turn_id, frame))
+
+    async def _run(self, turn_id: str, frame: dict) -> None:
+        try:
+            await self.run_turn(self, turn_id, frame)
+        except HTTPException as e:
+            await self.send({"type": "error", "id": turn_id, "status": e.status_code, "detail": e.detail})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error in chat socket turn: {str(e)}")
+            await self.send({"type": "error", "id": turn_id, "status": 500,
+                             "detail": f"Internal server error: {str(e)}"})
+        finally:
+            self._last_activity = self._loop.time()
+
+    async def _cancel_turn(self, turn_id: Optional[str] = None, notify: bool = True) -> bool:
+        task = self._turn
+        if task is None or task.done() or (turn_id is not None and turn_id != self._turn_id):
+            return False
+        task.cancel()
+        # wait() rather than awaiting the task: a cancellation of this task must still propagate
+        await asyncio.wait({task})
+        self.registry.cancelled += 1
+        if notify:
+            await self.send({"type": "cancelled", "id": self._turn_id})
+        return True
+
+    async def _write(self) -> None:
+        while True:
+            frame = await self.frames.get()
+            if frame is None:
+                return
+            try:
+                await asyncio.wait_for(self.websocket.send_text(json.dumps(frame, ensure_ascii=False)),
+                                       self.send_timeout)
+            except asyncio.TimeoutError:
+                self.registry.slow_closed += 1
+                self._close = (CLOSE_SLOW_CLIENT, "client not reading")
+                logger.warning(f"Chat socket client took no frame for {self.send_timeout:.0f}s, closing")
+                return
+            except Exception:
+                return  # the client is gone; the reader sees the disconnect
+            self._last_sent = self._loop.time()
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            if self._loop.time() - self._last_sent >= self.heartbeat_interval and not len(self.frames):
+                await self.send({"type": "heartbeat"})
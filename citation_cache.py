@@ -0,0 +1,219 @@
+"""
+Per-session cache of retrieved documents for follow-up questions.
+
+Follow-ups in a consultation ("and what is the deadline for that?") need
+the documents of the previous turns, yet each turn used to search from
+scratch and the citations Azure returned were only logged. The cache keeps
+each session's recent citations (keyed by document and chunk) in a bounded
+in-process LRU, and a follow-up turn is grounded on them:
+
+- `reuse`: the cached chunks replace the search entirely;
+- `merge`: a smaller new search (SEARCH_REDUCED_TOP_N_DOCUMENTS) is fused
+  with the cached chunks by reciprocal rank fusion. Needs the local
+  retrieval backend; with Azure Search data_sources, follow-ups are
+  answered as with `reuse`, since extra documents cannot be added there.
+
+A turn counts as a follow-up when the session has cached chunks and the
+question either has no content words of its own (pure anaphora) or most of
+its content words occur in the cached chunks. Latencies are tracked per
+grounding mode, so the time saved by reuse can be reported.
+
+The cache is per worker: a follow-up served by another gunicorn worker
+searches as usual.
+"""
+
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from retrieval import RetrievedChunk, reciprocal_rank_fusion, tokenize
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ("off", "reuse", "merge")
+
+# Grounding modes of a turn
+MODE_SEARCH = "search"
+MODE_REUSE = "reuse"
+MODE_MERGE = "merge"
+
+# Question and function words that do not identify a topic
+STOPWORDS = frozenset({
+    "какой", "какая", "какое", "какие", "каких", "каком", "этот", "этого", "этому", "этом", "этим",
+    "этой", "эта", "это", "эти", "этих", "если", "почему", "зачем", "когда", "сколько", "можно",
+    "нужно", "надо", "тогда", "также", "насчёт", "насчет", "чтобы", "будет", "быть", "есть",
+    "него", "неё", "нее", "них", "ними", "она", "они", "оно", "тоже", "ещё", "еще",
+    "там", "тут", "так", "где", "куда", "откуда", "кто", "что", "чем", "как", "или",
+    "what", "about", "that", "this", "these", "those", "then", "when", "which", "there",
+})
+
+# Content words of a follow-up that must occur in the cached chunks
+FOLLOW_UP_COVERAGE = 0.5
+
+# Weight of the newest sample in the per-mode latency averages
+LATENCY_EWMA_ALPHA = 0.2
+
+
+def content_stems(text: str) -> Set[str]:
+    """Crude stems of the topic words of a text (endings dropped, >= 4 letters kept)."""
+    return {
+        token[:max(4, len(token) - 2)]
+        for token in tokenize(text)
+        if len(token) > 3 and token not in STOPWORDS and not token.isdigit()
+    }
+
+
+def chunk_from_citation(citation: Dict[str, object]) -> Optional[RetrievedChunk]:
+    """A cacheable chunk from an Azure Search or local citation, or None without content."""
+    content = str(citation.get("content") or "")
+    if not content:
+        return None
+    return RetrievedChunk(
+        str(citation.get("chunk_id") or ""), str(citation.get("title") or ""),
+        str(citation.get("filepath") or ""), str(citation.get("url") or ""), content, 0.0
+    )
+
+
+def chunk_key(chunk: RetrievedChunk) -> str:
+    """Document and chunk identity (Azure chunk ids are only unique within a document)."""
+    return f"{chunk.filepath or chunk.url or chunk.title}#{chunk.chunk_id}"
+
+
+class SessionChunks:
+    """Recent chunks of one session, newest first, with their stems."""
+
+    __slots__ = ("chunks", "stems", "updated")
+
+    def __init__(self):
+        self.chunks: "OrderedDict[str, Tuple[RetrievedChunk, Set[str]]]" = OrderedDict()
+        self.stems: Set[str] = set()
+        self.updated = time.monotonic()
+
+
+class CitationCache:
+    """Bounded per-session LRU of retrieved chunks and the reuse policy."""
+
+    def __init__(self, policy: str = MODE_MERGE, max_sessions: int = 1000, max_chunks: int = 20,
+                 ttl: float = 900.0, top_n: int = 10):
+        if policy not in POLICIES:
+            logger.warning(f"Unknown citation reuse policy {policy!r}, using 'off'")
+            policy = "off"
+        self.policy = policy
+        self.max_sessions = max_sessions
+        self.max_chunks = max_chunks
+        self.ttl = ttl
+        self.top_n = top_n
+        self._sessions: "OrderedDict[str, SessionChunks]" = OrderedDict()
+        self.lookups = 0
+        self.hits = 0
+        self.evicted = 0
+        self.latency: Dict[Tuple[str, bool], float] = {}
+        self.saved_seconds = 0.0
+        self.saved_turns = 0
+
+    @classmethod
+    def from_config(cls, config, top_n: int = 10) -> "CitationCache":
+        """Build the cache from the CITATION_* settings of a config object."""
+        return cls(
+            policy=config.CITATION_REUSE,
+            max_sessions=config.CITATION_CACHE_SESSIONS,
+            max_chunks=config.CITATION_CACHE_CHUNKS,
+            ttl=config.CITATION_CACHE_TTL,
+            top_n=top_n,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.policy != "off"
+
+    def remember(self, session_id: Optional[str], chunks: Iterable[RetrievedChunk]) -> None:
+        """Add a turn's chunks to the front of its session's cache."""
+        if not self.enabled or not session_id:
+            return
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            entry = self._sessions[session_id] = SessionChunks()
+        self._sessions.move_to_end(session_id)
+        for chunk in reversed(list(chunks)):
+            key = chunk_key(chunk)
+            entry.chunks[key] = (chunk, content_stems(f"{chunk.title} {chunk.content}"))
+            entry.chunks.move_to_end(key, last=False)
+        while len(entry.chunks) > self.max_chunks:
+            entry.chunks.popitem()
+        entry.stems = set().union(*(stems for _, stems in entry.chunks.values()))
+        entry.updated = time.monotonic()
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+
+    def remember_citations(self, session_id: Optional[str], citations: Sequence[Dict[str, object]]) -> None:
+        """Add the citations of an Azure Search grounded answer."""
+        self.remember(session_id, filter(None, (chunk_from_citation(citation) for citation in citations)))
+
+    def forget(self, session_id: str) -> None:
+        self._sessions.pop(session_id, None)
+
+    def follow_up(self, session_id: Optional[str], query: str) -> Optional[List[RetrievedChunk]]:
+        """
+        Cached chunks to ground a follow-up question on, best match first.
+
+        Returns:
+            The session's chunks ranked by overlap with the question, or None
+            if the question is not a follow-up (or nothing is cached).
+        """
+        if not self.enabled or not session_id:
+            return None
+        self.lookups += 1
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.updated > self.ttl:
+            del self._sessions[session_id]
+            return None
+        stems = content_stems(query)
+        if stems and len(stems & entry.stems) / len(stems) < FOLLOW_UP_COVERAGE:
+            return None
+        self.hits += 1
+        ranked = sorted(entry.chunks.values(), key=lambda item: len(stems & item[1]), reverse=True)
+        return [chunk for chunk, _ in ranked]
+
+    def merge(self, cached: Sequence[RetrievedChunk], fresh: Sequence[RetrievedChunk]) -> List[RetrievedChunk]:
+        """Fuse cached and newly retrieved chunks by reciprocal rank, up to `top_n`."""
+        by_key = {chunk_key(chunk): chunk for chunk in list(fresh) + list(cached)}
+        fused = reciprocal_rank_fusion([[chunk_key(chunk) for chunk in cached],
+                                        [chunk_key(chunk) for chunk in fresh]])
+        return [by_key[key] for key in sorted(fused, key=fused.get, reverse=True)[:self.top_n]]
+
+    def record(self, mode: str, streamed: bool, seconds: float) -> None:
+        """
+        Record how long a grounded turn took (to the first token when streamed).
+
+        Reuse and merge turns are credited with the difference to the average
+        full-search turn of the same kind.
+        """
+        key = (mode, streamed)
+        previous = self.latency.get(key)
+        self.latency[key] = seconds if previous is None else (
+            LATENCY_EWMA_ALPHA * seconds + (1 - LATENCY_EWMA_ALPHA) * previous)
+        baseline = self.latency.get((MODE_SEARCH, streamed))
+        if mode != MODE_SEARCH and baseline is not None:
+            self.saved_seconds += max(0.0, baseline - seconds)
+            self.saved_turns += 1
+
+    def stats(self) -> Dict[str, object]:
+        """Hit rate and latency saved, for monitoring."""
+        return {
+            "policy": self.policy,
+            "sessions": len(self._sessions),
+            "lookups": self.lookups,
+            "follow_ups": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else None,
+            "evicted": self.evicted,
+            "avg_turn_ms": {
+                f"{mode}{'_stream' if streamed else ''}": round(1000 * seconds, 1)
+                for (mode, streamed), seconds in sorted(self.latency.items())
+            },
+            "saved_ms_total": round(1000 * self.saved_seconds, 1),
+            "saved_ms_per_turn": round(1000 * self.saved_seconds / self.saved_turns, 1) if self.saved_turns else None,
+        }
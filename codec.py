@@ -0,0 +1,82 @@
+"""
+Pluggable JSON codec for upstream payloads and responses.
+
+orjson is used when installed (several times faster than the standard
+library for chat payloads); otherwise the stdlib `json` module is used.
+Both produce compact UTF-8 bytes, so encoded payloads are interchangeable.
+"""
+
+import json
+import logging
+from typing import Any, Callable, Dict
+
+try:
+    import orjson
+except ImportError:  # optional: fall back to the stdlib codec
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+class Codec:
+    """A named pair of `dumps` (object -> bytes) and `loads` (bytes/str -> object)."""
+
+    __slots__ = ("name", "dumps", "loads")
+
+    def __init__(self, name: str, dumps: Callable[[Any], bytes], loads: Callable[[Any], Any]):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+
+def _json_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+CODECS: Dict[str, Codec] = {"json": Codec("json", _json_dumps, json.loads)}
+if orjson is not None:
+    CODECS["orjson"] = Codec("orjson", orjson.dumps, orjson.loads)
+
+
+def get_codec(name: str = "auto") -> Codec:
+    """
+    Look up a codec by name.
+
+    Args:
+        name: `orjson`, `json`, or `auto` for the fastest one installed
+
+    Returns:
+        The codec; `json` if the requested one is not installed.
+    """
+    if name == "auto":
+        name = "orjson" if "orjson" in CODECS else "json"
+    codec = CODECS.get(name)
+    if codec is None:
+        logger.warning(f"JSON codec '{name}' is not available, using json")
+        codec = CODECS["json"]
+    return codec
+
+
+_active = get_codec()
+
+
+def use_codec(name: str) -> Codec:
+    """Select the codec used by `dumps` and `loads` (normally once at startup)."""
+    global _active
+    _active = get_codec(name)
+    logger.info(f"JSON codec: {_active.name}")
+    return _active
+
+
+def dumps(obj: Any) -> bytes:
+    """Encode an object to compact UTF-8 JSON bytes with the active codec."""
+    return _active.dumps(obj)
+
+
+def loads(data: Any) -> Any:
+    """Decode JSON bytes or text with the active codec."""
+    return _active.loads(data)
+
+
+def codec_name() -> str:
+    return _active.name
@@ -34,6 +34,15 @@ class ProductionConfig:
     # Logging configuration for production
     LOG_LEVEL: str = "INFO"
     LOG_FORMAT: str = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    # Written by a background thread; JSON lines with the request id
+    LOG_QUEUE: bool = os.environ.get("LOG_QUEUE", "true").lower() == "true"
+    LOG_JSON: bool = os.environ.get("LOG_JSON", "true").lower() == "true"
+    # Share of records kept per hot-path event (event=rate,...)
+    LOG_SAMPLE_RATES: str = os.environ.get("LOG_SAMPLE_RATES", "chat.request=0.1,chat.route=0.1,chat.citations=0.1")
+    # Records per second per message type (0 = unlimited)
+    LOG_RATE_LIMIT: float = float(os.environ.get("LOG_RATE_LIMIT", 50))
+    # Log citation contents and answer text at DEBUG (may contain user data)
+    LOG_CONTENT_DEBUG: bool = os.environ.get("LOG_CONTENT_DEBUG", "false").lower() == "true"
     
     # Server configuration
     HOST: str = "0.0.0.0"
@@ -53,6 +62,131 @@ class ProductionConfig:
     AVATAR_STYLE: str = os.environ.get("AVATAR_STYLE", "")
     VOICE_NAME: str = os.environ.get("VOICE_NAME", "")
     STT_LOCALE: str = os.environ.get("STT_LOCALE", "")
+    SPEECH_PROSODY_RATE: str = os.environ.get("SPEECH_PROSODY_RATE", "1.1")
+    
+    # Upstream connection pool (one per worker, shared by all chat requests)
+    UPSTREAM_POOL_LIMIT: int = int(os.environ.get("UPSTREAM_POOL_LIMIT", 100))
+    UPSTREAM_POOL_LIMIT_PER_HOST: int = int(os.environ.get("UPSTREAM_POOL_LIMIT_PER_HOST", 20))
+    UPSTREAM_KEEPALIVE_TIMEOUT: float = float(os.environ.get("UPSTREAM_KEEPALIVE_TIMEOUT", 60))
+    UPSTREAM_DNS_CACHE_TTL: int = int(os.environ.get("UPSTREAM_DNS_CACHE_TTL", 300))
+    UPSTREAM_CONNECT_TIMEOUT: float = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", 5))
+    UPSTREAM_READ_TIMEOUT: float = float(os.environ.get("UPSTREAM_READ_TIMEOUT", 120))
+    # Per-phase latency metrics: Server-Timing header on chat responses, and a
+    # directory where workers share their /metrics histograms ("" = per worker)
+    SERVER_TIMING_ENABLED: bool = os.environ.get("SERVER_TIMING_ENABLED", "true").lower() == "true"
+    METRICS_MULTIPROCESS_DIR: str = os.environ.get("METRICS_MULTIPROCESS_DIR", "")
+    METRICS_FLUSH_INTERVAL: float = float(os.environ.get("METRICS_FLUSH_INTERVAL", 5))
+    
+    # Warm-up before serving (DNS, pooled TLS connections, caches) and the
+    # cached upstream probes behind /health/deep (they also keep connections warm)
+    WARMUP_ENABLED: bool = os.environ.get("WARMUP_ENABLED", "true").lower() == "true"
+    WARMUP_TIMEOUT: float = float(os.environ.get("WARMUP_TIMEOUT", 10))
+    WARMUP_CONNECTIONS: int = int(os.environ.get("WARMUP_CONNECTIONS", 2))
+    HEALTH_PROBE_INTERVAL: float = float(os.environ.get("HEALTH_PROBE_INTERVAL", 30))
+    HEALTH_PROBE_TIMEOUT: float = float(os.environ.get("HEALTH_PROBE_TIMEOUT", 5))
+    
+    # Opt-in capture of sanitized chat requests for replay (benchmarks/replay.py)
+    CAPTURE_ENABLED: bool = os.environ.get("CAPTURE_ENABLED", "false").lower() == "true"
+    CAPTURE_DIR: str = os.environ.get("CAPTURE_DIR", "captures")
+    CAPTURE_PATHS: str = os.environ.get("CAPTURE_PATHS", "/chat,/simple-chat")
+    CAPTURE_SAMPLE_RATE: float = float(os.environ.get("CAPTURE_SAMPLE_RATE", 1.0))
+    CAPTURE_MAX_BYTES: int = int(os.environ.get("CAPTURE_MAX_BYTES", 50 * 1024 * 1024))
+    CAPTURE_MAX_FILES: int = int(os.environ.get("CAPTURE_MAX_FILES", 20))
+    
+    # Answer cache for repeated questions (non-streamed /chat and /simple-chat)
+    ANSWER_CACHE_ENABLED: bool = os.environ.get("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+    ANSWER_CACHE_MAX_ENTRIES: int = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", 512))
+    ANSWER_CACHE_MAX_BYTES: int = int(os.environ.get("ANSWER_CACHE_MAX_BYTES", 8 * 1024 * 1024))
+    ANSWER_CACHE_TTL: float = float(os.environ.get("ANSWER_CACHE_TTL", 3600))
+    ANSWER_CACHE_STALE_TTL: float = float(os.environ.get("ANSWER_CACHE_STALE_TTL", 600))
+    
+    # Share one upstream call among identical concurrent chat requests
+    SINGLE_FLIGHT_ENABLED: bool = os.environ.get("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+    
+    # Conversation history policy per endpoint: full, window or summary
+    HISTORY_POLICY_CHAT: str = os.environ.get("HISTORY_POLICY_CHAT", "summary")
+    HISTORY_POLICY_SIMPLE_CHAT: str = os.environ.get("HISTORY_POLICY_SIMPLE_CHAT", "window")
+    HISTORY_PROMPT_BUDGET: int = int(os.environ.get("HISTORY_PROMPT_BUDGET", 3000))
+    HISTORY_SUMMARY_MAX_TOKENS: int = int(os.environ.get("HISTORY_SUMMARY_MAX_TOKENS", 300))
+    HISTORY_MAX_CONVERSATIONS: int = int(os.environ.get("HISTORY_MAX_CONVERSATIONS", 1000))
+
+    # Server-side conversation sessions (idle timeout matches checkLastSpeak in js/chat.js)
+    SESSION_MAX_SESSIONS: int = int(os.environ.get("SESSION_MAX_SESSIONS", 1000))
+    SESSION_IDLE_TIMEOUT: float = float(os.environ.get("SESSION_IDLE_TIMEOUT", 15))
+    SESSION_MAX_MESSAGES: int = int(os.environ.get("SESSION_MAX_MESSAGES", 200))
+    # Worker processes (startup.sh passes it to gunicorn). In-memory sessions are
+    # private to a worker, so with several workers they default to SQLite
+    WEB_CONCURRENCY: int = int(os.environ.get("WEB_CONCURRENCY", 1))
+    SESSION_SQLITE_PATH: str = os.environ.get("SESSION_SQLITE_PATH",
+                                              "sessions.sqlite3" if WEB_CONCURRENCY > 1 else "")
+    # /ws/chat: idle close (defaults to the session idle timeout), heartbeat
+    # interval, per-connection send queue (frames) and slow-client timeout
+    WS_IDLE_TIMEOUT: float = float(os.environ.get("WS_IDLE_TIMEOUT", os.environ.get("SESSION_IDLE_TIMEOUT", 15)))
+    WS_HEARTBEAT_INTERVAL: float = float(os.environ.get("WS_HEARTBEAT_INTERVAL", 5))
+    WS_SEND_QUEUE: int = int(os.environ.get("WS_SEND_QUEUE", 64))
+    WS_SEND_TIMEOUT: float = float(os.environ.get("WS_SEND_TIMEOUT", 10))
+    WS_MAX_MESSAGE_BYTES: int = int(os.environ.get("WS_MAX_MESSAGE_BYTES", 65536))
+    # Reuse of a session's retrieved documents for follow-up questions:
+    # "merge" (with a smaller new search), "reuse" (no new search) or "off"
+    CITATION_REUSE: str = os.environ.get("CITATION_REUSE", "merge").lower()
+    CITATION_CACHE_SESSIONS: int = int(os.environ.get("CITATION_CACHE_SESSIONS", 1000))
+    CITATION_CACHE_CHUNKS: int = int(os.environ.get("CITATION_CACHE_CHUNKS", 20))
+    CITATION_CACHE_TTL: float = float(os.environ.get("CITATION_CACHE_TTL", 900))
+
+    # JSON codec for upstream payloads: auto (orjson if installed), orjson or json
+    JSON_CODEC: str = os.environ.get("JSON_CODEC", "auto")
+
+    # HTML page cache: re-read pages when their mtime changes (reload explicitly in production)
+    PAGE_CACHE_AUTO_RELOAD: bool = os.environ.get("PAGE_CACHE_AUTO_RELOAD", "false").lower() == "true"
+
+    # Upstream gateway: adaptive concurrency limit, wait queue and 429-aware retries (per worker)
+    GATEWAY_INITIAL_CONCURRENCY: int = int(os.environ.get("GATEWAY_INITIAL_CONCURRENCY", 8))
+    GATEWAY_MAX_CONCURRENCY: int = int(os.environ.get("GATEWAY_MAX_CONCURRENCY", 64))
+    GATEWAY_MAX_QUEUE: int = int(os.environ.get("GATEWAY_MAX_QUEUE", 100))
+    GATEWAY_QUEUE_TIMEOUT: float = float(os.environ.get("GATEWAY_QUEUE_TIMEOUT", 10))
+    GATEWAY_MAX_RETRIES: int = int(os.environ.get("GATEWAY_MAX_RETRIES", 2))
+    GATEWAY_MAX_RETRY_DELAY: float = float(os.environ.get("GATEWAY_MAX_RETRY_DELAY", 10))
+
+    # Endpoint routing (AZURE_OPENAI_ENDPOINTS), circuit breakers and hedged streams
+    ENDPOINT_FAILURE_THRESHOLD: int = int(os.environ.get("ENDPOINT_FAILURE_THRESHOLD", 5))
+    ENDPOINT_OPEN_SECONDS: float = float(os.environ.get("ENDPOINT_OPEN_SECONDS", 30))
+    HEDGE_ENABLED: bool = os.environ.get("HEDGE_ENABLED", "false").lower() == "true"
+    HEDGE_MIN_DELAY: float = float(os.environ.get("HEDGE_MIN_DELAY", 0.3))
+
+    # Chat turn deadlines (a request may ask for less via deadline_ms / X-Deadline-Ms)
+    CHAT_DEADLINE_SECONDS: float = float(os.environ.get("CHAT_DEADLINE_SECONDS", 20))
+    CHAT_MAX_DEADLINE_SECONDS: float = float(os.environ.get("CHAT_MAX_DEADLINE_SECONDS", 60))
+    # Time the Azure Search path gets (to the first token when streaming) before
+    # falling back to the plain path, and how long fewer documents are requested after that
+    SEARCH_DEADLINE_SECONDS: float = float(os.environ.get("SEARCH_DEADLINE_SECONDS", 8))
+    SEARCH_DEGRADED_SECONDS: float = float(os.environ.get("SEARCH_DEGRADED_SECONDS", 60))
+
+    # Retrieval backend of the grounded path: "azure" (Azure Search data_sources)
+    # or "local" (in-process BM25 + vector index, see retrieval.py)
+    RETRIEVAL_BACKEND: str = os.environ.get("RETRIEVAL_BACKEND", "azure").lower()
+    RETRIEVAL_INDEX_PATH: str = os.environ.get("RETRIEVAL_INDEX_PATH", "retrieval_index")
+    RETRIEVAL_RRF_K: int = int(os.environ.get("RETRIEVAL_RRF_K", 60))
+    # Seconds between checks for an index published by ingest.py (0 disables)
+    RETRIEVAL_RELOAD_INTERVAL: float = float(os.environ.get("RETRIEVAL_RELOAD_INTERVAL", 5))
+    EMBEDDING_DEPLOYMENT: str = os.environ.get("AZURE_OPENAI_EMBEDDING_DEPLOYMENT", "text-embedding-ada-002")
+    EMBEDDING_BATCH_SIZE: int = int(os.environ.get("EMBEDDING_BATCH_SIZE", 16))
+    # Query embedding cache shared by the workers on a host, used by the local
+    # retrieval backend only ("" disables)
+    EMBEDDING_CACHE_PATH: str = os.environ.get("EMBEDDING_CACHE_PATH", "embedding_cache")
+    EMBEDDING_CACHE_SIZE: int = int(os.environ.get("EMBEDDING_CACHE_SIZE", 10000))
+    
+    # Shared L2 behind the answer and query embedding caches: "sqlite" for the
+    # workers of one host, "redis" for every node, "memory" for per-worker only
+    CACHE_BACKEND: str = os.environ.get("CACHE_BACKEND", "memory")
+    CACHE_NAMESPACE: str = os.environ.get("CACHE_NAMESPACE", "ai_advocate")
+    CACHE_SQLITE_PATH: str = os.environ.get("CACHE_SQLITE_PATH", "shared_cache.sqlite3")
+    CACHE_SQLITE_MAX_ENTRIES: int = int(os.environ.get("CACHE_SQLITE_MAX_ENTRIES", 100000))
+    CACHE_REDIS_URL: str = os.environ.get("CACHE_REDIS_URL", "")
+    CACHE_TIMEOUT: float = float(os.environ.get("CACHE_TIMEOUT", 0.25))
+    CACHE_MAX_CONNECTIONS: int = int(os.environ.get("CACHE_MAX_CONNECTIONS", 8))
+    # In-process L1: how long another worker's invalidation may go unseen
+    CACHE_L1_TTL: float = float(os.environ.get("CACHE_L1_TTL", 5))
+    CACHE_L1_MAX_ENTRIES: int = int(os.environ.get("CACHE_L1_MAX_ENTRIES", 1024))
     
     # Security headers
     SECURITY_HEADERS = {
@@ -75,6 +209,11 @@ class DevelopmentConfig:
     # Debug logging for development
     LOG_LEVEL: str = "DEBUG"
     LOG_FORMAT: str = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    LOG_QUEUE: bool = os.environ.get("LOG_QUEUE", "true").lower() == "true"
+    LOG_JSON: bool = os.environ.get("LOG_JSON", "false").lower() == "true"
+    LOG_SAMPLE_RATES: str = os.environ.get("LOG_SAMPLE_RATES", "")
+    LOG_RATE_LIMIT: float = float(os.environ.get("LOG_RATE_LIMIT", 0))
+    LOG_CONTENT_DEBUG: bool = os.environ.get("LOG_CONTENT_DEBUG", "false").lower() == "true"
     
     # Server configuration
     HOST: str = "127.0.0.1"
@@ -94,6 +233,131 @@ class DevelopmentConfig:
     AVATAR_STYLE: str = os.environ.get("AVATAR_STYLE", "")
     VOICE_NAME: str = os.environ.get("VOICE_NAME", "")
     STT_LOCALE: str = os.environ.get("STT_LOCALE", "")
+    SPEECH_PROSODY_RATE: str = os.environ.get("SPEECH_PROSODY_RATE", "1.1")
+    
+    # Upstream connection pool (one per worker, shared by all chat requests)
+    UPSTREAM_POOL_LIMIT: int = int(os.environ.get("UPSTREAM_POOL_LIMIT", 20))
+    UPSTREAM_POOL_LIMIT_PER_HOST: int = int(os.environ.get("UPSTREAM_POOL_LIMIT_PER_HOST", 10))
+    UPSTREAM_KEEPALIVE_TIMEOUT: float = float(os.environ.get("UPSTREAM_KEEPALIVE_TIMEOUT", 60))
+    UPSTREAM_DNS_CACHE_TTL: int = int(os.environ.get("UPSTREAM_DNS_CACHE_TTL", 300))
+    UPSTREAM_CONNECT_TIMEOUT: float = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", 5))
+    UPSTREAM_READ_TIMEOUT: float = float(os.environ.get("UPSTREAM_READ_TIMEOUT", 120))
+    # Per-phase latency metrics: Server-Timing header on chat responses, and a
+    # directory where workers share their /metrics histograms ("" = per worker)
+    SERVER_TIMING_ENABLED: bool = os.environ.get("SERVER_TIMING_ENABLED", "true").lower() == "true"
+    METRICS_MULTIPROCESS_DIR: str = os.environ.get("METRICS_MULTIPROCESS_DIR", "")
+    METRICS_FLUSH_INTERVAL: float = float(os.environ.get("METRICS_FLUSH_INTERVAL", 5))
+    
+    # Warm-up before serving (DNS, pooled TLS connections, caches) and the
+    # cached upstream probes behind /health/deep (they also keep connections warm)
+    WARMUP_ENABLED: bool = os.environ.get("WARMUP_ENABLED", "true").lower() == "true"
+    WARMUP_TIMEOUT: float = float(os.environ.get("WARMUP_TIMEOUT", 10))
+    WARMUP_CONNECTIONS: int = int(os.environ.get("WARMUP_CONNECTIONS", 2))
+    HEALTH_PROBE_INTERVAL: float = float(os.environ.get("HEALTH_PROBE_INTERVAL", 30))
+    HEALTH_PROBE_TIMEOUT: float = float(os.environ.get("HEALTH_PROBE_TIMEOUT", 5))
+    
+    # Opt-in capture of sanitized chat requests for replay (benchmarks/replay.py)
+    CAPTURE_ENABLED: bool = os.environ.get("CAPTURE_ENABLED", "false").lower() == "true"
+    CAPTURE_DIR: str = os.environ.get("CAPTURE_DIR", "captures")
+    CAPTURE_PATHS: str = os.environ.get("CAPTURE_PATHS", "/chat,/simple-chat")
+    CAPTURE_SAMPLE_RATE: float = float(os.environ.get("CAPTURE_SAMPLE_RATE", 1.0))
+    CAPTURE_MAX_BYTES: int = int(os.environ.get("CAPTURE_MAX_BYTES", 50 * 1024 * 1024))
+    CAPTURE_MAX_FILES: int = int(os.environ.get("CAPTURE_MAX_FILES", 20))
+    
+    # Answer cache for repeated questions (non-streamed /chat and /simple-chat)
+    ANSWER_CACHE_ENABLED: bool = os.environ.get("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+    ANSWER_CACHE_MAX_ENTRIES: int = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", 512))
+    ANSWER_CACHE_MAX_BYTES: int = int(os.environ.get("ANSWER_CACHE_MAX_BYTES", 8 * 1024 * 1024))
+    ANSWER_CACHE_TTL: float = float(os.environ.get("ANSWER_CACHE_TTL", 3600))
+    ANSWER_CACHE_STALE_TTL: float = float(os.environ.get("ANSWER_CACHE_STALE_TTL", 600))
+    
+    # Share one upstream call among identical concurrent chat requests
+    SINGLE_FLIGHT_ENABLED: bool = os.environ.get("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+    
+    # Conversation history policy per endpoint: full, window or summary
+    HISTORY_POLICY_CHAT: str = os.environ.get("HISTORY_POLICY_CHAT", "summary")
+    HISTORY_POLICY_SIMPLE_CHAT: str = os.environ.get("HISTORY_POLICY_SIMPLE_CHAT", "window")
+    HISTORY_PROMPT_BUDGET: int = int(os.environ.get("HISTORY_PROMPT_BUDGET", 3000))
+    HISTORY_SUMMARY_MAX_TOKENS: int = int(os.environ.get("HISTORY_SUMMARY_MAX_TOKENS", 300))
+    HISTORY_MAX_CONVERSATIONS: int = int(os.environ.get("HISTORY_MAX_CONVERSATIONS", 1000))
+
+    # Server-side conversation sessions (idle timeout matches checkLastSpeak in js/chat.js)
+    SESSION_MAX_SESSIONS: int = int(os.environ.get("SESSION_MAX_SESSIONS", 1000))
+    SESSION_IDLE_TIMEOUT: float = float(os.environ.get("SESSION_IDLE_TIMEOUT", 15))
+    SESSION_MAX_MESSAGES: int = int(os.environ.get("SESSION_MAX_MESSAGES", 200))
+    # Worker processes (startup.sh passes it to gunicorn). In-memory sessions are
+    # private to a worker, so with several workers they default to SQLite
+    WEB_CONCURRENCY: int = int(os.environ.get("WEB_CONCURRENCY", 1))
+    SESSION_SQLITE_PATH: str = os.environ.get("SESSION_SQLITE_PATH",
+                                              "sessions.sqlite3" if WEB_CONCURRENCY > 1 else "")
+    # /ws/chat: idle close (defaults to the session idle timeout), heartbeat
+    # interval, per-connection send queue (frames) and slow-client timeout
+    WS_IDLE_TIMEOUT: float = float(os.environ.get("WS_IDLE_TIMEOUT", os.environ.get("SESSION_IDLE_TIMEOUT", 15)))
+    WS_HEARTBEAT_INTERVAL: float = float(os.environ.get("WS_HEARTBEAT_INTERVAL", 5))
+    WS_SEND_QUEUE: int = int(os.environ.get("WS_SEND_QUEUE", 64))
+    WS_SEND_TIMEOUT: float = float(os.environ.get("WS_SEND_TIMEOUT", 10))
+    WS_MAX_MESSAGE_BYTES: int = int(os.environ.get("WS_MAX_MESSAGE_BYTES", 65536))
+    # Reuse of a session's retrieved documents for follow-up questions:
+    # "merge" (with a smaller new search), "reuse" (no new search) or "off"
+    CITATION_REUSE: str = os.environ.get("CITATION_REUSE", "merge").lower()
+    CITATION_CACHE_SESSIONS: int = int(os.environ.get("CITATION_CACHE_SESSIONS", 1000))
+    CITATION_CACHE_CHUNKS: int = int(os.environ.get("CITATION_CACHE_CHUNKS", 20))
+    CITATION_CACHE_TTL: float = float(os.environ.get("CITATION_CACHE_TTL", 900))
+
+    # JSON codec for upstream payloads: auto (orjson if installed), orjson or json
+    JSON_CODEC: str = os.environ.get("JSON_CODEC", "auto")
+
+    # HTML page cache: re-read pages when their mtime changes (reload explicitly in production)
+    PAGE_CACHE_AUTO_RELOAD: bool = os.environ.get("PAGE_CACHE_AUTO_RELOAD", "true").lower() == "true"
+
+    # Upstream gateway: adaptive concurrency limit, wait queue and 429-aware retries (per worker)
+    GATEWAY_INITIAL_CONCURRENCY: int = int(os.environ.get("GATEWAY_INITIAL_CONCURRENCY", 8))
+    GATEWAY_MAX_CONCURRENCY: int = int(os.environ.get("GATEWAY_MAX_CONCURRENCY", 64))
+    GATEWAY_MAX_QUEUE: int = int(os.environ.get("GATEWAY_MAX_QUEUE", 100))
+    GATEWAY_QUEUE_TIMEOUT: float = float(os.environ.get("GATEWAY_QUEUE_TIMEOUT", 10))
+    GATEWAY_MAX_RETRIES: int = int(os.environ.get("GATEWAY_MAX_RETRIES", 2))
+    GATEWAY_MAX_RETRY_DELAY: float = float(os.environ.get("GATEWAY_MAX_RETRY_DELAY", 10))
+
+    # Endpoint routing (AZURE_OPENAI_ENDPOINTS), circuit breakers and hedged streams
+    ENDPOINT_FAILURE_THRESHOLD: int = int(os.environ.get("ENDPOINT_FAILURE_THRESHOLD", 5))
+    ENDPOINT_OPEN_SECONDS: float = float(os.environ.get("ENDPOINT_OPEN_SECONDS", 30))
+    HEDGE_ENABLED: bool = os.environ.get("HEDGE_ENABLED", "false").lower() == "true"
+    HEDGE_MIN_DELAY: float = float(os.environ.get("HEDGE_MIN_DELAY", 0.3))
+
+    # Chat turn deadlines (a request may ask for less via deadline_ms / X-Deadline-Ms)
+    CHAT_DEADLINE_SECONDS: float = float(os.environ.get("CHAT_DEADLINE_SECONDS", 20))
+    CHAT_MAX_DEADLINE_SECONDS: float = float(os.environ.get("CHAT_MAX_DEADLINE_SECONDS", 60))
+    # Time the Azure Search path gets (to the first token when streaming) before
+    # falling back to the plain path, and how long fewer documents are requested after that
+    SEARCH_DEADLINE_SECONDS: float = float(os.environ.get("SEARCH_DEADLINE_SECONDS", 8))
+    SEARCH_DEGRADED_SECONDS: float = float(os.environ.get("SEARCH_DEGRADED_SECONDS", 60))
+
+    # Retrieval backend of the grounded path: "azure" (Azure Search data_sources)
+    # or "local" (in-process BM25 + vector index, see retrieval.py)
+    RETRIEVAL_BACKEND: str = os.environ.get("RETRIEVAL_BACKEND", "azure").lower()
+    RETRIEVAL_INDEX_PATH: str = os.environ.get("RETRIEVAL_INDEX_PATH", "retrieval_index")
+    RETRIEVAL_RRF_K: int = int(os.environ.get("RETRIEVAL_RRF_K", 60))
+    # Seconds between checks for an index published by ingest.py (0 disables)
+    RETRIEVAL_RELOAD_INTERVAL: float = float(os.environ.get("RETRIEVAL_RELOAD_INTERVAL", 5))
+    EMBEDDING_DEPLOYMENT: str = os.environ.get("AZURE_OPENAI_EMBEDDING_DEPLOYMENT", "text-embedding-ada-002")
+    EMBEDDING_BATCH_SIZE: int = int(os.environ.get("EMBEDDING_BATCH_SIZE", 16))
+    # Query embedding cache shared by the workers on a host, used by the local
+    # retrieval backend only ("" disables)
+    EMBEDDING_CACHE_PATH: str = os.environ.get("EMBEDDING_CACHE_PATH", "embedding_cache")
+    EMBEDDING_CACHE_SIZE: int = int(os.environ.get("EMBEDDING_CACHE_SIZE", 10000))
+    
+    # Shared L2 behind the answer and query embedding caches: "sqlite" for the
+    # workers of one host, "redis" for every node, "memory" for per-worker only
+    CACHE_BACKEND: str = os.environ.get("CACHE_BACKEND", "memory")
+    CACHE_NAMESPACE: str = os.environ.get("CACHE_NAMESPACE", "ai_advocate")
+    CACHE_SQLITE_PATH: str = os.environ.get("CACHE_SQLITE_PATH", "shared_cache.sqlite3")
+    CACHE_SQLITE_MAX_ENTRIES: int = int(os.environ.get("CACHE_SQLITE_MAX_ENTRIES", 100000))
+    CACHE_REDIS_URL: str = os.environ.get("CACHE_REDIS_URL", "")
+    CACHE_TIMEOUT: float = float(os.environ.get("CACHE_TIMEOUT", 0.25))
+    CACHE_MAX_CONNECTIONS: int = int(os.environ.get("CACHE_MAX_CONNECTIONS", 8))
+    # In-process L1: how long another worker's invalidation may go unseen
+    CACHE_L1_TTL: float = float(os.environ.get("CACHE_L1_TTL", 5))
+    CACHE_L1_MAX_ENTRIES: int = int(os.environ.get("CACHE_L1_MAX_ENTRIES", 1024))
 
 def get_config():
     """Get configuration based on environment."""
@@ -0,0 +1,177 @@
+"""
+Immutable snapshot of the Azure and avatar configuration.
+
+The snapshot is built once from the environment and shared by every request:
+`/config` and `/internal/config` serve its pre-encoded JSON bodies with a
+strong ETag, and chat turns use its pre-validated Azure OpenAI and Azure
+Search settings. Reloading builds a new snapshot and swaps the reference,
+so a request always sees one consistent configuration.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional
+
+from endpoints import parse_targets
+from request_template import (
+    SEARCH_REDUCED_TOP_N_DOCUMENTS,
+    SEARCH_TOP_N_DOCUMENTS,
+    RequestTemplate,
+    azure_search_data_source,
+)
+
+logger = logging.getLogger(__name__)
+
+# Response field -> environment variable, in response order
+CONFIG_ENV_VARS = {
+    "azure_speech_key": "AZURE_SPEECH_KEY",
+    "azure_speech_region": "AZURE_SPEECH_REGION",
+    "azure_openai_key": "AZURE_OPENAI_KEY",
+    "azure_openai_endpoint": "AZURE_OPENAI_ENDPOINT",
+    "azure_openai_deployment": "AZURE_OPENAI_DEPLOYMENT",
+    "azure_system_prompt": "AZURE_SYSTEM_PROMPT",
+    "azure_search_endpoint": "AZURE_SEARCH_ENDPOINT",
+    "azure_search_api_key": "AZURE_SEARCH_API_KEY",
+    "azure_search_index_name": "AZURE_SEARCH_INDEX_NAME",
+    "avatar_character": "AVATAR_CHARACTER",
+    "avatar_style": "AVATAR_STYLE",
+    "voice_name": "VOICE_NAME",
+    "stt_locale": "STT_LOCALE",
+}
+
+# Fields masked in the public /config response
+SECRET_FIELDS = ("azure_speech_key", "azure_openai_key", "azure_search_api_key")
+MASKED_VALUE = "***MASKED***"
+
+DEFAULT_SYSTEM_PROMPT = "Ты юридический помощник фирмы Владимира Миллера."
+
+# Browsers may keep the body but must revalidate it (cheap 304) on every load
+CONFIG_CACHE_CONTROL = "private, no-cache"
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Check an `If-None-Match` header against a strong ETag.
+
+    Args:
+        if_none_match: Raw header value (may list several tags or be `*`)
+        etag: Current quoted ETag
+
+    Returns:
+        True if the client's cached copy is current.
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == "*" or candidate == etag:
+            return True
+    return False
+
+
+class ConfigSnapshot:
+    """Read-only configuration values with pre-encoded response bodies."""
+
+    __slots__ = (
+        "values", "loaded_at",
+        "public_body", "public_etag", "internal_body", "internal_etag",
+        "openai_ready", "search_ready", "system_prompt",
+        "targets",
+        "deployment", "search_endpoint", "search_api_key", "search_index_name",
+        "voice_name", "stt_locale",
+        "plain_template", "grounded_template", "reduced_template",
+    )
+
+    def __init__(self, values: Mapping[str, Optional[str]], loaded_at: Optional[float] = None,
+                 endpoints_json: Optional[str] = None):
+        values = {field: values.get(field) for field in CONFIG_ENV_VARS}
+        masked = {
+            field: (MASKED_VALUE if value else None) if field in SECRET_FIELDS else value
+            for field, value in values.items()
+        }
+        public_body = json.dumps(masked, ensure_ascii=False).encode("utf-8")
+        internal_body = json.dumps(values, ensure_ascii=False).encode("utf-8")
+
+        # One or more Azure OpenAI deployments (AZURE_OPENAI_ENDPOINTS overrides the single one)
+        targets = parse_targets(
+            endpoints_json,
+            endpoint=values["azure_openai_endpoint"] or "",
+            deployment=values["azure_openai_deployment"] or "",
+            key=values["azure_openai_key"] or "",
+        )
+
+        fields = {
+            "values": MappingProxyType(values),
+            "loaded_at": loaded_at if loaded_at is not None else time.time(),
+            "public_body": public_body,
+            "public_etag": _etag(public_body),
+            "internal_body": internal_body,
+            "internal_etag": _etag(internal_body),
+            "openai_ready": any(target.ready for target in targets),
+            "search_ready": bool(values["azure_search_endpoint"] and values["azure_search_api_key"]
+                                 and values["azure_search_index_name"]),
+            "system_prompt": values["azure_system_prompt"] or DEFAULT_SYSTEM_PROMPT,
+            "targets": targets,
+            # Part of the answer cache key: answers depend on the model behind it
+            "deployment": ",".join(sorted({target.deployment for target in targets})),
+            "search_endpoint": values["azure_search_endpoint"] or "",
+            "search_api_key": values["azure_search_api_key"] or "",
+            "search_index_name": values["azure_search_index_name"] or "",
+            "voice_name": values["voice_name"] or "",
+            "stt_locale": values["stt_locale"] or "",
+        }
+        # Precompiled upstream requests: plain (system prompt), grounded, and
+        # grounded with fewer documents for when search is slow
+        fields["plain_template"] = RequestTemplate(
+            system_message={"role": "system", "content": fields["system_prompt"]}
+        )
+        for name, top_n in (("grounded_template", SEARCH_TOP_N_DOCUMENTS),
+                            ("reduced_template", SEARCH_REDUCED_TOP_N_DOCUMENTS)):
+            fields[name] = RequestTemplate(
+                data_sources=[azure_search_data_source(
+                    fields["search_endpoint"], fields["search_api_key"], fields["search_index_name"],
+                    top_n_documents=top_n
+                )]
+            ) if fields["search_ready"] else None
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ConfigSnapshot is immutable")
+
+    @classmethod
+    def from_environ(cls, environ: Optional[Mapping[str, str]] = None) -> "ConfigSnapshot":
+        """
+        Build a snapshot from environment variables.
+
+        Missing variables become None, as in the previous per-request loader.
+        """
+        environ = os.environ if environ is None else environ
+        snapshot = cls({field: environ.get(name) for field, name in CONFIG_ENV_VARS.items()},
+                       endpoints_json=environ.get("AZURE_OPENAI_ENDPOINTS"))
+        loaded_count = sum(1 for value in snapshot.values.values() if value is not None)
+        logger.info(f"Configuration loaded: {loaded_count}/{len(CONFIG_ENV_VARS)} environment variables found, "
+                    f"Azure OpenAI {'SET' if snapshot.openai_ready else 'INCOMPLETE'} "
+                    f"({len(snapshot.targets)} endpoint(s)), "
+                    f"Azure Search {'SET' if snapshot.search_ready else 'NOT SET'}")
+        return snapshot
+
+    def stats(self) -> Dict[str, object]:
+        """Snapshot identity for monitoring (no values)."""
+        return {
+            "loaded_at": self.loaded_at,
+            "public_etag": self.public_etag,
+            "internal_etag": self.internal_etag,
+            "openai_ready": self.openai_ready,
+            "search_ready": self.search_ready,
+        }
@@ -0,0 +1,175 @@
+"""
+End-to-end deadlines for chat turns.
+
+A turn gets its deadline from the `deadline_ms` request field or the
+`X-Deadline-Ms` header, else CHAT_DEADLINE_SECONDS, capped at
+CHAT_MAX_DEADLINE_SECONDS. Everything the turn waits for upstream (gateway
+queue, retries, the call itself) runs inside it; when it runs out the call
+is cancelled and the client gets 504 instead of waiting on a worker that
+gunicorn would let run for ten minutes.
+
+Azure Search grounding is the slow part of a turn, so the grounded path
+gets its own sub-budget until the upstream starts responding: the response
+headers of a non-streamed call (see `mark_responded`), the first token when
+streaming. Generating the rest of the answer only counts against the turn's
+deadline. If the sub-budget is missed, the turn is retried on the plain
+system-prompt path and marked as degraded, and for a while afterwards
+grounded turns ask for fewer documents.
+"""
+
+import asyncio
+import contextvars
+import logging
+import time
+from typing import Awaitable, Dict, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+DEADLINE_HEADER = "x-deadline-ms"
+
+# Reasons reported to the client in `degraded` / `X-Degraded`
+DEGRADED_SEARCH_TIMEOUT = "search-timeout"
+DEGRADED_REDUCED_SEARCH = "reduced-search"
+
+# Set by `Deadline.run_to_response` for the attempt it runs
+_responded: "contextvars.ContextVar[Optional[asyncio.Event]]" = contextvars.ContextVar("upstream_responded",
+                                                                                        default=None)
+
+
+class ResponseTimeout(Exception):
+    """The upstream did not start responding within the sub-budget."""
+
+
+def mark_responded() -> None:
+    """Record that the upstream started answering the current attempt (no-op outside one)."""
+    event = _responded.get()
+    if event is not None:
+        event.set()
+
+
+class Deadline:
+    """Point in time by which a turn must have produced its answer."""
+
+    __slots__ = ("timeout", "expires_at")
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout
+
+    @classmethod
+    def from_request(cls, deadline_ms: Optional[int], header: Optional[str],
+                     default_seconds: float, max_seconds: float) -> "Deadline":
+        """
+        Resolve a turn's deadline; the request field wins over the header.
+
+        Missing, invalid or non-positive values fall back to the default, and
+        the result never exceeds `max_seconds`.
+        """
+        seconds = default_seconds
+        for value in (deadline_ms, header):
+            if value is None:
+                continue
+            try:
+                requested = float(value) / 1000.0
+            except (TypeError, ValueError):
+                logger.warning(f"Ignoring invalid deadline: {value!r}")
+                continue
+            if requested > 0:
+                seconds = requested
+                break
+        return cls(min(seconds, max_seconds))
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    async def run(self, awaitable: Awaitable[T], limit: Optional[float] = None) -> T:
+        """
+        Await within the remaining time (and `limit`, if smaller).
+
+        Raises:
+            asyncio.TimeoutError: If the time runs out; the awaitable is cancelled.
+        """
+        budget = self.remaining() if limit is None else min(self.remaining(), limit)
+        return await asyncio.wait_for(awaitable, budget)
+
+    async def run_to_response(self, awaitable: Awaitable[T], limit: float) -> T:
+        """
+        Await within the remaining time, giving up after `limit` only if the
+        upstream has not started responding by then.
+
+        The awaitable finishing counts as responding, so a streamed attempt
+        that returns at its first token needs no `mark_responded` call.
+
+        Raises:
+            ResponseTimeout: If `limit` passed first; the awaitable is cancelled.
+            asyncio.TimeoutError: If the deadline runs out; the awaitable is cancelled.
+        """
+        responded = asyncio.Event()
+        token = _responded.set(responded)
+        try:
+            # The task copies the context, and with it the event
+            task = asyncio.ensure_future(awaitable)
+        finally:
+            _responded.reset(token)
+        waiter = asyncio.ensure_future(responded.wait())
+        try:
+            await asyncio.wait({task, waiter}, timeout=min(limit, self.remaining()),
+                               return_when=asyncio.FIRST_COMPLETED)
+        except BaseException:
+            task.cancel()
+            raise
+        finally:
+            waiter.cancel()
+        if not task.done() and not responded.is_set():
+            task.cancel()
+            await asyncio.wait({task})
+            if self.expired:
+                raise asyncio.TimeoutError()
+            raise ResponseTimeout()
+        return await asyncio.wait_for(task, self.remaining())
+
+
+class SearchFallback:
+    """Tracks slow Azure Search grounding and the degraded window that follows."""
+
+    def __init__(self, budget: float = 8.0, degraded_seconds: float = 60.0):
+        self.budget = budget
+        self.degraded_seconds = degraded_seconds
+        self.degraded_until = 0.0
+        self.fallbacks = 0
+        self.reduced = 0
+        self.exceeded = 0
+
+    @classmethod
+    def from_config(cls, config) -> "SearchFallback":
+        """Build the fallback policy from the SEARCH_* deadline settings of a config object."""
+        return cls(
+            budget=config.SEARCH_DEADLINE_SECONDS,
+            degraded_seconds=config.SEARCH_DEGRADED_SECONDS,
+        )
+
+    @property
+    def active(self) -> bool:
+        """Whether grounded turns should currently ask for fewer documents."""
+        return time.monotonic() < self.degraded_until
+
+    def trip(self) -> None:
+        """Record a grounded turn that missed its budget."""
+        self.fallbacks += 1
+        self.degraded_until = time.monotonic() + self.degraded_seconds
+
+    def stats(self) -> Dict[str, object]:
+        """Fallback counters for monitoring."""
+        return {
+            "search_budget": self.budget,
+            "reduced_search_active": self.active,
+            "search_fallbacks": self.fallbacks,
+            "reduced_search_turns": self.reduced,
+            "deadline_exceeded": self.exceeded,
+        }
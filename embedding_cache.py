@@ -0,0 +1,232 @@
+"""
+Persistent cache of query embeddings.
+
+FAQ-style questions repeat a lot, and every repeat used to cost an
+embeddings call. Entries are keyed by a hash of the normalized text and the
+model (deployment) name:
+
+- vectors live in one memory-mapped float32 file per model (`capacity`
+  rows), so all gunicorn workers on the host share the pages through the
+  OS page cache;
+- a SQLite side index in WAL mode (`index.sqlite3`) maps keys to rows and
+  keeps the last-use time for eviction.
+
+The cache is bounded: when a model's file is full, the least recently used
+row is reused. Last-use times are refreshed at most once per
+LAST_USED_RESOLUTION seconds per entry, so hot lookups stay read-only and
+do not compete with other workers for the write lock. Each entry stores a
+CRC of its vector, so a row overwritten by another worker between the index
+lookup and the read is a miss, never a wrong vector.
+
+The methods block on SQLite (up to its 5 s busy timeout); callers on the
+event loop run them in an executor.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # optional: only needed for the local retrieval backend
+    np = None
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.sqlite3"
+
+# Precision of the LRU clock: a hit refreshes last_used only if it is older
+LAST_USED_RESOLUTION = 60.0
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """Case- and whitespace-insensitive form of a query, as cached."""
+    return _WHITESPACE.sub(" ", text).strip().lower()
+
+
+def cache_key(model: str, text: str) -> str:
+    """Cache key of a text embedded by a model."""
+    return hashlib.blake2b(f"{model}\x00{normalize_query(text)}".encode("utf-8"), digest_size=16).hexdigest()
+
+
+class EmbeddingCache:
+    """Size-bounded, multi-process cache of embedding vectors."""
+
+    def __init__(self, path: str, capacity: int = 10000):
+        if np is None:
+            raise RuntimeError("The embedding cache needs numpy")
+        self.path = path
+        self.capacity = max(1, capacity)
+        os.makedirs(path, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(path, INDEX_FILE), isolation_level=None,
+                                   check_same_thread=False, timeout=5.0)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS models ("
+            "model TEXT PRIMARY KEY, dimensions INTEGER NOT NULL, capacity INTEGER NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, slot INTEGER NOT NULL, "
+            "crc INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE UNIQUE INDEX IF NOT EXISTS entries_slot ON entries (model, slot)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (model, last_used)")
+        self._lock = threading.Lock()
+        self._arrays: Dict[str, "np.memmap"] = {}
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.corrupt = 0
+        logger.info(f"Embedding cache at {path} ({self.capacity} vectors per model)")
+
+    @classmethod
+    def from_config(cls, config) -> Optional["EmbeddingCache"]:
+        """Build the cache from the EMBEDDING_CACHE_* settings; None if disabled or unavailable."""
+        if not config.EMBEDDING_CACHE_PATH:
+            return None
+        try:
+            return cls(config.EMBEDDING_CACHE_PATH, config.EMBEDDING_CACHE_SIZE)
+        except (RuntimeError, OSError, sqlite3.Error) as e:
+            logger.warning(f"Embedding cache disabled: {str(e)}")
+            return None
+
+    def close(self) -> None:
+        with self._lock:
+            for array in self._arrays.values():
+                array.flush()
+            self._arrays.clear()
+            self._db.close()
+
+    def _array(self, model: str, dimensions: Optional[int] = None) -> Optional["np.memmap"]:
+        """The model's vector file, created on the first store."""
+        array = self._arrays.get(model)
+        if array is not None:
+            return array
+        row = self._db.execute("SELECT dimensions, capacity FROM models WHERE model = ?", (model,)).fetchone()
+        if row is None:
+            if dimensions is None:
+                return None
+            self._db.execute("INSERT OR IGNORE INTO models VALUES (?, ?, ?)", (model, dimensions, self.capacity))
+            row = self._db.execute("SELECT dimensions, capacity FROM models WHERE model = ?", (model,)).fetchone()
+        file_path = os.path.join(self.path, f"{hashlib.blake2b(model.encode('utf-8'), digest_size=8).hexdigest()}.f32")
+        size = row[0] * row[1] * 4
+        with open(file_path, "ab") as handle:
+            # Sparse until written; a no-op once the file has its full size
+            if handle.tell() < size:
+                handle.truncate(size)
+        array = np.memmap(file_path, dtype=np.float32, mode="r+", shape=(row[1], row[0]))
+        self._arrays[model] = array
+        return array
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional["np.ndarray"]]:
+        """
+        Look up several texts at once.
+
+        Returns:
+            One vector (a copy) or None per text, in input order.
+        """
+        results: List[Optional["np.ndarray"]] = [None] * len(texts)
+        keys = [cache_key(model, text) for text in texts]
+        with self._lock:
+            array = self._array(model)
+            if array is not None and keys:
+                rows = self._db.execute(
+                    f"SELECT key, slot, crc, last_used FROM entries WHERE key IN ({','.join('?' * len(keys))})",
+                    keys
+                ).fetchall()
+                found = {key: (slot, crc, last_used) for key, slot, crc, last_used in rows}
+                now = time.time()
+                stale_keys = []
+                for position, key in enumerate(keys):
+                    if key not in found:
+                        continue
+                    slot, crc, last_used = found[key]
+                    if slot >= array.shape[0]:
+                        continue
+                    vector = np.array(array[slot])
+                    if zlib.crc32(vector.tobytes()) != crc:
+                        self.corrupt += 1
+                        continue
+                    results[position] = vector
+                    if now - last_used >= LAST_USED_RESOLUTION:
+                        stale_keys.append(key)
+                if stale_keys:
+                    self._db.executemany("UPDATE entries SET last_used = ? WHERE key = ?",
+                                         [(now, key) for key in stale_keys])
+        hits = sum(vector is not None for vector in results)
+        self.hits += hits
+        self.misses += len(texts) - hits
+        return results
+
+    def get(self, model: str, text: str) -> Optional["np.ndarray"]:
+        return self.get_many(model, [text])[0]
+
+    def put_many(self, model: str, texts: Sequence[str], vectors: Sequence[Sequence[float]]) -> None:
+        """Store vectors, evicting the least recently used rows of the model when full."""
+        if not texts:
+            return
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+        with self._lock:
+            array = self._array(model, matrix.shape[1])
+            if array.shape[1] != matrix.shape[1]:
+                logger.warning(f"Not caching {model} embeddings: {matrix.shape[1]} dimensions, "
+                               f"cache has {array.shape[1]}")
+                return
+            # One writer at a time across workers while slots are handed out
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for text, vector in zip(texts, matrix):
+                    key = cache_key(model, text)
+                    row = self._db.execute("SELECT slot FROM entries WHERE key = ?", (key,)).fetchone()
+                    if row is not None:
+                        slot = row[0]
+                    else:
+                        slot = self._free_slot(model, array.shape[0])
+                    array[slot] = vector
+                    self._db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                                     (key, model, slot, zlib.crc32(vector.tobytes()), time.time()))
+                    self.stores += 1
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _free_slot(self, model: str, capacity: int) -> int:
+        used = self._db.execute("SELECT COUNT(*) FROM entries WHERE model = ?", (model,)).fetchone()[0]
+        if used < capacity:
+            # Rows are only ever reused, so the used slots are 0..used-1
+            return used
+        key, slot = self._db.execute(
+            "SELECT key, slot FROM entries WHERE model = ? ORDER BY last_used LIMIT 1", (model,)
+        ).fetchone()
+        self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+        self.evictions += 1
+        return slot
+
+    def stats(self) -> Dict[str, object]:
+        """Hit/miss counters and entries per model for monitoring."""
+        with self._lock:
+            entries = dict(self._db.execute("SELECT model, COUNT(*) FROM entries GROUP BY model").fetchall())
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path,
+            "capacity": self.capacity,
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "corrupt": self.corrupt,
+        }
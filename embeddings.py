@@ -0,0 +1,308 @@
+"""
+Embeddings for the local retrieval backend.
+
+Embedders are pluggable and described by a spec stored in the index
+manifest, so queries are always embedded the way the corpus was:
+
+- `hashing`: deterministic feature hashing of words and word pairs; no
+  network, no model. For tests and fully offline setups.
+- `azure`: an Azure OpenAI embeddings deployment
+  (AZURE_OPENAI_EMBEDDING_DEPLOYMENT, `text-embedding-ada-002` by default,
+  as in the Azure Search integrated vectorizer).
+
+`EmbeddingClient` embeds queries on the server's shared upstream pool,
+through the persistent query cache (embedding_cache.py, on an executor
+thread) when one is configured, then the shared cache of all nodes
+(cache_backend.py, as float32 bytes); `AzureEmbedder` is its blocking
+counterpart for ingestion workers.
+"""
+
+import array
+import asyncio
+import hashlib
+import logging
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional, Sequence
+
+import aiohttp
+
+import codec
+from cache_backend import TieredCache
+from embedding_cache import EmbeddingCache, cache_key
+from endpoints import AZURE_OPENAI_API_VERSION, UpstreamTarget
+from gateway import parse_retry_after
+from retrieval import tokenize
+
+try:
+    import numpy as np
+except ImportError:  # optional: only needed for the local retrieval backend
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Azure OpenAI accepts up to 2048 inputs per embeddings call
+MAX_BATCH_SIZE = 2048
+
+# Query embeddings do not change for a deployment; the TTL only bounds the shared cache
+SHARED_TTL = 7 * 24 * 3600.0
+
+
+def pack_vector(vector: Sequence[float]) -> bytes:
+    """Little-endian float32 bytes of a vector, as kept in the shared cache."""
+    if np is not None:
+        return np.asarray(vector, dtype="<f4").tobytes()
+    packed = array.array("f", vector)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack_vector(data: bytes) -> Sequence[float]:
+    if np is not None:
+        # A writable copy: the retriever normalizes query vectors in place
+        return np.frombuffer(data, dtype="<f4").astype(np.float32)
+    vector = array.array("f")
+    vector.frombytes(data)
+    if sys.byteorder == "big":
+        vector.byteswap()
+    return vector
+
+
+def embeddings_url(endpoint: str, deployment: str) -> str:
+    """Embeddings endpoint of a deployment on an Azure OpenAI resource."""
+    return (f"{endpoint.rstrip('/')}/openai/deployments/{deployment}/embeddings"
+            f"?api-version={AZURE_OPENAI_API_VERSION}")
+
+
+class EmbeddingError(Exception):
+    """The embeddings call failed or returned an unexpected payload."""
+
+
+class EmbeddingClient:
+    """Embeds texts through the Azure OpenAI embeddings API."""
+
+    def __init__(self, deployment: str, batch_size: int = 16, cache: Optional[EmbeddingCache] = None,
+                 shared: Optional[TieredCache] = None):
+        self.deployment = deployment
+        self.batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+        self.cache = cache
+        self.shared = shared
+        self.shared_hits = 0
+        self.calls = 0
+        self.texts = 0
+        self.failures = 0
+
+    @classmethod
+    def from_config(cls, config, shared: Optional[TieredCache] = None) -> "EmbeddingClient":
+        """
+        Build a client from the EMBEDDING_* settings of a config object.
+
+        Only the local retrieval backend embeds queries itself; with Azure
+        Search the persistent cache is not created (nor its directory).
+        """
+        cache = EmbeddingCache.from_config(config) if config.RETRIEVAL_BACKEND == "local" else None
+        return cls(config.EMBEDDING_DEPLOYMENT, config.EMBEDDING_BATCH_SIZE, cache, shared)
+
+    def close(self) -> None:
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+    @staticmethod
+    def target_for(targets: Sequence[UpstreamTarget]) -> Optional[UpstreamTarget]:
+        """First configured Azure OpenAI resource (embeddings are not routed)."""
+        return next((target for target in targets if target.ready), None)
+
+    async def embed(self, session: aiohttp.ClientSession, targets: Sequence[UpstreamTarget],
+                    texts: Sequence[str], deployment: Optional[str] = None) -> List[Sequence[float]]:
+        """
+        Embed texts, in input order; cached vectors are not requested again.
+
+        Args:
+            session: Shared aiohttp session (the upstream pool's)
+            targets: Azure OpenAI targets of the current configuration snapshot
+            texts: Texts to embed
+            deployment: Embeddings deployment, if not the configured one
+
+        Returns:
+            One vector per text.
+
+        Raises:
+            EmbeddingError: If no target is configured or a call fails.
+        """
+        deployment = deployment or self.deployment
+        loop = asyncio.get_running_loop()
+        vectors: List[Optional[Sequence[float]]] = (
+            await loop.run_in_executor(None, self.cache.get_many, deployment, texts)
+            if self.cache is not None else [None] * len(texts)
+        )
+        missing = [position for position, vector in enumerate(vectors) if vector is None]
+        if missing and self.shared is not None:
+            missing = await self._from_shared(deployment, texts, vectors, missing)
+        if not missing:
+            return vectors
+        target = self.target_for(targets)
+        if target is None:
+            raise EmbeddingError("Azure OpenAI is not configured")
+        embedded: List[List[float]] = []
+        for start in range(0, len(missing), self.batch_size):
+            embedded.extend(await self._embed_batch(
+                session, target, deployment, [texts[position] for position in missing[start:start + self.batch_size]]
+            ))
+        for position, vector in zip(missing, embedded):
+            vectors[position] = vector
+        if self.cache is not None:
+            await loop.run_in_executor(None, self.cache.put_many, deployment,
+                                       [texts[position] for position in missing], embedded)
+        if self.shared is not None:
+            await self.shared.set_many("embedding", [
+                (cache_key(deployment, texts[position]), pack_vector(vector))
+                for position, vector in zip(missing, embedded)
+            ], SHARED_TTL)
+        return vectors
+
+    async def _from_shared(self, deployment: str, texts: Sequence[str], vectors: List[Optional[Sequence[float]]],
+                           missing: List[int]) -> List[int]:
+        """Fill `vectors` from the shared cache (and the host cache with them); returns what is still missing."""
+        found = await self.shared.get_many("embedding", [cache_key(deployment, texts[position]) for position in missing])
+        still_missing = []
+        adopted = []
+        for position, data in zip(missing, found):
+            if isinstance(data, bytes) and data and len(data) % 4 == 0:
+                vectors[position] = unpack_vector(data)
+                adopted.append(position)
+            else:
+                still_missing.append(position)
+        self.shared_hits += len(adopted)
+        if adopted and self.cache is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.cache.put_many, deployment, [texts[position] for position in adopted],
+                [vectors[position] for position in adopted]
+            )
+        return still_missing
+
+    async def _embed_batch(self, session: aiohttp.ClientSession, target: UpstreamTarget, deployment: str,
+                           batch: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.texts += len(batch)
+        try:
+            async with session.post(embeddings_url(target.endpoint, deployment), headers=target.headers,
+                                    data=codec.dumps({"input": batch})) as response:
+                if response.status != 200:
+                    raise EmbeddingError(f"Embeddings API error: {response.status} - {await response.text()}")
+                data = codec.loads(await response.read())
+        except aiohttp.ClientError as e:
+            self.failures += 1
+            raise EmbeddingError(f"Embeddings API unreachable: {str(e)}") from e
+        except EmbeddingError:
+            self.failures += 1
+            raise
+        items = sorted(data.get("data") or [], key=lambda item: item.get("index", 0))
+        if len(items) != len(batch):
+            self.failures += 1
+            raise EmbeddingError(f"Embeddings API returned {len(items)} vectors for {len(batch)} inputs")
+        return [item["embedding"] for item in items]
+
+    def stats(self) -> Dict[str, object]:
+        """Call counters for monitoring."""
+        return {
+            "deployment": self.deployment,
+            "calls": self.calls,
+            "texts": self.texts,
+            "failures": self.failures,
+            "shared_hits": self.shared_hits,
+            "cache": self.cache.stats() if self.cache is not None else None,
+        }
+
+
+class HashingEmbedder:
+    """Deterministic feature-hashing embedder (signed buckets of words and word pairs)."""
+
+    name = "hashing"
+
+    def __init__(self, dimensions: int = 256):
+        self.dimensions = dimensions
+
+    def spec(self) -> Dict[str, object]:
+        return {"name": self.name, "dimensions": self.dimensions}
+
+    def embed(self, texts: Sequence[str]) -> "np.ndarray":
+        """L2-normalized float32 vectors, one row per text."""
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            for feature in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+                # blake2b, not hash(): stable across processes and runs
+                digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+                matrix[row, digest % self.dimensions] += 1.0 if digest >> 63 else -1.0
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1.0, norms)
+
+
+class AzureEmbedder:
+    """Blocking Azure OpenAI embeddings client for ingestion worker processes."""
+
+    name = "azure"
+
+    def __init__(self, endpoint: str, key: str, deployment: str, batch_size: int = 16, max_retries: int = 5):
+        self.endpoint = endpoint
+        self.key = key
+        self.deployment = deployment
+        self.batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+        self.max_retries = max_retries
+
+    def spec(self) -> Dict[str, object]:
+        # The key is not part of the spec: specs are written to the index manifest
+        return {"name": self.name, "deployment": self.deployment}
+
+    def embed(self, texts: Sequence[str]) -> "np.ndarray":
+        """Float32 vectors, one row per text; retries 429/5xx with the server's hint."""
+        rows: List[List[float]] = []
+        for start in range(0, len(texts), self.batch_size):
+            rows.extend(self._embed_batch(list(texts[start:start + self.batch_size])))
+        return np.asarray(rows, dtype=np.float32).reshape(len(texts), -1)
+
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        request = urllib.request.Request(
+            embeddings_url(self.endpoint, self.deployment),
+            data=codec.dumps({"input": batch}),
+            headers={"api-key": self.key, "Content-Type": "application/json"},
+            method="POST",
+        )
+        for attempt in range(self.max_retries + 1):
+            try:
+                with urllib.request.urlopen(request, timeout=60) as response:
+                    data = codec.loads(response.read())
+                items = sorted(data.get("data") or [], key=lambda item: item.get("index", 0))
+                if len(items) != len(batch):
+                    raise EmbeddingError(f"Embeddings API returned {len(items)} vectors for {len(batch)} inputs")
+                return [item["embedding"] for item in items]
+            except urllib.error.HTTPError as e:
+                if e.code not in (429, 500, 502, 503, 504) or attempt == self.max_retries:
+                    raise EmbeddingError(f"Embeddings API error: {e.code} - {e.read()[:200]!r}") from e
+                delay = parse_retry_after(e.headers) or min(30.0, 2.0 ** attempt)
+            except urllib.error.URLError as e:
+                if attempt == self.max_retries:
+                    raise EmbeddingError(f"Embeddings API unreachable: {str(e)}") from e
+                delay = min(30.0, 2.0 ** attempt)
+            time.sleep(delay)
+        raise EmbeddingError("Embeddings API retries exhausted")
+
+
+def create_embedder(spec: Dict[str, object], endpoint: str = "", key: str = "", batch_size: int = 16):
+    """
+    Build an embedder from its spec.
+
+    Raises:
+        ValueError: If the spec names an unknown embedder or Azure is not configured.
+    """
+    if spec.get("name") == HashingEmbedder.name:
+        return HashingEmbedder(int(spec.get("dimensions") or 256))
+    if spec.get("name") == AzureEmbedder.name:
+        if not endpoint or not key:
+            raise ValueError("The azure embedder needs AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_KEY")
+        return AzureEmbedder(endpoint, key, str(spec.get("deployment")), batch_size)
+    raise ValueError(f"Unknown embedder: {spec.get('name')!r}")
@@ -0,0 +1,366 @@
+"""
+Routing across several Azure OpenAI endpoints (regions/deployments).
+
+`AZURE_OPENAI_ENDPOINTS` may list several targets as JSON:
+
+    [{"name": "swc", "endpoint": "https://a.openai.azure.com", "deployment": "gpt-4o",
+      "key": "...", "weight": 2},
+     {"name": "frc", "endpoint": "https://b.openai.azure.com", "deployment": "gpt-4o",
+      "key": "..."}]
+
+Without it the single AZURE_OPENAI_ENDPOINT/DEPLOYMENT/KEY triple is used.
+
+Each call goes to the target with the lowest EWMA latency per unit of
+weight; a target that has not been used for a cool-down is probed again.
+A per-target circuit breaker stops sending traffic to a failing
+target (closed -> open), and lets a single probe through after a cool-down
+(half-open). Streamed calls can be hedged: if the first target has not
+answered within its p95 time to first byte, a second target is tried and
+the slower call is cancelled.
+"""
+
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import deque
+from types import MappingProxyType
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+import aiohttp
+
+from gateway import GatewayBusy, UpstreamStatusError
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+AZURE_OPENAI_API_VERSION = "2024-10-21"
+
+# Latency charged to a target for a failed call, so routing moves away from it
+FAILURE_PENALTY_SECONDS = 5.0
+
+
+class UpstreamTarget:
+    """One Azure OpenAI deployment with its prebuilt URL and headers."""
+
+    __slots__ = ("name", "endpoint", "deployment", "weight", "api_url", "headers", "ready")
+
+    def __init__(self, name: str, endpoint: str, deployment: str, key: str, weight: float = 1.0):
+        self.name = name
+        self.endpoint = endpoint
+        self.deployment = deployment
+        self.weight = weight if weight > 0 else 1.0
+        self.api_url = (f"{endpoint}/openai/deployments/{deployment}/chat/completions"
+                        f"?api-version={AZURE_OPENAI_API_VERSION}")
+        self.headers = MappingProxyType({
+            "api-key": key,
+            "Content-Type": "application/json",
+        })
+        self.ready = bool(key.strip() and endpoint.strip() and deployment.strip())
+
+
+def parse_targets(endpoints_json: Optional[str], endpoint: str = "", deployment: str = "",
+                  key: str = "") -> Tuple[UpstreamTarget, ...]:
+    """
+    Build the upstream targets from `AZURE_OPENAI_ENDPOINTS`, falling back to
+    the single endpoint settings when the list is absent or invalid.
+    """
+    if endpoints_json and endpoints_json.strip():
+        try:
+            entries = json.loads(endpoints_json)
+            targets = tuple(
+                UpstreamTarget(
+                    name=str(entry.get("name") or f"endpoint-{i}"),
+                    endpoint=str(entry.get("endpoint", "")).rstrip("/"),
+                    deployment=str(entry.get("deployment", deployment)),
+                    key=str(entry.get("key", "")),
+                    weight=float(entry.get("weight", 1.0)),
+                )
+                for i, entry in enumerate(entries)
+            )
+            if targets:
+                return targets
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.error(f"Invalid AZURE_OPENAI_ENDPOINTS, using AZURE_OPENAI_ENDPOINT: {str(e)}")
+    return (UpstreamTarget("primary", endpoint, deployment, key),)
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker for one target."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, open_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    def available(self, now: float) -> bool:
+        """Whether a call may go to this target (no side effects)."""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return now - self.opened_at >= self.open_seconds
+        return not self.probing
+
+    def acquire(self, now: float) -> None:
+        """Mark a call as sent; after the cool-down it becomes the half-open probe."""
+        if self.state == self.OPEN and now - self.opened_at >= self.open_seconds:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            self.probing = True
+
+    def record_success(self) -> None:
+        if self.state != self.CLOSED:
+            logger.info("Circuit closed")
+        self.state = self.CLOSED
+        self.failures = 0
+        self.probing = False
+
+    def record_failure(self, now: float) -> None:
+        self.failures += 1
+        self.probing = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = now
+
+    def record_abandoned(self) -> None:
+        """A call was cancelled (e.g. hedge loser): no verdict on the target."""
+        self.probing = False
+
+    def retry_after(self, now: float) -> float:
+        return max(0.0, self.open_seconds - (now - self.opened_at))
+
+
+class TargetState:
+    """Latency statistics and breaker of one target, kept across config reloads."""
+
+    def __init__(self, breaker: CircuitBreaker, sample_size: int = 200):
+        self.breaker = breaker
+        self.ewma: Optional[float] = None
+        self.last_used = 0.0
+        self.first_byte: Deque[float] = deque(maxlen=sample_size)
+        self.requests = 0
+        self.failures = 0
+        self.hedges_won = 0
+
+    def observe(self, latency: float, alpha: float = 0.3) -> None:
+        self.ewma = latency if self.ewma is None else (1 - alpha) * self.ewma + alpha * latency
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.first_byte:
+            return None
+        ordered = sorted(self.first_byte)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class EndpointRouter:
+    """Latency-aware routing, circuit breaking and hedging across targets."""
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        open_seconds: float = 30.0,
+        hedge_enabled: bool = False,
+        hedge_min_delay: float = 0.3,
+        hedge_min_samples: int = 20,
+    ):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.hedge_enabled = hedge_enabled
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self._states: Dict[str, TargetState] = {}
+        self.hedged = 0
+        self.hedge_cancelled = 0
+
+    @classmethod
+    def from_config(cls, config) -> "EndpointRouter":
+        """Build a router from the ENDPOINT_* / HEDGE_* settings of a config object."""
+        return cls(
+            failure_threshold=config.ENDPOINT_FAILURE_THRESHOLD,
+            open_seconds=config.ENDPOINT_OPEN_SECONDS,
+            hedge_enabled=config.HEDGE_ENABLED,
+            hedge_min_delay=config.HEDGE_MIN_DELAY,
+        )
+
+    def state(self, target: UpstreamTarget) -> TargetState:
+        state = self._states.get(target.name)
+        if state is None:
+            state = self._states[target.name] = TargetState(
+                CircuitBreaker(self.failure_threshold, self.open_seconds)
+            )
+        return state
+
+    def pick(self, targets: Tuple[UpstreamTarget, ...],
+             exclude: Optional[UpstreamTarget] = None) -> Optional[UpstreamTarget]:
+        """Best available target by EWMA latency per weight (untried targets first)."""
+        now = time.monotonic()
+        best, best_score = None, None
+        for target in targets:
+            if target is exclude or not target.ready:
+                continue
+            state = self.state(target)
+            if not state.breaker.available(now):
+                continue
+            # A target left alone for a cool-down is re-probed instead of judged on old latency
+            ewma = state.ewma if now - state.last_used < self.open_seconds else None
+            # Random tie-break spreads load across equally fast targets
+            score = (ewma or 0.0) / target.weight + random.random() * 1e-3
+            if best_score is None or score < best_score:
+                best, best_score = target, score
+        return best
+
+    def hedge_delay(self, target: UpstreamTarget) -> Optional[float]:
+        """p95 time to first byte of a target, once enough samples exist."""
+        state = self.state(target)
+        if len(state.first_byte) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, state.percentile(0.95))
+
+    async def run(
+        self,
+        targets: Tuple[UpstreamTarget, ...],
+        attempt: Callable[[UpstreamTarget], Awaitable[T]],
+        hedge: bool = False,
+        discard: Optional[Callable[[T], None]] = None,
+    ) -> T:
+        """
+        Send one call to the best target, hedging it when allowed.
+
+        Args:
+            targets: Targets of the current configuration snapshot
+            attempt: Performs the call against a target; for streams it must
+                return as soon as the upstream answered (first byte)
+            hedge: Allow a second, parallel call to another target
+            discard: Releases the result of a call that lost the race
+
+        Raises:
+            GatewayBusy: If every target's circuit is open.
+        """
+        primary = self.pick(targets)
+        if primary is None:
+            now = time.monotonic()
+            waits = [self.state(t).breaker.retry_after(now) for t in targets if t.ready]
+            raise GatewayBusy("No Azure OpenAI endpoint available", min(waits) if waits else 1.0)
+
+        delay = self.hedge_delay(primary) if hedge and self.hedge_enabled and len(targets) > 1 else None
+        if delay is None:
+            return await self._attempt(primary, attempt, record_first_byte=hedge)
+
+        first = asyncio.ensure_future(self._attempt(primary, attempt, record_first_byte=True))
+        try:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+        except BaseException:
+            self._abandon(first, discard)
+            raise
+        secondary = None if done else self.pick(targets, exclude=primary)
+        if secondary is None:
+            try:
+                return await first
+            except asyncio.CancelledError:
+                self._abandon(first, discard)
+                raise
+
+        self.hedged += 1
+        logger.info(f"Hedging upstream call: {primary.name} slower than {delay:.2f}s, trying {secondary.name}")
+        second = asyncio.ensure_future(self._attempt(secondary, attempt, record_first_byte=True))
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in done if task.exception() is None), None)
+                if winner is not None:
+                    if winner is second:
+                        self.state(secondary).hedges_won += 1
+                    for task in (first, second):
+                        if task is not winner:
+                            self._abandon(task, discard)
+                    return winner.result()
+                error = next(iter(done)).exception()
+            raise error
+        except asyncio.CancelledError:
+            for task in (first, second):
+                self._abandon(task, discard)
+            raise
+
+    def _abandon(self, task: "asyncio.Future", discard: Optional[Callable]) -> None:
+        """Cancel a losing call, releasing its result if it already finished."""
+        def release(finished: "asyncio.Future") -> None:
+            if not finished.cancelled() and finished.exception() is None and discard is not None:
+                discard(finished.result())
+
+        if task.done():
+            release(task)
+        else:
+            self.hedge_cancelled += 1
+            task.cancel()
+            task.add_done_callback(release)
+
+    async def _attempt(self, target: UpstreamTarget, attempt: Callable[[UpstreamTarget], Awaitable[T]],
+                       record_first_byte: bool = False) -> T:
+        state = self.state(target)
+        started = time.monotonic()
+        state.breaker.acquire(started)
+        state.requests += 1
+        state.last_used = started
+        try:
+            result = await attempt(target)
+        except asyncio.CancelledError:
+            state.breaker.record_abandoned()
+            raise
+        except (UpstreamStatusError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            now = time.monotonic()
+            state.failures += 1
+            if isinstance(e, UpstreamStatusError) and e.status == 429:
+                # Quota, not an outage: steer away via latency but keep the circuit closed
+                state.breaker.record_abandoned()
+            else:
+                state.breaker.record_failure(now)
+            state.observe(max(FAILURE_PENALTY_SECONDS, now - started))
+            if state.breaker.state == CircuitBreaker.OPEN:
+                logger.warning(f"Circuit open for upstream endpoint {target.name}")
+            raise
+        except BaseException:
+            # Not the target's fault (e.g. a 400 for this request)
+            state.breaker.record_abandoned()
+            raise
+        latency = time.monotonic() - started
+        state.breaker.record_success()
+        state.observe(latency)
+        if record_first_byte:
+            state.first_byte.append(latency)
+        return result
+
+    def stats(self, targets: Tuple[UpstreamTarget, ...] = ()) -> Dict[str, object]:
+        """Per-target routing state for monitoring."""
+        endpoints: List[Dict[str, object]] = []
+        for target in targets:
+            state = self.state(target)
+            p95 = state.percentile(0.95)
+            endpoints.append({
+                "name": target.name,
+                "deployment": target.deployment,
+                "weight": target.weight,
+                "ready": target.ready,
+                "circuit": state.breaker.state,
+                "latency_ewma": round(state.ewma, 4) if state.ewma is not None else None,
+                "first_byte_p95": round(p95, 4) if p95 is not None else None,
+                "requests": state.requests,
+                "failures": state.failures,
+                "hedges_won": state.hedges_won,
+            })
+        return {
+            "hedge_enabled": self.hedge_enabled,
+            "hedged": self.hedged,
+            "hedge_cancelled": self.hedge_cancelled,
+            "endpoints": endpoints,
+        }
@@ -0,0 +1,326 @@
+"""
+Per-worker gateway for Azure OpenAI calls: adaptive concurrency, a bounded
+wait queue and 429-aware retries.
+
+The concurrency limit follows AIMD: it grows by about one slot per round of
+successful calls and is cut multiplicatively when the upstream throttles
+(429/503) or latency climbs well above its observed baseline. Calls beyond
+the limit wait in a FIFO queue with a length bound and a queue-time budget;
+callers that cannot be admitted get `GatewayBusy` instead of piling onto a
+throttled deployment.
+
+Failed attempts are retried with jitter, honouring `retry-after-ms` and
+`Retry-After`. An attempt is only retried before the caller has received
+anything: a streamed call counts as delivered once its status line arrived.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Deque, Dict, Mapping, Optional, Tuple, TypeVar
+
+import aiohttp
+
+from metrics import phase
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Upstream statuses worth another attempt; 429 and 503 also signal overload
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+OVERLOAD_STATUSES = frozenset({429, 503})
+
+
+class UpstreamStatusError(Exception):
+    """A retryable error status from the upstream, before any body was used."""
+
+    def __init__(self, status: int, text: str, retry_after: Optional[float] = None):
+        super().__init__(f"Upstream returned {status}")
+        self.status = status
+        self.text = text
+        self.retry_after = retry_after
+
+
+class GatewayBusy(Exception):
+    """The call could not be admitted or kept being throttled."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """
+    Read the upstream's retry hint in seconds.
+
+    Azure OpenAI sends `retry-after-ms` (milliseconds) and/or `Retry-After`
+    (seconds or an HTTP date); the millisecond header is more precise.
+    """
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000.0)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                return None
+    return None
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit with a bounded FIFO wait queue."""
+
+    def __init__(
+        self,
+        initial_limit: int = 8,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        max_queue: int = 100,
+        queue_timeout: float = 10.0,
+        backoff: float = 0.5,
+        latency_tolerance: float = 3.0,
+    ):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+        self.baseline_latency: Optional[float] = None
+        self.latency_ewma: Optional[float] = None
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.queue_timeouts = 0
+        self.decreases = 0
+
+    @property
+    def current_limit(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    async def acquire(self) -> None:
+        """
+        Take a concurrency slot, waiting in line if the limit is reached.
+
+        Raises:
+            GatewayBusy: If the queue is full or the queue-time budget runs out.
+        """
+        if self.in_flight < self.current_limit and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise GatewayBusy("Upstream queue is full", self.queue_timeout)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.queue_timeouts += 1
+            raise GatewayBusy("Timed out waiting for an upstream slot", self.queue_timeout)
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # Slot was handed over just as we gave up: pass it on
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        self.admitted += 1
+
+    def release(self) -> None:
+        """Return a slot and admit queued callers while the limit allows."""
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < self.current_limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # The slot moves to the waiter without becoming free
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def on_success(self, latency: float) -> None:
+        """Additive increase, unless latency shows the upstream is saturating."""
+        self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+        if self.baseline_latency is None or latency < self.baseline_latency:
+            self.baseline_latency = latency
+        else:
+            # Let the baseline drift up slowly so it tracks prompt sizes
+            self.baseline_latency = 0.99 * self.baseline_latency + 0.01 * latency
+        if self.latency_ewma > self.latency_tolerance * self.baseline_latency:
+            self._decrease(0.9)
+            return
+        if self.in_flight >= self.current_limit - 1:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._wake()
+
+    def on_overload(self) -> None:
+        """Multiplicative decrease on throttling."""
+        self._decrease(self.backoff)
+
+    def _decrease(self, factor: float) -> None:
+        now = time.monotonic()
+        # One cut per latency window: a burst of 429s is one congestion signal
+        window = self.latency_ewma or 1.0
+        if now - self._last_decrease < window:
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_limit), self.limit * factor)
+        self.decreases += 1
+        logger.info(f"Upstream concurrency limit lowered to {self.current_limit}")
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "limit": self.current_limit,
+            "in_flight": self.in_flight,
+            "queue_depth": len(self._waiters),
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "queue_timeouts": self.queue_timeouts,
+            "decreases": self.decreases,
+            "latency_ewma": round(self.latency_ewma, 4) if self.latency_ewma is not None else None,
+            "baseline_latency": round(self.baseline_latency, 4) if self.baseline_latency is not None else None,
+        }
+
+
+class UpstreamGateway:
+    """Admission control and retries around single upstream attempts."""
+
+    def __init__(
+        self,
+        limiter: AdaptiveLimiter,
+        max_retries: int = 2,
+        base_delay: float = 0.5,
+        max_retry_delay: float = 10.0,
+    ):
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_retry_delay = max_retry_delay
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.exhausted = 0
+
+    @classmethod
+    def from_config(cls, config) -> "UpstreamGateway":
+        """Build a gateway from the GATEWAY_* settings of a config object."""
+        return cls(
+            AdaptiveLimiter(
+                initial_limit=config.GATEWAY_INITIAL_CONCURRENCY,
+                min_limit=1,
+                max_limit=config.GATEWAY_MAX_CONCURRENCY,
+                max_queue=config.GATEWAY_MAX_QUEUE,
+                queue_timeout=config.GATEWAY_QUEUE_TIMEOUT,
+            ),
+            max_retries=config.GATEWAY_MAX_RETRIES,
+            max_retry_delay=config.GATEWAY_MAX_RETRY_DELAY,
+        )
+
+    async def call(self, attempt: Callable[[], Awaitable[T]]) -> T:
+        """Run a complete (non-streamed) upstream call with admission and retries."""
+        result, release = await self.open(attempt)
+        release()
+        return result
+
+    async def open(self, attempt: Callable[[], Awaitable[T]]) -> Tuple[T, Callable[[], None]]:
+        """
+        Start an upstream call and keep its concurrency slot.
+
+        Used for streams: `attempt` returns once the upstream answered 200,
+        before any event is read, so it can be retried safely. The caller
+        must call the returned `release` when the stream ends.
+
+        Raises:
+            GatewayBusy: If the call was not admitted or stayed throttled.
+            UpstreamStatusError: If a retryable server error persisted.
+        """
+        self.calls += 1
+        tries = 0
+        while True:
+            with phase("queue_wait"):
+                await self.limiter.acquire()
+            started = time.monotonic()
+            try:
+                result = await attempt()
+            except UpstreamStatusError as e:
+                self.limiter.release()
+                delay = self._after_failure(e.status in OVERLOAD_STATUSES, e.retry_after, tries)
+                if delay is None:
+                    self.exhausted += 1
+                    if e.status == 429:
+                        raise GatewayBusy("Upstream rate limit reached", e.retry_after or self.base_delay)
+                    raise
+            except aiohttp.ClientConnectionError as e:
+                # Nothing was received: reconnecting is safe
+                self.limiter.release()
+                delay = self._after_failure(False, None, tries)
+                if delay is None:
+                    self.exhausted += 1
+                    raise
+                logger.warning(f"Upstream connection failed, retrying: {str(e)}")
+            except BaseException:
+                self.limiter.release()
+                raise
+            else:
+                self.limiter.on_success(time.monotonic() - started)
+                return result, self._releaser()
+            tries += 1
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+    def _after_failure(self, overload: bool, retry_after: Optional[float], tries: int) -> Optional[float]:
+        """Delay before the next attempt, or None to give up."""
+        if overload:
+            self.throttled += 1
+            self.limiter.on_overload()
+        if tries >= self.max_retries:
+            return None
+        if retry_after is not None:
+            if retry_after > self.max_retry_delay:
+                return None
+            # Spread the herd that got the same hint
+            return retry_after + random.uniform(0, min(1.0, retry_after * 0.2 + 0.05))
+        return random.uniform(0, min(self.max_retry_delay, self.base_delay * (2 ** tries)))
+
+    def _releaser(self) -> Callable[[], None]:
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                self.limiter.release()
+        return release
+
+    def stats(self) -> Dict[str, object]:
+        """Limit, queue and retry counters for monitoring."""
+        return {
+            **self.limiter.stats(),
+            "calls": self.calls,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "retries_exhausted": self.exhausted,
+        }
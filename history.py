@@ -0,0 +1,297 @@
+"""
+Token-budgeted conversation windowing for chat requests.
+
+The browser resends the whole conversation on every turn. A history policy
+keeps the system messages plus the most recent turns that fit a prompt token
+budget. With the `summary` policy, turns that fall out of the window are
+compacted into a rolling summary; the summary is computed in the background
+and cached per session, so a turn never waits for it. Conversations without
+a session are cached under a hash of the exact turns summarized, so a
+summary is only ever served for the same text it was made from; the next
+turn finds it through the hash of its own longest earlier prefix and folds
+in only the newly dropped turns.
+
+Policies:
+- `full`: forward the history unchanged (previous behaviour)
+- `window`: drop the oldest turns beyond the budget
+- `summary`: like `window`, plus a cached summary of the dropped turns
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import re
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+try:
+    import tiktoken
+except ImportError:  # optional: fall back to the local estimator below
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+HISTORY_POLICIES = ("full", "window", "summary")
+
+# Per-message framing overhead of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMING_TOKENS = 2
+
+_PIECE_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+SUMMARY_INSTRUCTIONS = (
+    "Summarize the conversation between a client and a legal assistant in a few "
+    "sentences, in the language of the conversation. Keep names, dates, amounts, "
+    "the client's situation and open questions. If a previous summary is given, "
+    "extend it with the new turns."
+)
+
+
+def build_summary_messages(dropped: List[Dict[str, object]], previous: str = "") -> List[Dict[str, str]]:
+    """
+    Build the upstream prompt that folds dropped turns into a summary.
+
+    Args:
+        dropped: Turns that no longer fit the window and are not summarized yet
+        previous: Existing rolling summary, if any
+
+    Returns:
+        Messages for a plain (ungrounded) chat completion.
+    """
+    transcript = "\n".join(
+        f"{m.get('role')}: {m.get('content') if isinstance(m.get('content'), str) else json.dumps(m.get('content'), ensure_ascii=False)}"
+        for m in dropped
+    )
+    if previous:
+        transcript = f"Previous summary: {previous}\n\n{transcript}"
+    return [
+        {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+        {"role": "user", "content": transcript},
+    ]
+
+
+class TokenCounter:
+    """Count prompt tokens with tiktoken when available, else a local estimate."""
+
+    def __init__(self, encoding_name: str = "o200k_base"):
+        self._encoding = None
+        if tiktoken is not None:
+            try:
+                self._encoding = tiktoken.get_encoding(encoding_name)
+            except Exception as e:
+                logger.warning(f"tiktoken encoding unavailable, using estimator: {str(e)}")
+
+    @property
+    def exact(self) -> bool:
+        return self._encoding is not None
+
+    def count_text(self, text) -> int:
+        """Tokens in a message content (string or multimodal parts)."""
+        if not isinstance(text, str):
+            text = json.dumps(text, ensure_ascii=False)
+        if self._encoding is not None:
+            return len(self._encoding.encode(text))
+        # BPE vocabularies split long and non-Latin words into several
+        # pieces. Err on the high side so the budget is never exceeded:
+        # Cyrillic words take up to one token per 2 characters, Latin words
+        # and numbers rarely more than one per 3.
+        return sum(math.ceil(len(piece) / (3 if piece.isascii() else 2)) for piece in _PIECE_RE.findall(text))
+
+    def count_message(self, message: Dict[str, object]) -> int:
+        return MESSAGE_OVERHEAD_TOKENS + self.count_text(message.get("content", ""))
+
+    def count_messages(self, messages: List[Dict[str, object]]) -> int:
+        return REPLY_PRIMING_TOKENS + sum(self.count_message(m) for m in messages)
+
+
+class HistoryWindow:
+    """Outcome of applying a policy to one request."""
+
+    __slots__ = ("messages", "policy", "prompt_tokens", "dropped_messages", "summarized", "estimated")
+
+    def __init__(self, messages, policy, prompt_tokens, dropped_messages=0, summarized=False, estimated=False):
+        self.messages = messages
+        self.policy = policy
+        self.prompt_tokens = prompt_tokens
+        self.dropped_messages = dropped_messages
+        self.summarized = summarized
+        self.estimated = estimated
+
+    def metadata(self) -> Dict[str, object]:
+        return {
+            "history_policy": self.policy,
+            "prompt_tokens": self.prompt_tokens,
+            "prompt_tokens_estimated": self.estimated,
+            "dropped_messages": self.dropped_messages,
+            "summarized": self.summarized,
+        }
+
+
+def prefix_keys(system: List[Dict[str, object]], dropped: List[Dict[str, object]]) -> List[str]:
+    """
+    Summary keys of a conversation without a session, one per prefix boundary.
+
+    Element ``k - 1`` hashes the system messages plus ``dropped[:k]``; the
+    hash is extended message by message, so all boundaries cost one pass.
+
+    Args:
+        system: Leading system messages
+        dropped: Turns that fell out of the window, oldest first
+
+    Returns:
+        One key per dropped turn; the last one covers the whole prefix.
+    """
+    digest = hashlib.sha256()
+    for message in system:
+        digest.update(_prefix_material(message))
+    keys = []
+    for message in dropped:
+        digest.update(_prefix_material(message))
+        keys.append("prefix:" + digest.copy().hexdigest())
+    return keys
+
+
+def _prefix_material(message: Dict[str, object]) -> bytes:
+    return (json.dumps([message.get("role"), message.get("content")], ensure_ascii=False) + "\n").encode("utf-8")
+
+
+class SummaryStore:
+    """Rolling summaries per conversation, bounded LRU."""
+
+    def __init__(self, max_conversations: int = 1000):
+        self.max_conversations = max_conversations
+        self._summaries: "OrderedDict[str, Tuple[int, str]]" = OrderedDict()
+        self._pending = set()
+
+    def get(self, key: str) -> Optional[Tuple[int, str]]:
+        """Return (number of messages covered, summary) for a conversation."""
+        value = self._summaries.get(key)
+        if value is not None:
+            self._summaries.move_to_end(key)
+        return value
+
+    def put(self, key: str, covered: int, summary: str) -> None:
+        self._summaries[key] = (covered, summary)
+        self._summaries.move_to_end(key)
+        while len(self._summaries) > self.max_conversations:
+            self._summaries.popitem(last=False)
+
+    def claim(self, key: str) -> bool:
+        if key in self._pending:
+            return False
+        self._pending.add(key)
+        return True
+
+    def release(self, key: str) -> None:
+        self._pending.discard(key)
+
+    def __len__(self) -> int:
+        return len(self._summaries)
+
+
+class HistoryPolicy:
+    """Apply one windowing policy within a prompt token budget."""
+
+    def __init__(
+        self,
+        policy: str,
+        prompt_budget: int,
+        counter: TokenCounter,
+        summaries: Optional[SummaryStore] = None,
+        summary_max_tokens: int = 300,
+        summarizer: Optional[Callable[[List[Dict[str, object]], str], Awaitable[str]]] = None,
+        spawn: Optional[Callable[[Awaitable], None]] = None,
+    ):
+        if policy not in HISTORY_POLICIES:
+            raise ValueError(f"Unknown history policy: {policy}")
+        self.policy = policy
+        self.prompt_budget = prompt_budget
+        self.counter = counter
+        self.summaries = summaries
+        self.summary_max_tokens = summary_max_tokens
+        self.summarizer = summarizer
+        self.spawn = spawn or (lambda coro: asyncio.ensure_future(coro))
+
+    def apply(self, messages: List[Dict[str, object]], conversation_id: Optional[str] = None) -> HistoryWindow:
+        """
+        Fit a conversation into the prompt budget.
+
+        Leading system messages and the latest message are always kept; older
+        turns are dropped from the front until the rest fits.
+
+        Args:
+            messages: Full upstream message list, system prompt included
+            conversation_id: Key for the rolling summary (session id); without
+                one the summary is keyed on the exact dropped prefix and
+                the longest earlier prefix's summary is extended
+
+        Returns:
+            HistoryWindow with the messages to send and its token count.
+        """
+        if self.policy == "full":
+            return HistoryWindow(messages, self.policy, self.counter.count_messages(messages),
+                                 estimated=not self.counter.exact)
+
+        head = 0
+        while head < len(messages) - 1 and messages[head].get("role") == "system":
+            head += 1
+        system, turns = messages[:head], messages[head:]
+
+        budget = self.prompt_budget - self.counter.count_messages(system)
+        if self.policy == "summary":
+            budget -= self.summary_max_tokens + MESSAGE_OVERHEAD_TOKENS
+
+        kept = []
+        used = 0
+        for message in reversed(turns):
+            cost = self.counter.count_message(message)
+            if kept and used + cost > budget:
+                break
+            kept.append(message)
+            used += cost
+        kept.reverse()
+        dropped = turns[:len(turns) - len(kept)]
+
+        summarized = False
+        if dropped and self.policy == "summary" and self.summaries is not None:
+            if conversation_id:
+                key = conversation_id
+                cached = self.summaries.get(key)
+            else:
+                # Never key on partial content (e.g. the first question): two visitors
+                # opening alike would be served each other's summaries. The previous
+                # turn summarized a shorter prefix, so take the longest one cached.
+                keys = prefix_keys(system, dropped)
+                key = keys[-1]
+                cached = None
+                for candidate in reversed(keys):
+                    cached = self.summaries.get(candidate)
+                    if cached is not None:
+                        break
+            if cached is not None:
+                system = system + [{"role": "system", "content": SUMMARY_PREFIX + cached[1]}]
+                summarized = True
+            if (cached is None or cached[0] < len(dropped)) and self.summarizer is not None:
+                if self.summaries.claim(key):
+                    self.spawn(self._update_summary(key, dropped, cached))
+
+        window = system + kept
+        return HistoryWindow(window, self.policy, self.counter.count_messages(window), len(dropped), summarized,
+                             estimated=not self.counter.exact)
+
+    async def _update_summary(self, key: str, dropped: List[Dict[str, object]],
+                              cached: Optional[Tuple[int, str]]) -> None:
+        """Fold newly dropped turns into the conversation's rolling summary."""
+        try:
+            covered, previous = cached if cached is not None else (0, "")
+            summary = await self.summarizer(dropped[covered:], previous)
+            if summary:
+                self.summaries.put(key, len(dropped), summary.strip())
+        except Exception as e:
+            logger.error(f"Failed to summarize conversation history: {str(e)}")
+        finally:
+            self.summaries.release(key)
@@ -0,0 +1,418 @@
+"""
+Incremental document ingestion for the local retrieval index.
+
+Reads PDF, DOCX, TXT and Markdown files under a source directory, splits
+them into overlapping chunks, embeds the chunks and publishes a new index
+generation that running servers pick up without a restart:
+
+    retrieval_index/
+        index.json      active generation (replaced atomically)
+        ingest.json     content-hash manifest: file -> sha256, shard, rows
+        shards/000001/  chunks.jsonl + embeddings.f32 (raw float32 rows)
+        generations/<id>/
+                        assembled index (see retrieval.py)
+
+Extraction, normalization, chunking and embedding run in a process pool.
+A re-run hashes the sources and only processes new or changed files; their
+chunks are appended to a new shard. Unchanged files keep their chunks and
+embeddings from earlier shards, so only BM25 statistics are rebuilt when
+the generation is assembled. Shards with no live rows and all but the
+previous generation are deleted after the swap.
+
+Usage:
+    python ingest.py documents/ [--index retrieval_index] [--embedder hashing|azure]
+                     [--workers 4] [--chunk-words 300] [--overlap-words 50] [--full]
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import time
+import unicodedata
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+from xml.etree import ElementTree
+
+import numpy as np
+
+from config import get_config
+from embeddings import HashingEmbedder, create_embedder
+from retrieval import INDEX_MANIFEST, write_index
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # optional: PDFs are skipped without it
+    PdfReader = None
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = {".pdf", ".docx", ".txt", ".md", ".markdown"}
+INGEST_MANIFEST = "ingest.json"
+SHARDS_DIR = "shards"
+GENERATIONS_DIR = "generations"
+
+_WORD_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_HYPHENATION_RE = re.compile(r"(\w)-\n(\w)")
+_INLINE_SPACE_RE = re.compile(r"[ \t\f\v]+")
+_PARAGRAPH_BREAK_RE = re.compile(r"\n\s*\n+")
+
+
+class IngestError(Exception):
+    """A source file could not be read."""
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def extract_text(path: str) -> str:
+    """
+    Plain text of a document.
+
+    Raises:
+        IngestError: If the format is unsupported or the file is unreadable.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        if ext in (".txt", ".md", ".markdown"):
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                return f.read()
+        if ext == ".docx":
+            with zipfile.ZipFile(path) as archive:
+                root = ElementTree.fromstring(archive.read("word/document.xml"))
+            paragraphs = []
+            for paragraph in root.iter(f"{_WORD_NAMESPACE}p"):
+                parts = []
+                for node in paragraph.iter():
+                    if node.tag == f"{_WORD_NAMESPACE}t" and node.text:
+                        parts.append(node.text)
+                    elif node.tag in (f"{_WORD_NAMESPACE}tab", f"{_WORD_NAMESPACE}br"):
+                        parts.append(" ")
+                paragraphs.append("".join(parts))
+            return "\n\n".join(paragraphs)
+        if ext == ".pdf":
+            if PdfReader is None:
+                raise IngestError("pypdf is not installed")
+            return "\n\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+    except (OSError, KeyError, zipfile.BadZipFile, ElementTree.ParseError) as e:
+        raise IngestError(str(e)) from e
+    raise IngestError(f"Unsupported file type {ext}")
+
+
+def normalize_text(text: str) -> List[str]:
+    """NFKC-normalize, undo line-end hyphenation and return non-empty paragraphs."""
+    text = unicodedata.normalize("NFKC", text).replace("\u00ad", "").replace("\r\n", "\n")
+    text = _HYPHENATION_RE.sub(r"\1\2", text)
+    paragraphs = []
+    for block in _PARAGRAPH_BREAK_RE.split(text):
+        paragraph = _INLINE_SPACE_RE.sub(" ", block.replace("\n", " ")).strip()
+        if paragraph:
+            paragraphs.append(paragraph)
+    return paragraphs
+
+
+def chunk_paragraphs(paragraphs: List[str], chunk_words: int = 300, overlap_words: int = 50) -> List[str]:
+    """Pack paragraphs into chunks of about `chunk_words` words, overlapping by `overlap_words`."""
+    words: List[str] = []
+    for paragraph in paragraphs:
+        words.extend(paragraph.split(" "))
+    if not words:
+        return []
+    step = max(1, chunk_words - overlap_words)
+    chunks = []
+    for start in range(0, len(words), step):
+        chunks.append(" ".join(words[start:start + chunk_words]))
+        if start + chunk_words >= len(words):
+            break
+    return chunks
+
+
+def document_title(rel_path: str, paragraphs: List[str]) -> str:
+    """First Markdown heading, else the file name."""
+    if rel_path.lower().endswith((".md", ".markdown")) and paragraphs and paragraphs[0].startswith("#"):
+        return paragraphs[0].lstrip("#").strip()
+    return os.path.splitext(os.path.basename(rel_path))[0]
+
+
+def process_file(path: str, rel_path: str, sha256: str, embedder_spec: Dict[str, object],
+                 chunk_words: int, overlap_words: int) -> Tuple[str, List[Dict[str, object]], "np.ndarray"]:
+    """
+    Worker: extract, normalize, chunk and embed one file.
+
+    Returns:
+        Tuple of (rel_path, chunk records, float32 embeddings with one row per chunk)
+    """
+    paragraphs = normalize_text(extract_text(path))
+    title = document_title(rel_path, paragraphs)
+    records = [
+        {"id": f"{sha256[:12]}-{i}", "title": title, "filepath": rel_path, "url": "", "content": content}
+        for i, content in enumerate(chunk_paragraphs(paragraphs, chunk_words, overlap_words))
+    ]
+    embedder = create_embedder(embedder_spec, os.environ.get("AZURE_OPENAI_ENDPOINT", ""),
+                               os.environ.get("AZURE_OPENAI_KEY", ""))
+    vectors = embedder.embed([f"{title}\n{record['content']}" for record in records]) if records \
+        else np.zeros((0, 0), dtype=np.float32)
+    return rel_path, records, np.asarray(vectors, dtype=np.float32)
+
+
+class ShardWriter:
+    """Appends chunk records and embedding rows to a new shard."""
+
+    def __init__(self, root: str, name: str):
+        self.name = name
+        self.path = os.path.join(root, SHARDS_DIR, name)
+        os.makedirs(self.path, exist_ok=False)
+        self.rows = 0
+        self.dimensions = 0
+        self._chunks = open(os.path.join(self.path, "chunks.jsonl"), "ab")
+        self._embeddings = open(os.path.join(self.path, "embeddings.f32"), "ab")
+
+    def append(self, records: List[Dict[str, object]], vectors: "np.ndarray") -> Tuple[int, int]:
+        """Append one file's chunks; returns its row range."""
+        if len(records) and self.dimensions and vectors.shape[1] != self.dimensions:
+            raise ValueError(f"Embedding dimensions changed from {self.dimensions} to {vectors.shape[1]}")
+        start = self.rows
+        for record in records:
+            self._chunks.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+        if len(records):
+            self.dimensions = int(vectors.shape[1])
+            self._embeddings.write(np.ascontiguousarray(vectors, dtype="<f4").tobytes())
+        self.rows += len(records)
+        # Rows are durable before the manifest refers to them
+        self._chunks.flush()
+        self._embeddings.flush()
+        return start, self.rows
+
+    def close(self) -> None:
+        self._chunks.close()
+        self._embeddings.close()
+        with open(os.path.join(self.path, "shard.json"), "w", encoding="utf-8") as f:
+            json.dump({"rows": self.rows, "dimensions": self.dimensions}, f)
+
+
+def read_shard_rows(root: str, shard: str, rows: List[Tuple[int, int]]) -> Tuple[List[Dict[str, object]], "np.ndarray"]:
+    """Records and embeddings of the given row ranges of a shard."""
+    path = os.path.join(root, SHARDS_DIR, shard)
+    with open(os.path.join(path, "shard.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    with open(os.path.join(path, "chunks.jsonl"), "rb") as f:
+        lines = f.read().splitlines()[:meta["rows"]]
+    wanted = [i for start, end in rows for i in range(start, end)]
+    records = [json.loads(lines[i]) for i in wanted]
+    if not meta["dimensions"] or not wanted:
+        return records, np.zeros((len(wanted), meta["dimensions"]), dtype=np.float32)
+    matrix = np.memmap(os.path.join(path, "embeddings.f32"), dtype="<f4", mode="r",
+                       shape=(meta["rows"], meta["dimensions"]))
+    return records, np.asarray(matrix[wanted], dtype=np.float32)
+
+
+def supported_extensions() -> set:
+    """File types this installation can read (PDF needs pypdf)."""
+    return SUPPORTED_EXTENSIONS if PdfReader is not None else SUPPORTED_EXTENSIONS - {".pdf"}
+
+
+def scan_sources(source: str) -> Dict[str, str]:
+    """Readable files under a directory: rel_path -> absolute path."""
+    extensions = supported_extensions()
+    files = {}
+    for root, _, names in os.walk(source):
+        for name in sorted(names):
+            if os.path.splitext(name)[1].lower() in extensions:
+                path = os.path.join(root, name)
+                files[os.path.relpath(path, source).replace(os.sep, "/")] = os.path.abspath(path)
+    return files
+
+
+def unreadable_here(source: str, rel_path: str) -> bool:
+    """Whether an indexed file still exists but is of a type this installation cannot read."""
+    return (os.path.splitext(rel_path)[1].lower() not in supported_extensions()
+            and os.path.isfile(os.path.join(source, rel_path)))
+
+
+def write_json_atomic(path: str, data: Dict[str, object]) -> None:
+    """Write a JSON file via a temporary file and an atomic rename."""
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load_manifest(index_path: str) -> Dict[str, object]:
+    try:
+        with open(os.path.join(index_path, INGEST_MANIFEST), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"embedder": None, "files": {}}
+
+
+def ingest(source: str, index_path: str, embedder_spec: Dict[str, object], workers: Optional[int] = None,
+           chunk_words: int = 300, overlap_words: int = 50, full: bool = False) -> Dict[str, object]:
+    """
+    Bring the index at `index_path` up to date with the documents under `source`.
+
+    Returns:
+        Summary of the run (files processed, removed, failed; chunks; generation).
+    """
+    os.makedirs(index_path, exist_ok=True)
+    manifest = load_manifest(index_path)
+    if full or manifest.get("embedder") != embedder_spec:
+        carried = {}
+        if manifest.get("files"):
+            logger.info("Embedder changed or full run requested: re-processing every file")
+            if manifest.get("embedder") == embedder_spec:
+                # Files this installation cannot read (PDF without pypdf) keep their chunks
+                carried = {rel_path: entry for rel_path, entry in manifest["files"].items()
+                           if unreadable_here(source, rel_path)}
+            elif any(unreadable_here(source, rel_path) for rel_path in manifest["files"]):
+                logger.warning("Embedder changed: indexed files this installation cannot read are dropped")
+        manifest = {"embedder": embedder_spec, "files": carried}
+    known: Dict[str, Dict[str, object]] = manifest["files"]
+
+    sources = scan_sources(source)
+    changed: Dict[str, Tuple[str, str]] = {}
+    for rel_path, path in sources.items():
+        stat = os.stat(path)
+        entry = known.get(rel_path)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            continue
+        sha256 = file_sha256(path)
+        if entry and entry["sha256"] == sha256:
+            # Touched but identical: refresh the stat fields only
+            entry.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+            continue
+        changed[rel_path] = (path, sha256)
+    # A file is only removed when it is gone, not when it cannot be read here
+    kept = [rel_path for rel_path in known if rel_path not in sources and unreadable_here(source, rel_path)]
+    if kept:
+        logger.warning(f"Keeping {len(kept)} indexed files of types this installation cannot read "
+                       f"(install pypdf to update them)")
+    removed = [rel_path for rel_path in known if rel_path not in sources and rel_path not in kept]
+    for rel_path in removed:
+        del known[rel_path]
+
+    summary = {"files": len(sources), "processed": 0, "removed": len(removed), "kept": len(kept), "failed": 0,
+               "chunks": 0, "generation": None}
+    if not changed and not removed and os.path.exists(os.path.join(index_path, INDEX_MANIFEST)):
+        write_json_atomic(os.path.join(index_path, INGEST_MANIFEST), manifest)
+        logger.info(f"Index is up to date ({len(sources)} files)")
+        return summary
+
+    if changed:
+        existing = os.listdir(os.path.join(index_path, SHARDS_DIR)) if os.path.isdir(
+            os.path.join(index_path, SHARDS_DIR)) else []
+        shard_name = f"{max([int(name) for name in existing if name.isdigit()] or [0]) + 1:06d}"
+        shard = ShardWriter(index_path, shard_name)
+        started = time.perf_counter()
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    pool.submit(process_file, path, rel_path, sha256, embedder_spec, chunk_words, overlap_words): rel_path
+                    for rel_path, (path, sha256) in changed.items()
+                }
+                for future in as_completed(futures):
+                    rel_path = futures[future]
+                    try:
+                        _, records, vectors = future.result()
+                    except Exception as e:
+                        # The previous version of the file (if any) stays in the index
+                        summary["failed"] += 1
+                        logger.error(f"Skipping {rel_path}: {str(e)}")
+                        continue
+                    start, end = shard.append(records, vectors)
+                    stat = os.stat(changed[rel_path][0])
+                    known[rel_path] = {"sha256": changed[rel_path][1], "size": stat.st_size,
+                                       "mtime_ns": stat.st_mtime_ns, "shard": shard_name, "rows": [start, end]}
+                    summary["processed"] += 1
+                    logger.info(f"Ingested {rel_path}: {end - start} chunks")
+        finally:
+            shard.close()
+        logger.info(f"Processed {summary['processed']} files in {time.perf_counter() - started:.1f}s")
+
+    summary["generation"], summary["chunks"] = publish(index_path, manifest)
+    write_json_atomic(os.path.join(index_path, INGEST_MANIFEST), manifest)
+    collect_garbage(index_path, manifest, summary["generation"])
+    return summary
+
+
+def publish(index_path: str, manifest: Dict[str, object]) -> Tuple[str, int]:
+    """Assemble the live chunks into a new generation and swap it in atomically."""
+    by_shard: Dict[str, List[Tuple[int, int]]] = {}
+    for entry in sorted(manifest["files"].values(), key=lambda entry: (entry["shard"], entry["rows"][0])):
+        by_shard.setdefault(entry["shard"], []).append(tuple(entry["rows"]))
+    records: List[Dict[str, object]] = []
+    matrices = []
+    for shard, rows in sorted(by_shard.items()):
+        shard_records, shard_vectors = read_shard_rows(index_path, shard, rows)
+        records.extend(shard_records)
+        if len(shard_records):
+            matrices.append(shard_vectors)
+    embeddings = np.concatenate(matrices) if matrices and all(m.shape[1] for m in matrices) else None
+
+    generation = time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+    target = os.path.join(index_path, GENERATIONS_DIR, generation)
+    index_manifest = write_index(target, records, embeddings, embedder=manifest["embedder"])
+    # One rename replaces the pointer: readers see the old or the new index, never a mix
+    write_json_atomic(os.path.join(index_path, INDEX_MANIFEST),
+                      {**index_manifest, "directory": f"{GENERATIONS_DIR}/{generation}"})
+    logger.info(f"Published generation {generation}: {len(records)} chunks")
+    return generation, len(records)
+
+
+def collect_garbage(index_path: str, manifest: Dict[str, object], current: str, keep_generations: int = 2) -> None:
+    """Delete shards without live rows and generations older than the previous one."""
+    live_shards = {entry["shard"] for entry in manifest["files"].values()}
+    shards_dir = os.path.join(index_path, SHARDS_DIR)
+    for name in os.listdir(shards_dir) if os.path.isdir(shards_dir) else []:
+        if name not in live_shards:
+            shutil.rmtree(os.path.join(shards_dir, name), ignore_errors=True)
+    generations_dir = os.path.join(index_path, GENERATIONS_DIR)
+    # Keep the previous generation for servers that have not reloaded yet
+    older = [name for name in sorted(os.listdir(generations_dir)) if name != current]
+    for name in older[:max(0, len(older) - (keep_generations - 1))]:
+        shutil.rmtree(os.path.join(generations_dir, name), ignore_errors=True)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    config = get_config()
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("source", help="Directory with PDF, DOCX, TXT and Markdown documents")
+    parser.add_argument("--index", default=config.RETRIEVAL_INDEX_PATH, help="Index directory")
+    parser.add_argument("--embedder", choices=("hashing", "azure"), default="azure",
+                        help="hashing: deterministic and offline; azure: AZURE_OPENAI_EMBEDDING_DEPLOYMENT")
+    parser.add_argument("--dimensions", type=int, default=256, help="Dimensions of the hashing embedder")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--chunk-words", type=int, default=300, help="Words per chunk")
+    parser.add_argument("--overlap-words", type=int, default=50, help="Words shared by consecutive chunks")
+    parser.add_argument("--full", action="store_true", help="Ignore the manifest and re-process every file")
+    args = parser.parse_args(argv)
+
+    if args.embedder == "hashing":
+        spec = HashingEmbedder(args.dimensions).spec()
+    else:
+        spec = {"name": "azure", "deployment": config.EMBEDDING_DEPLOYMENT}
+        if not (config.AZURE_OPENAI_ENDPOINT and config.AZURE_OPENAI_KEY):
+            logger.error("The azure embedder needs AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_KEY")
+            return 2
+    if PdfReader is None:
+        logger.warning("pypdf is not installed: PDF files are not ingested")
+
+    summary = ingest(args.source, args.index, spec, args.workers, args.chunk_words, args.overlap_words, args.full)
+    logger.info(f"Ingestion finished: {json.dumps(summary)}")
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    sys.exit(main())
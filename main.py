@@ -13,16 +13,47 @@ Security considerations:
 """
 
 import os
+import math
+import time
+import signal
+import asyncio
 import logging
-from typing import Dict, Optional
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Mapping, Optional
+from fastapi import FastAPI, HTTPException, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from dotenv import load_dotenv
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
+import codec
 from config import get_config
-import aiohttp
+from config_snapshot import CONFIG_CACHE_CONTROL, ConfigSnapshot, etag_matches
+from request_template import SEARCH_REDUCED_TOP_N_DOCUMENTS, SEARCH_TOP_N_DOCUMENTS
+from upstream import UpstreamPool
+from endpoints import EndpointRouter, UpstreamTarget
+from gateway import (RETRYABLE_STATUSES, GatewayBusy, UpstreamGateway, UpstreamStatusError,
+                     parse_retry_after)
+from streaming import (SSE_HEADERS, SSE_MEDIA_TYPE, ReleasingStream, await_first_token, collect_reply,
+                       context_event, prepend_events, relay_chat_stream, tap_citations, watch_disconnect)
+from deadline import (DEADLINE_HEADER, DEGRADED_REDUCED_SEARCH, DEGRADED_SEARCH_TIMEOUT, Deadline,
+                      ResponseTimeout, SearchFallback, mark_responded)
+from speech import speech_events, speech_stream
+from answer_cache import AnswerCache, answer_cache_key
+from cache_backend import TieredCache
+from singleflight import SingleFlight
+from history import HistoryPolicy, SummaryStore, TokenCounter, build_summary_messages
+from sessions import Session, SessionStore
+from chat_socket import ChatSocket, ChatSocketRegistry
+from page_cache import PageCache
+from assets import AssetManifest, FingerprintedStaticFiles
+from retrieval import LocalRetriever, format_sources
+from embeddings import EmbeddingClient, EmbeddingError, HashingEmbedder
+from citation_cache import MODE_MERGE, MODE_REUSE, MODE_SEARCH, CitationCache
+from metrics import (CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, MetricsRegistry, current_timer,
+                     phase, record_phase, set_label, timed_handler)
+from structured_logging import RequestIdMiddleware, configure_logging
+from traffic_capture import CaptureMiddleware, TrafficCapture
+from warmup import UpstreamProber, WarmupState
 
 # Load environment variables from .env file (if it exists)
 try:
@@ -34,18 +65,174 @@ except Exception:
 # Get configuration based on environment
 config = get_config()
 
-# Configure logging
-logging.basicConfig(
-    level=getattr(logging, config.LOG_LEVEL),
-    format=config.LOG_FORMAT
-)
+# Configure logging: written off the event loop, sampled on the chat hot path
+logging_pipeline = configure_logging(config)
 logger = logging.getLogger(__name__)
+# Citation contents and answer text are only logged when explicitly enabled
+log_content = config.LOG_CONTENT_DEBUG
+
+# JSON codec for upstream payloads (orjson when installed)
+codec.use_codec(config.JSON_CODEC)
+
+# Azure and avatar settings, swapped atomically on reload (SIGHUP or admin endpoint)
+config_snapshot = ConfigSnapshot.from_environ()
+
+# Per-worker connection pool for Azure OpenAI, opened and closed by the lifespan
+upstream_pool = UpstreamPool.from_config(config)
+
+# Adaptive concurrency limit, wait queue and retries for upstream calls
+upstream_gateway = UpstreamGateway.from_config(config)
+
+# Latency-aware routing, circuit breakers and hedging across Azure OpenAI endpoints
+endpoint_router = EndpointRouter.from_config(config)
+
+# Deadline sub-budget and degraded mode of the grounded (Azure Search) path
+search_fallback = SearchFallback.from_config(config)
+
+# Shared L2 of the answer and query embedding caches (None: per-worker caches only)
+shared_cache = TieredCache.from_config(config)
+
+# Retrieval for the grounded path: Azure Search data_sources or the local hybrid index
+retrieval_backend = config.RETRIEVAL_BACKEND
+local_retriever = LocalRetriever.from_config(config)
+embedding_client = EmbeddingClient.from_config(config, shared_cache)
+
+# Per-worker answer cache for non-streamed /chat and /simple-chat turns
+# (the L1 in front of the shared cache, when one is configured)
+answer_cache = AnswerCache.from_config(config)
+answer_cache_enabled = config.ANSWER_CACHE_ENABLED
+
+# Coalesces identical in-flight upstream calls (JSON and streamed)
+single_flight = SingleFlight()
+single_flight_enabled = config.SINGLE_FLIGHT_ENABLED
+
+# Server-side conversation history, so clients send only the new turn
+session_store = SessionStore.from_config(config)
+
+# Open /ws/chat connections, one per session
+chat_sockets = ChatSocketRegistry()
+
+# Documents retrieved for each session, reused to ground follow-up questions
+citation_cache = CitationCache.from_config(config, SEARCH_TOP_N_DOCUMENTS)
+
+# Per-phase latency histograms of chat requests (/metrics, Server-Timing)
+metrics_registry = MetricsRegistry.from_config(config)
+CHAT_PATHS = ("/chat", "/chat/speech-stream", "/simple-chat")
+
+# Sampled, sanitized chat requests written for offline replay (None unless enabled)
+traffic_capture = TrafficCapture.from_config(config)
+
+# HTML pages served from memory with precompressed variants
+HTML_PAGES = (
+    "chat-auto.html", "chat-with-api.html", "chat.html", "avatar-debug.html",
+    "test-config.html", "test-search.html", "test-chat-api.html", "test-vector-db.html",
+    "test-simple-chat.html", "test-azure-search.html",
+)
+asset_manifest = AssetManifest(("css", "js", "image"))
+asset_manifest.build()
+# With auto reload (development) pages keep plain asset URLs, so edited assets show up
+page_cache = PageCache(
+    auto_reload=config.PAGE_CACHE_AUTO_RELOAD,
+    transform=None if config.PAGE_CACHE_AUTO_RELOAD else asset_manifest.rewrite_html
+)
+for page in HTML_PAGES:
+    page_cache.register(page)
+
+# Strong references to fire-and-forget tasks (cache refreshes)
+background_tasks = set()
+
+# Warm-up before serving (/ready) and cached upstream probes (/health/deep)
+warmup_state = WarmupState()
+upstream_prober = UpstreamProber.from_config(config)
+
+
+async def warm_up_worker() -> None:
+    """Open warm upstream connections and touch the caches before the worker serves traffic."""
+    with warmup_state.step("upstream"):
+        await upstream_prober.probe(upstream_pool.session, config_snapshot, config.WARMUP_CONNECTIONS)
+    with warmup_state.step("caches"):
+        # Pages and the asset manifest are built at import; a page that failed to load is retried
+        pages = sum(1 for page in HTML_PAGES if page_cache.get(page) is not None)
+        snapshot = config_snapshot
+        # First renders and JSON round trips pay for lazy imports and codec setup
+        sample = [{"role": "user", "content": "warm-up"}]
+        for template in (snapshot.plain_template, snapshot.grounded_template, snapshot.reduced_template):
+            if template is not None:
+                codec.loads(template.render(template.prepend_system(sample), False, 1, 0.0))
+        if local_retriever.ready:
+            # Faults in the memory-mapped index
+            local_retriever.search("warm-up", None, 1)
+        logger.info(f"Caches warm: {pages}/{len(HTML_PAGES)} pages, "
+                    f"{asset_manifest.stats()['assets']} assets, config {snapshot.public_etag}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open shared upstream resources on startup and release them on shutdown."""
+    await upstream_pool.start()
+    index_watcher = None
+    if retrieval_backend == "local":
+        local_retriever.load()
+        if config.RETRIEVAL_RELOAD_INTERVAL > 0:
+            # Picks up indexes published by ingest.py
+            index_watcher = asyncio.ensure_future(local_retriever.watch(config.RETRIEVAL_RELOAD_INTERVAL))
+    if traffic_capture is not None:
+        traffic_capture.writer.start()
+    warmup_state.begin()
+    if config.WARMUP_ENABLED:
+        # Runs before the server accepts connections on this worker
+        try:
+            await asyncio.wait_for(warm_up_worker(), config.WARMUP_TIMEOUT)
+            warmup_state.finish()
+        except asyncio.TimeoutError:
+            logger.warning(f"Warm-up did not finish within {config.WARMUP_TIMEOUT:.0f}s, serving anyway")
+            warmup_state.finish(timed_out=True)
+    else:
+        warmup_state.finish()
+    prober_task = None
+    if config.HEALTH_PROBE_INTERVAL > 0:
+        prober_task = asyncio.ensure_future(upstream_prober.run_periodically(
+            lambda: upstream_pool.session, lambda: config_snapshot, config.HEALTH_PROBE_INTERVAL
+        ))
+    metrics_flusher = None
+    if metrics_registry.multiprocess_dir:
+        metrics_flusher = asyncio.ensure_future(metrics_registry.flush_periodically(config.METRICS_FLUSH_INTERVAL))
+    loop = asyncio.get_running_loop()
+    sighup = getattr(signal, "SIGHUP", None)
+    if sighup is not None:
+        try:
+            loop.add_signal_handler(sighup, reload_on_signal)
+        except (NotImplementedError, RuntimeError):
+            # Not supported on this platform or outside the main thread
+            sighup = None
+    try:
+        yield
+    finally:
+        if sighup is not None:
+            loop.remove_signal_handler(sighup)
+        if index_watcher is not None:
+            index_watcher.cancel()
+        if prober_task is not None:
+            prober_task.cancel()
+        if metrics_flusher is not None:
+            metrics_flusher.cancel()
+        metrics_registry.flush()
+        if traffic_capture is not None:
+            await traffic_capture.writer.close()
+        await upstream_pool.close()
+        session_store.close()
+        embedding_client.close()
+        if shared_cache is not None:
+            await shared_cache.close()
+        logging_pipeline.stop()
+
 
 # Initialize FastAPI app
 app = FastAPI(
     title="Azure AI Avatar Configuration Service",
     description="Secure configuration endpoint for Azure AI Avatar applications",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware for browser access
@@ -57,10 +244,10 @@ app.add_middleware(
     allow_headers=config.CORS_ALLOW_HEADERS,
 )
 
-# Mount static files
-app.mount("/css", StaticFiles(directory="css"), name="css")
-app.mount("/js", StaticFiles(directory="js"), name="js")
-app.mount("/image", StaticFiles(directory="image"), name="image")
+# Mount static files (fingerprinted names are served from memory as immutable)
+app.mount("/css", FingerprintedStaticFiles(directory="css", manifest=asset_manifest), name="css")
+app.mount("/js", FingerprintedStaticFiles(directory="js", manifest=asset_manifest), name="js")
+app.mount("/image", FingerprintedStaticFiles(directory="image", manifest=asset_manifest), name="image")
 
 # Add security headers middleware (production only)
 if hasattr(config, 'SECURITY_HEADERS'):
@@ -71,6 +258,14 @@ if hasattr(config, 'SECURITY_HEADERS'):
             response.headers[header] = value
         return response
 
+# Outermost, so the request timer starts before any other middleware runs
+app.add_middleware(MetricsMiddleware, registry=metrics_registry, paths=CHAT_PATHS,
+                   server_timing=config.SERVER_TIMING_ENABLED)
+if traffic_capture is not None:
+    # Times the whole request, like the client saw it
+    app.add_middleware(CaptureMiddleware, capture=traffic_capture)
+app.add_middleware(RequestIdMiddleware)
+
 # Configuration model for response validation
 class ConfigurationResponse(BaseModel):
     """Response model for configuration endpoint."""
@@ -103,62 +298,88 @@ class SimpleChatRequest(BaseModel):
 
 
 class ChatRequest(BaseModel):
-    """Model for chat request."""
-    messages: list[ChatMessage]
+    """Model for chat request.
+    
+    Either the full `messages` history, or a `session_id` with only the new
+    turn in `message` (or `messages`); the server keeps the session history.
+    `deadline_ms` (or the `X-Deadline-Ms` header) bounds the whole turn.
+    """
+    messages: list[ChatMessage] = []
     stream: bool = False
     max_tokens: int = 500
     temperature: float = 0.7
+    session_id: Optional[str] = None
+    message: Optional[str] = None
+    deadline_ms: Optional[int] = None
+
+
+class SpeechStreamRequest(ChatRequest):
+    """Model for the sentence-level speech stream request."""
+    include_ssml: bool = True
 
 
 class ChatResponse(BaseModel):
     """Model for chat response."""
     response: str
     status: str = "success"
+    metadata: Optional[Dict[str, Any]] = None
+    session_id: Optional[str] = None
+    degraded: Optional[str] = None
+
 
+class SessionResponse(BaseModel):
+    """Model for a server-side chat session."""
+    session_id: str
+    messages: list[ChatMessage] = []
+    idle_timeout: float
 
-def load_configuration() -> Dict[str, Optional[str]]:
+
+def reload_config_snapshot() -> ConfigSnapshot:
     """
-    Load configuration from environment variables.
+    Re-read the environment (and .env, whose values win) into a new snapshot.
     
-    Returns:
-        Dict containing configuration values, with None for missing variables.
+    The global reference is replaced in one assignment; requests already
+    running keep the snapshot they started with.
     
-    Security note: This function safely retrieves configuration without
-    exposing sensitive data in logs or error messages.
+    Returns:
+        The new configuration snapshot
     """
-    config = {
-        "azure_speech_key": os.environ.get("AZURE_SPEECH_KEY"),
-        "azure_speech_region": os.environ.get("AZURE_SPEECH_REGION"),
-        "azure_openai_key": os.environ.get("AZURE_OPENAI_KEY"),
-        "azure_openai_endpoint": os.environ.get("AZURE_OPENAI_ENDPOINT"),
-        "azure_openai_deployment": os.environ.get("AZURE_OPENAI_DEPLOYMENT"),
-        "azure_system_prompt": os.environ.get("AZURE_SYSTEM_PROMPT"),
-        "azure_search_endpoint": os.environ.get("AZURE_SEARCH_ENDPOINT"),
-        "azure_search_api_key": os.environ.get("AZURE_SEARCH_API_KEY"),
-        "azure_search_index_name": os.environ.get("AZURE_SEARCH_INDEX_NAME"),
-        "avatar_character": os.environ.get("AVATAR_CHARACTER"),
-        "avatar_style": os.environ.get("AVATAR_STYLE"),
-        "voice_name": os.environ.get("VOICE_NAME"),
-        "stt_locale": os.environ.get("STT_LOCALE"),
-    }
-    
-    # Log configuration loading status (without exposing sensitive data)
-    loaded_count = sum(1 for value in config.values() if value is not None)
-    logger.info(f"Configuration loaded: {loaded_count}/{len(config)} environment variables found")
-    
-    return config
+    global config_snapshot
+    try:
+        load_dotenv(override=True)
+    except Exception:
+        # In Azure App Service, .env file might not exist - that's ok
+        pass
+    config_snapshot = ConfigSnapshot.from_environ()
+    logger.info("Configuration snapshot reloaded")
+    return config_snapshot
+
+
+def reload_on_signal() -> None:
+    """SIGHUP: reload the configuration snapshot, static assets, HTML pages and the local index."""
+    reload_config_snapshot()
+    asset_manifest.build()
+    page_cache.reload()
+    if retrieval_backend == "local":
+        local_retriever.load()
+
+
+def snapshot_response(http_request: Request, body: bytes, etag: str) -> Response:
+    """Serve a pre-encoded configuration body, or 304 if the client's copy is current."""
+    headers = {"ETag": etag, "Cache-Control": CONFIG_CACHE_CONTROL}
+    if etag_matches(http_request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 @app.get("/config", response_model=ConfigurationResponse)
-async def get_configuration():
+async def get_configuration(http_request: Request):
     """
     Get application configuration from environment variables.
     
     Returns:
-        JSON response containing configuration values.
-        
-    Raises:
-        HTTPException: If configuration loading fails.
+        JSON response containing configuration values, or 304 Not Modified
+        when `If-None-Match` carries the current ETag.
         
     Security considerations:
     - API keys are never logged to console
@@ -166,55 +387,36 @@ async def get_configuration():
     - No sensitive data is exposed in error messages
     - Sensitive keys are masked for security
     """
-    try:
-        config = load_configuration()
-        logger.info("Configuration endpoint accessed successfully")
-        
-        # SECURITY: Mask sensitive data before returning
-        safe_config = {
-            "azure_speech_key": "***MASKED***" if config.get("azure_speech_key") else None,
-            "azure_speech_region": config.get("azure_speech_region"),
-            "azure_openai_key": "***MASKED***" if config.get("azure_openai_key") else None,
-            "azure_openai_endpoint": config.get("azure_openai_endpoint"),
-            "azure_openai_deployment": config.get("azure_openai_deployment"),
-            "azure_system_prompt": config.get("azure_system_prompt"),
-            "azure_search_endpoint": config.get("azure_search_endpoint"),
-            "azure_search_api_key": "***MASKED***" if config.get("azure_search_api_key") else None,
-            "azure_search_index_name": config.get("azure_search_index_name"),
-            "avatar_character": config.get("avatar_character"),
-            "avatar_style": config.get("avatar_style"),
-            "voice_name": config.get("voice_name"),
-            "stt_locale": config.get("stt_locale"),
-        }
-        
-        return ConfigurationResponse(**safe_config)
-    except Exception as e:
-        logger.error(f"Failed to load configuration: {str(e)}")
-        raise HTTPException(
-            status_code=500,
-            detail="Failed to load configuration"
-        )
+    snapshot = config_snapshot
+    return snapshot_response(http_request, snapshot.public_body, snapshot.public_etag)
 
 
 @app.get("/internal/config")
-async def get_internal_configuration():
+async def get_internal_configuration(http_request: Request):
     """
     Internal endpoint for frontend to get actual configuration.
     This endpoint should not be publicly accessible.
     
     Returns:
-        JSON response containing actual configuration values for frontend use.
+        JSON response containing actual configuration values for frontend use,
+        or 304 Not Modified when `If-None-Match` carries the current ETag.
     """
-    try:
-        config = load_configuration()
-        logger.info("Internal configuration endpoint accessed")
-        return config
-    except Exception as e:
-        logger.error(f"Failed to load internal configuration: {str(e)}")
-        raise HTTPException(
-            status_code=500,
-            detail="Failed to load configuration"
-        )
+    snapshot = config_snapshot
+    return snapshot_response(http_request, snapshot.internal_body, snapshot.internal_etag)
+
+
+@app.post("/internal/config/reload")
+async def reload_configuration():
+    """
+    Internal endpoint to reload the configuration without a restart.
+    
+    Only the worker serving the request reloads; send SIGHUP to every
+    worker process to reload them all.
+    
+    Returns:
+        JSON response with the new snapshot's ETags.
+    """
+    return reload_config_snapshot().stats()
 
 
 @app.get("/health")
@@ -228,61 +430,273 @@ async def health_check():
     return {"status": "healthy", "service": "Azure AI Avatar Configuration Service"}
 
 
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness probe: whether this worker finished its warm-up.
+    
+    Returns:
+        200 with the warm-up steps and the worker's cold-start time once
+        ready (`warm` is false if a step failed or timed out), 503 while
+        warming up
+    """
+    stats = warmup_state.stats()
+    return JSONResponse(status_code=200 if warmup_state.ready else 503, content=stats)
+
+
+@app.get("/health/deep")
+async def deep_health_check():
+    """
+    Health of the upstreams from the latest background probe (not probed per call).
+    
+    Returns:
+        Probe results per Azure OpenAI endpoint and Azure Search, pool
+        occupancy and the warm-up state; 503 when no Azure OpenAI endpoint
+        answered the latest probe
+    """
+    probes = upstream_prober.stats()
+    snapshot = config_snapshot
+    content = {
+        "status": probes["status"],
+        "upstreams": probes,
+        "config": {"openai_ready": snapshot.openai_ready, "search_ready": snapshot.search_ready},
+        "pool": upstream_pool.stats(),
+        "warmup": warmup_state.stats(),
+    }
+    return JSONResponse(status_code=503 if probes["status"] == "unhealthy" else 200, content=content)
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus metrics: per-phase latency histograms of chat requests.
+
+    Returns:
+        Text exposition of every worker's histograms when
+        METRICS_MULTIPROCESS_DIR is set, else of this worker's.
+    """
+    return Response(content=metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+@app.get("/internal/upstream/stats")
+async def upstream_stats():
+    """
+    Internal endpoint reporting upstream connection pool and gateway usage.
+    
+    Returns:
+        JSON response with connection counts, the current concurrency limit,
+        queue depth, retry counters, per-endpoint routing state and
+        deadline fallbacks.
+    """
+    return {"pool": upstream_pool.stats(), "gateway": upstream_gateway.stats(),
+            "routing": endpoint_router.stats(config_snapshot.targets),
+            "deadlines": search_fallback.stats(),
+            "single_flight": single_flight.stats()}
+
+
+@app.get("/internal/capture/stats")
+async def capture_stats():
+    """
+    Internal endpoint reporting the traffic capture of this worker.
+    
+    Returns:
+        JSON response with the sampling counters and the writer state, or
+        `{"enabled": false}` when CAPTURE_ENABLED is off
+    """
+    if traffic_capture is None:
+        return {"enabled": False}
+    return {"enabled": True, **traffic_capture.stats()}
+
+
+@app.get("/internal/sessions/stats")
+async def session_stats():
+    """
+    Internal endpoint reporting server-side session usage.
+    
+    Returns:
+        JSON response with active sessions, expiry/eviction counters, the
+        follow-up citation reuse (hit rate, latency saved) and the /ws/chat
+        connections (turns, cancels, idle and slow-client closes).
+    """
+    return {**session_store.stats(), "citations": citation_cache.stats(), "sockets": chat_sockets.stats()}
+
+
+@app.get("/internal/cache/answers")
+async def answer_cache_info():
+    """
+    Internal endpoint to inspect the answer cache.
+    
+    Returns:
+        JSON response with hit/miss counters, savings and cached entries.
+    """
+    return {"enabled": answer_cache_enabled, "stats": answer_cache.stats(), "entries": answer_cache.entries()}
+
+
+@app.delete("/internal/cache/answers")
+async def answer_cache_clear():
+    """
+    Internal endpoint to invalidate every cached answer.
+    
+    Other workers drop their copies of shared answers within CACHE_L1_TTL,
+    but keep the answers they generated themselves until they are cleared.
+    """
+    removed = answer_cache.clear()
+    shared_removed = await shared_cache.clear("answer") if shared_cache is not None else 0
+    logger.info(f"Answer cache cleared ({removed} entries, {shared_removed} shared)")
+    return {"removed": removed, "shared_removed": shared_removed}
+
+
+@app.delete("/internal/cache/answers/{key}")
+async def answer_cache_invalidate(key: str):
+    """Internal endpoint to invalidate a single cached answer."""
+    removed = answer_cache.delete(key)
+    if shared_cache is not None:
+        removed = await shared_cache.delete("answer", key) or removed
+    if not removed:
+        raise HTTPException(status_code=404, detail="Cache entry not found")
+    return {"removed": 1}
+
+
+@app.get("/internal/cache/shared")
+async def shared_cache_info():
+    """
+    Internal endpoint to inspect the shared cache.
+    
+    Returns:
+        JSON response with the backend, its L1/L2 hit counters and errors,
+        or only the backend name when the caches are per worker.
+    """
+    if shared_cache is None:
+        return {"backend": "memory"}
+    return {"backend": config.CACHE_BACKEND, **shared_cache.stats()}
+
+
+@app.get("/internal/pages")
+async def page_cache_info():
+    """
+    Internal endpoint to inspect the HTML page cache.
+    
+    Returns:
+        JSON response with cached pages, variant sizes and counters.
+    """
+    return page_cache.stats()
+
+
+@app.post("/internal/pages/reload")
+async def page_cache_reload():
+    """Internal endpoint to re-hash static assets and re-read every cached HTML page (this worker only)."""
+    assets = asset_manifest.build()
+    return {"assets": assets, "loaded": page_cache.reload()}
+
+
+@app.get("/internal/retrieval")
+async def retrieval_info():
+    """
+    Internal endpoint reporting the retrieval backend and local index state.
+    
+    Returns:
+        JSON response with the backend, index size and search timings.
+    """
+    return {"backend": retrieval_backend, "local": local_retriever.stats(),
+            "embeddings": embedding_client.stats()}
+
+
+@app.get("/internal/retrieval/search")
+async def retrieval_search(q: str, top_n: int = SEARCH_TOP_N_DOCUMENTS):
+    """
+    Internal endpoint to run a query against the local index.
+    
+    Args:
+        q: Query text
+        top_n: Number of chunks to return
+        
+    Returns:
+        JSON response with the retrieved chunks and their fused scores.
+    """
+    if not local_retriever.ready:
+        raise HTTPException(status_code=404, detail="Local retrieval index not loaded")
+    started = time.perf_counter()
+    chunks = await retrieve_sources(q, top_n)
+    return {
+        "elapsed_ms": round(1000 * (time.perf_counter() - started), 3),
+        "results": [{**chunk.citation(), "score": chunk.score} for chunk in chunks],
+    }
+
+
+@app.post("/internal/retrieval/reload")
+async def retrieval_reload():
+    """Internal endpoint to re-open the local index (this worker only)."""
+    if not local_retriever.load():
+        raise HTTPException(status_code=500, detail=f"Local index not loaded: {local_retriever.error}")
+    return local_retriever.stats()
+
+
+@app.get("/internal/assets")
+async def asset_manifest_info():
+    """
+    Internal endpoint to inspect the fingerprinted asset manifest.
+    
+    Returns:
+        JSON response with the original -> fingerprinted paths and counters.
+    """
+    return asset_manifest.stats()
+
+
 # HTML routes
 @app.get("/")
-async def root_page():
+async def root_page(request: Request):
     """Serve the main auto-start chat page."""
-    return FileResponse("chat-auto.html")
+    return page_cache.response("chat-auto.html", request)
 
 @app.get("/chat")
-async def chat_page():
+async def chat_page(request: Request):
     """Serve the chat page with API configuration."""
-    return FileResponse("chat-with-api.html")
+    return page_cache.response("chat-with-api.html", request)
 
 @app.get("/chat-auto")
-async def chat_auto_page():
+async def chat_auto_page(request: Request):
     """Serve the auto-start chat page."""
-    return FileResponse("chat-auto.html")
+    return page_cache.response("chat-auto.html", request)
 
 @app.get("/chat-simple")
-async def chat_simple_page():
+async def chat_simple_page(request: Request):
     """Serve the simple chat page with hardcoded configuration."""
-    return FileResponse("chat.html")
+    return page_cache.response("chat.html", request)
 
 @app.get("/test-config")
-async def test_config_page():
+async def test_config_page(request: Request):
     """Serve test configuration page."""
-    return FileResponse("test-config.html")
+    return page_cache.response("test-config.html", request)
 
 @app.get("/test-search")
-async def test_search_page():
+async def test_search_page(request: Request):
     """Serve Azure Search test page."""
-    return FileResponse("test-search.html")
+    return page_cache.response("test-search.html", request)
 
 @app.get("/debug-avatar")
-async def debug_avatar_page():
+async def debug_avatar_page(request: Request):
     """Serve avatar debug page."""
-    return FileResponse("avatar-debug.html")
+    return page_cache.response("avatar-debug.html", request)
 
 @app.get("/test-chat-api")
-async def test_chat_api_page():
+async def test_chat_api_page(request: Request):
     """Serve chat API test page."""
-    return FileResponse("test-chat-api.html")
+    return page_cache.response("test-chat-api.html", request)
 
 @app.get("/test-vector-db")
-async def test_vector_db_page():
+async def test_vector_db_page(request: Request):
     """Serve vector database test page."""
-    return FileResponse("test-vector-db.html")
+    return page_cache.response("test-vector-db.html", request)
 
 @app.get("/test-simple-chat")
-async def test_simple_chat():
+async def test_simple_chat(request: Request):
     """Serve simple chat test page without vector database."""
-    return FileResponse("test-simple-chat.html")
+    return page_cache.response("test-simple-chat.html", request)
 
 @app.get("/test-azure-search")
-async def test_azure_search():
+async def test_azure_search(request: Request):
     """Serve Azure Search test page."""
-    return FileResponse("test-azure-search.html")
+    return page_cache.response("test-azure-search.html", request)
 
 @app.get("/info")
 async def info():
@@ -303,21 +717,245 @@ async def info():
 
 # Chat endpoint
 @app.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest):
+@timed_handler
+async def chat_endpoint(request: ChatRequest, http_request: Request):
     """
     Chat endpoint for processing user messages with Azure OpenAI and Azure Search.
     
+    With a `session_id` (or a bare `message`), only the new turn is sent and
+    the history is kept server-side; the response carries the session id.
+    
+    If Azure Search grounding is too slow for the turn's deadline, the answer
+    comes from the plain system-prompt path and `degraded` (or the
+    `X-Degraded` header when streaming) says so.
+    
+    Args:
+        request: Chat request with messages and parameters
+        http_request: Incoming HTTP request (used to detect disconnects when streaming)
+        
+    Returns:
+        Chat response with AI-generated text from Azure Search knowledge base,
+        or a `text/event-stream` relay of the upstream deltas when `stream` is set
+    """
+    deadline = request_deadline(request, http_request)
+    session, new_messages, request = await start_session_turn(request)
+    result = await process_chat_request(request, use_search=True, http_request=http_request,
+                                        history_policy=history_policies["chat"],
+                                        conversation_id=session.id if session else None,
+                                        deadline=deadline)
+    if session is None:
+        return result
+    if isinstance(result, StreamingResponse):
+        result.body_iterator = collect_reply(
+            result.body_iterator,
+            lambda reply: finish_session_turn(session, new_messages, reply)
+        )
+        result.headers["X-Session-Id"] = session.id
+        return result
+    await finish_session_turn(session, new_messages, result.response)
+    result.session_id = session.id
+    return result
+
+
+@app.post("/sessions", response_model=SessionResponse)
+async def create_session():
+    """
+    Start a server-side chat session.
+    
+    Returns:
+        The new session id and its idle timeout in seconds.
+    """
+    session = await session_store.create()
+    return SessionResponse(session_id=session.id, idle_timeout=session_store.idle_timeout)
+
+
+@app.get("/sessions/{session_id}", response_model=SessionResponse)
+async def get_session(session_id: str):
+    """
+    Return the history of a session and mark it active.
+    
+    Clients call this as a keep-alive while the avatar is still speaking.
+    
+    Raises:
+        HTTPException: If the session is unknown or expired.
+    """
+    session = await session_store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    await session_store.touch(session)
+    return SessionResponse(session_id=session.id, messages=session.messages,
+                           idle_timeout=session_store.idle_timeout)
+
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    """End a session and forget its history."""
+    citation_cache.forget(session_id)
+    if not await session_store.delete(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"removed": 1}
+
+
+@app.post("/chat/speech-stream")
+@timed_handler
+async def chat_speech_stream_endpoint(request: SpeechStreamRequest, http_request: Request):
+    """
+    Stream ready-to-speak sentences for the avatar.
+    
+    Consumes the upstream token stream and emits a `sentence` event as soon as
+    each sentence completes, with citation markers and markdown removed and,
+    unless `include_ssml` is false, SSML for the configured VOICE_NAME.
+    
     Args:
         request: Chat request with messages and parameters
+        http_request: Incoming HTTP request (used to detect disconnects)
         
     Returns:
-        Chat response with AI-generated text from Azure Search knowledge base
+        `text/event-stream` of `citations`, `sentence` and `done` events
+    """
+    deadline = request_deadline(request, http_request)
+    session, new_messages, request = await start_session_turn(request)
+    try:
+        logger.info("Processing speech stream request with %d messages", len(request.messages),
+                    extra={"event": "chat.request", "messages": len(request.messages)})
+        request.stream = True
+        events, history_window, degraded = await open_turn_events(
+            request, use_search=True, history_policy=history_policies["chat"],
+            conversation_id=session.id if session else None, deadline=deadline
+        )
+        
+        snapshot = config_snapshot
+        voice_name = snapshot.voice_name if request.include_ssml and snapshot.voice_name else None
+        locale = snapshot.stt_locale.split(",")[0].strip() if snapshot.stt_locale else None
+        headers = stream_headers(history_window, degraded)
+        on_complete = None
+        if session is not None:
+            headers = {**headers, "X-Session-Id": session.id}
+            on_complete = lambda reply: finish_session_turn(session, new_messages, reply)
+        return StreamingResponse(
+            speech_stream(events, http_request, voice_name=voice_name, locale=locale,
+                          rate=config.SPEECH_PROSODY_RATE, on_complete=on_complete),
+            media_type=SSE_MEDIA_TYPE,
+            headers=headers
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in speech stream endpoint: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Internal server error: {str(e)}"
+        )
+
+
+@app.websocket("/ws/chat")
+async def chat_websocket(websocket: WebSocket, session_id: Optional[str] = None):
+    """
+    Persistent chat channel of one avatar session (frames: see chat_socket.py).
+    
+    The client sends `message`, `cancel` and `ping` frames; the server pushes
+    `token`, `citations`, `sentence` and `done` frames for every turn. The
+    connection closes after WS_IDLE_TIMEOUT seconds without a client frame,
+    like the avatar's own idle disconnect.
+    
+    Args:
+        websocket: The client connection
+        session_id: Session to continue; an unknown or expired one (or none)
+            starts a new session, announced in the `ready` frame
+    """
+    await websocket.accept()
+    session = await session_store.get(session_id) if session_id else None
+    if session is None:
+        session = await session_store.create()
+    else:
+        await session_store.touch(session)
+    socket = ChatSocket(
+        websocket, session.id, run_socket_turn, chat_sockets,
+        keepalive=keep_session_alive,
+        idle_timeout=config.WS_IDLE_TIMEOUT,
+        heartbeat_interval=config.WS_HEARTBEAT_INTERVAL,
+        max_queue=config.WS_SEND_QUEUE,
+        send_timeout=config.WS_SEND_TIMEOUT,
+        max_frame_bytes=config.WS_MAX_MESSAGE_BYTES
+    )
+    await socket.serve()
+
+
+async def keep_session_alive(session_id: str) -> None:
+    """Mark a session active (a `ping` while the avatar is still speaking)."""
+    session = await session_store.get(session_id)
+    if session is not None:
+        await session_store.touch(session)
+
+
+async def run_socket_turn(socket: ChatSocket, turn_id: str, frame: dict) -> None:
     """
-    return await process_chat_request(request, use_search=True)
+    Answer one `message` frame of a /ws/chat connection.
+    
+    Runs the turn like /chat/speech-stream does, sending its events as
+    frames. Cancelling the task (barge-in, `cancel` frame, disconnect) closes
+    the upstream stream and leaves the turn out of the session history.
+    
+    Args:
+        socket: Connection the message arrived on
+        turn_id: Id carried by the turn's frames
+        frame: The `message` frame
+        
+    Raises:
+        HTTPException: If the message is invalid or the upstream call fails
+            (sent to the client as an `error` frame).
+    """
+    fields = {"session_id": socket.session_id}
+    if "content" in frame:
+        fields["messages"] = [{"role": "user", "content": frame["content"]}]
+    else:
+        fields["message"] = frame.get("text")
+    for name in ("include_ssml", "max_tokens", "temperature", "deadline_ms"):
+        if name in frame:
+            fields[name] = frame[name]
+    try:
+        request = SpeechStreamRequest.model_validate(fields)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+    
+    deadline = request_deadline(request)
+    session, new_messages, request = await start_session_turn(request)
+    if session.id != socket.session_id:
+        await socket.adopt_session(session.id)
+    logger.info("Processing chat socket turn with %d messages", len(request.messages),
+                extra={"event": "chat.request", "messages": len(request.messages), "transport": "websocket"})
+    request.stream = True
+    events, history_window, degraded = await open_turn_events(
+        request, use_search=frame.get("use_search", True) is not False,
+        history_policy=history_policies["chat"], conversation_id=session.id, deadline=deadline
+    )
+    
+    snapshot = config_snapshot
+    voice_name = snapshot.voice_name if request.include_ssml and snapshot.voice_name else None
+    locale = snapshot.stt_locale.split(",")[0].strip() if snapshot.stt_locale else None
+    start = {"type": "start", "id": turn_id, "degraded": degraded}
+    if history_window is not None:
+        start["prompt_tokens"] = history_window.prompt_tokens
+    await socket.send(start)
+    
+    frames = speech_events(events, voice_name=voice_name, locale=locale, rate=config.SPEECH_PROSODY_RATE,
+                           tokens=frame.get("tokens", True) is not False)
+    try:
+        async for name, payload in frames:
+            if name == "error":
+                await socket.send({"type": "error", "id": turn_id, "status": 502,
+                                   "detail": payload.get("error")})
+                return
+            if name == "done":
+                await finish_session_turn(session, new_messages, payload["response"])
+            await socket.send({"type": name, "id": turn_id, **payload})
+    finally:
+        await frames.aclose()
 
 
 # Simple chat endpoint for testing
 @app.post("/simple-chat", response_model=ChatResponse)
+@timed_handler
 async def simple_chat_endpoint(request: SimpleChatRequest):
     """
     Simple chat endpoint for testing Azure Search integration.
@@ -329,157 +967,709 @@ async def simple_chat_endpoint(request: SimpleChatRequest):
         Chat response with AI-generated text
     """
     try:
-        logger.info(f"Processing simple chat request: {request.message[:50]}...")
+        logger.info("Processing simple chat request", extra={"event": "chat.request"})
+        if log_content:
+            logger.debug("Simple chat message: %s", request.message[:50])
         
         # Create ChatRequest object
         chat_request = ChatRequest(messages=[ChatMessage(role="user", content=request.message)])
         
         # Process the request
-        return await process_chat_request(chat_request, request.use_search)
+        return await process_chat_request(chat_request, request.use_search,
+                                          history_policy=history_policies["simple-chat"])
         
     except Exception as e:
         logger.error(f"Error in simple chat endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing chat request: {str(e)}")
 
 
-async def process_chat_request(request: ChatRequest, use_search: bool = False):
+def build_upstream_request(request: ChatRequest, use_search: bool = False,
+                           history_policy: Optional[HistoryPolicy] = None,
+                           conversation_id: Optional[str] = None,
+                           reduced_search: bool = False,
+                           sources: Optional[list] = None):
     """
-    Process chat request with Azure OpenAI.
+    Build the Azure OpenAI chat completions call for a chat request.
     
     Args:
         request: Chat request with messages and parameters
         use_search: Whether to use Azure Search integration
+        history_policy: Windowing policy applied to the outgoing messages
+        conversation_id: Session id keying the rolling history summary
+        reduced_search: Ask Azure Search for fewer documents (slow search)
+        sources: Chunks retrieved from the local index or reused from the
+            session; they are added to the system message instead of sending
+            Azure Search data_sources
         
     Returns:
-        Chat response with AI-generated text
+        Tuple of (encoded request_body, use_azure_search, history_window)
+        
+    Raises:
+        HTTPException: If the Azure OpenAI configuration is incomplete.
+    """
+    # Validated once per configuration snapshot
+    snapshot = config_snapshot
+    if not snapshot.openai_ready:
+        logger.error("Azure OpenAI configuration is incomplete")
+        raise HTTPException(
+            status_code=500,
+            detail="Azure OpenAI configuration is incomplete"
+        )
+    
+    # Check if Azure Search is configured and should be used
+    use_azure_search = use_search and sources is None and snapshot.search_ready and retrieval_backend != "local"
+    
+    if sources is not None:
+        logger.info("Adding %d retrieved sources to the system message", len(sources),
+                    extra={"event": "chat.route", "route": "sources"})
+        template = snapshot.plain_template
+    elif use_azure_search:
+        logger.info("Adding Azure Search data source", extra={"event": "chat.route", "route": "azure_search"})
+        template = snapshot.reduced_template if reduced_search else snapshot.grounded_template
+    else:
+        logger.info("Using standard Azure OpenAI API (without Azure Search)",
+                    extra={"event": "chat.route", "route": "plain"})
+        # The plain template adds the system message in front
+        template = snapshot.plain_template
+    messages = template.prepend_system([{"role": msg.role, "content": msg.content} for msg in request.messages])
+    if sources is not None:
+        messages[0] = {"role": "system", "content": f"{messages[0]['content']}\n\n{format_sources(sources)}"}
+    
+    # Keep the prompt within the token budget of this endpoint
+    history_window = None
+    if history_policy is not None:
+        history_window = history_policy.apply(messages, conversation_id)
+        messages = history_window.messages
+        if history_window.dropped_messages:
+            logger.info("History window dropped %d messages, prompt is ~%d tokens",
+                        history_window.dropped_messages, history_window.prompt_tokens,
+                        extra={"event": "chat.history"})
+    
+    # Splice the turn into the precompiled request
+    request_body = template.render(messages, request.stream, request.max_tokens, request.temperature)
+    
+    return request_body, use_azure_search, history_window
+
+
+def upstream_error(status: int, error_text: str, headers: Mapping[str, str]) -> Exception:
+    """Retryable upstream errors go back to the gateway; others reach the client as before."""
+    logger.error("Azure OpenAI API error: %s - %s", status, error_text, extra={"event": "upstream.error"})
+    if status in RETRYABLE_STATUSES:
+        return UpstreamStatusError(status, error_text, parse_retry_after(headers))
+    return HTTPException(
+        status_code=status,
+        detail=f"Azure OpenAI API error: {error_text}"
+    )
+
+
+async def through_gateway(call):
+    """
+    Await a gateway call, turning admission and retry failures into HTTP errors.
+    
+    Upstream 429s never reach the browser: once retries are exhausted the
+    client gets 503 with a `Retry-After` hint.
     """
     try:
-        logger.info(f"Processing chat request with {len(request.messages)} messages")
+        return await call
+    except GatewayBusy as e:
+        logger.warning("Upstream gateway busy: %s", e.reason, extra={"event": "gateway.busy"})
+        raise HTTPException(
+            status_code=503,
+            detail="The assistant is busy, please try again shortly",
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))}
+        )
+    except UpstreamStatusError as e:
+        raise HTTPException(
+            status_code=e.status,
+            detail=f"Azure OpenAI API error: {e.text}"
+        )
+
+
+async def open_upstream_stream(target: UpstreamTarget, request_body: bytes):
+    """
+    Start a streamed Azure OpenAI call to one endpoint on the shared pool (one attempt).
+    
+    The caller owns the returned response and must release or close it,
+    normally by handing it to a streaming generator.
+    
+    Returns:
+        Tuple of (open aiohttp response with status 200, perf_counter() when
+        the call started)
+        
+    Raises:
+        UpstreamStatusError: If the upstream answers with a retryable error status.
+        HTTPException: If the upstream answers with another error status.
+    """
+    set_label("deployment", target.deployment)
+    started = time.perf_counter()
+    response = await upstream_pool.session.post(target.api_url, headers=target.headers, data=request_body)
+    record_phase("upstream_ttfb", time.perf_counter() - started)
+    if response.status != 200:
+        error_text = await response.text()
+        response.release()
+        raise upstream_error(response.status, error_text, response.headers)
+    return response, started
+
+
+async def fetch_chat_completion(request_body: bytes, use_azure_search: bool = False):
+    """
+    Run a non-streamed Azure OpenAI call through the upstream gateway,
+    on the endpoint chosen by the router.
+    
+    Returns:
+        Tuple of (assistant reply text, total tokens reported by the upstream,
+        Azure Search citations)
+        
+    Raises:
+        HTTPException: If the upstream fails or returns no choices, or 503 if
+        the gateway is saturated or the upstream keeps throttling.
+    """
+    return await through_gateway(upstream_gateway.call(
+        lambda: endpoint_router.run(
+            config_snapshot.targets,
+            lambda target: fetch_chat_completion_once(target, request_body, use_azure_search)
+        )
+    ))
+
+
+async def fetch_chat_completion_once(target: UpstreamTarget, request_body: bytes,
+                                     use_azure_search: bool = False):
+    """
+    Run one non-streamed Azure OpenAI attempt against one endpoint on the shared pool.
+    
+    Returns:
+        Tuple of (assistant reply text, total tokens reported by the upstream,
+        Azure Search citations)
+        
+    Raises:
+        UpstreamStatusError: If the upstream answers with a retryable error status.
+        HTTPException: If the upstream fails otherwise or returns no choices.
+    """
+    set_label("deployment", target.deployment)
+    started = time.perf_counter()
+    async with upstream_pool.session.post(
+        target.api_url,
+        headers=target.headers,
+        data=request_body
+    ) as response:
+        headers_at = time.perf_counter()
+        mark_responded()
+        
+        if response.status != 200:
+            error_text = await response.text()
+            raise upstream_error(response.status, error_text, response.headers)
         
-        # Validate Azure OpenAI configuration
-        logger.info(f"Checking Azure OpenAI configuration...")
-        logger.info(f"AZURE_OPENAI_KEY: {'SET' if hasattr(config, 'AZURE_OPENAI_KEY') and config.AZURE_OPENAI_KEY and config.AZURE_OPENAI_KEY.strip() else 'EMPTY'}")
-        logger.info(f"AZURE_OPENAI_ENDPOINT: {'SET' if hasattr(config, 'AZURE_OPENAI_ENDPOINT') and config.AZURE_OPENAI_ENDPOINT and config.AZURE_OPENAI_ENDPOINT.strip() else 'EMPTY'}")
-        logger.info(f"AZURE_OPENAI_DEPLOYMENT: {'SET' if hasattr(config, 'AZURE_OPENAI_DEPLOYMENT') and config.AZURE_OPENAI_DEPLOYMENT and config.AZURE_OPENAI_DEPLOYMENT.strip() else 'EMPTY'}")
+        body = await response.read()
+        received_at = time.perf_counter()
+        timer = current_timer()
+        if timer is not None:
+            timer.add("upstream_ttfb", headers_at - started)
+            timer.add("upstream_total", received_at - started)
+        response_data = codec.loads(body)
         
-        if not all([
-            hasattr(config, 'AZURE_OPENAI_KEY') and config.AZURE_OPENAI_KEY and config.AZURE_OPENAI_KEY.strip(),
-            hasattr(config, 'AZURE_OPENAI_ENDPOINT') and config.AZURE_OPENAI_ENDPOINT and config.AZURE_OPENAI_ENDPOINT.strip(),
-            hasattr(config, 'AZURE_OPENAI_DEPLOYMENT') and config.AZURE_OPENAI_DEPLOYMENT and config.AZURE_OPENAI_DEPLOYMENT.strip()
-        ]):
-            logger.error("Azure OpenAI configuration is incomplete")
+        # Extract response text
+        if 'choices' in response_data and len(response_data['choices']) > 0:
+            choice = response_data['choices'][0]
+            citations = []
+            
+            # For Azure Search Extensions API, the response might be in a different format
+            if 'message' in choice:
+                ai_response = choice['message']['content']
+                
+                # Log additional info for Azure Search responses
+                if use_azure_search and 'context' in choice.get('message', {}):
+                    citations = choice['message'].get('context', {}).get('citations') or []
+                    logger.info("Azure Search found %d citations", len(citations),
+                                extra={"event": "chat.citations", "citations": len(citations)})
+                    
+                    # Логируем первые несколько цитат для отладки (только с LOG_CONTENT_DEBUG)
+                    if log_content and logger.isEnabledFor(logging.DEBUG):
+                        for i, citation in enumerate(citations[:3]):
+                            logger.debug("Citation %d: %s... (%s)", i + 1, citation.get('content', '')[:100],
+                                         citation.get('title', 'No title'))
+                        context = choice['message'].get('context', {})
+                        if 'intent' in context:
+                            logger.debug("Search intent: %s", context['intent'])
+                        logger.debug("Full response content: %s...", ai_response[:200])
+                    
+            else:
+                # Fallback for other response formats
+                ai_response = choice.get('text', choice.get('content', ''))
+            
+            total_tokens = (response_data.get('usage') or {}).get('total_tokens', 0)
+            if timer is not None:
+                timer.add("response_parse", time.perf_counter() - received_at)
+            return ai_response, total_tokens, citations
+        else:
+            logger.error("No choices in Azure OpenAI response")
             raise HTTPException(
                 status_code=500,
-                detail="Azure OpenAI configuration is incomplete"
+                detail="No response from Azure OpenAI"
             )
+
+
+def request_key(request: ChatRequest, use_azure_search: bool, reduced_search: bool = False,
+                sources: Optional[list] = None) -> str:
+    """Identity of a chat turn, shared by the answer cache and request coalescing."""
+    search_index = config_snapshot.search_index_name if use_azure_search else ""
+    if use_azure_search and reduced_search:
+        search_index += f"?top_n={SEARCH_REDUCED_TOP_N_DOCUMENTS}"
+    if sources is not None:
+        # Locally grounded answers depend on exactly which chunks were retrieved
+        search_index = "local:" + ",".join(chunk.chunk_id for chunk in sources)
+    return answer_cache_key(
+        [{"role": msg.role, "content": msg.content} for msg in request.messages],
+        use_azure_search or sources is not None,
+        config_snapshot.deployment,
+        search_index,
+        config_snapshot.values["azure_system_prompt"],
+        request.max_tokens,
+        request.temperature
+    )
+
+
+async def complete_and_cache(key: str, label: str, request_body: bytes, use_azure_search: bool):
+    """
+    Fetch a non-streamed answer and store it in the answer cache.
+    
+    Returns:
+        Tuple of (answer text, Azure Search citations)
+    """
+    started = time.monotonic()
+    ai_response, total_tokens, citations = await fetch_chat_completion(request_body, use_azure_search)
+    if answer_cache_enabled:
+        answer_cache.record_upstream_latency(time.monotonic() - started)
+        answer_cache.set(key, ai_response, total_tokens, label=label)
+        if shared_cache is not None:
+            record = {"response": ai_response, "tokens": total_tokens, "label": label[:120], "created": time.time()}
+            spawn_background(shared_cache.set("answer", key, record, answer_cache.ttl + answer_cache.stale_ttl))
+    return ai_response, citations
+
+
+async def shared_answer(key: str):
+    """
+    An answer cached by another worker or node, adopted into this worker's cache.
+    
+    Returns:
+        Tuple of (entry or None, stale)
+    """
+    record = await shared_cache.get("answer", key)
+    if not isinstance(record, dict) or not isinstance(record.get("response"), str):
+        return None, False
+    return answer_cache.adopt(key, record["response"], record.get("tokens", 0), record.get("label", ""),
+                              max(0.0, time.time() - record.get("created", 0.0)))
+
+
+async def coalesced_completion(key: str, label: str, request_body: bytes, use_azure_search: bool):
+    """Non-streamed answer and citations, sharing one upstream call among identical in-flight turns."""
+    if not single_flight_enabled:
+        return await complete_and_cache(key, label, request_body, use_azure_search)
+    return await single_flight.do(
+        key,
+        lambda: complete_and_cache(key, label, request_body, use_azure_search)
+    )
+
+
+def stream_headers(history_window=None, degraded: Optional[str] = None) -> Dict[str, str]:
+    """SSE response headers, reporting the effective prompt size and degraded mode when known."""
+    headers = SSE_HEADERS
+    if history_window is not None:
+        headers = {**headers, "X-Prompt-Tokens": str(history_window.prompt_tokens)}
+    if degraded:
+        headers = {**headers, "X-Degraded": degraded}
+    return headers
+
+
+async def open_chat_events(request_body: bytes):
+    """
+    Open a streamed upstream call through the gateway and return an iterator
+    over its raw SSE events. The gateway slot is held until the stream ends.
+    
+    The call may be hedged to a second endpoint; the losing response is closed.
+    """
+    (response, started), release = await through_gateway(upstream_gateway.open(
+        lambda: endpoint_router.run(
+            config_snapshot.targets,
+            lambda target: open_upstream_stream(target, request_body),
+            hedge=True,
+            discard=lambda loser: loser[0].close()
+        )
+    ))
+    timer = current_timer()
+    
+    def release_and_record() -> None:
+        if timer is not None:
+            timer.add("upstream_total", time.perf_counter() - started)
+        release()
+    return ReleasingStream(relay_chat_stream(response), release_and_record)
+
+
+async def coalesced_chat_events(key: str, request_body: bytes):
+    """Raw SSE events of a streamed turn, fanned out from one upstream stream per key."""
+    if not single_flight_enabled:
+        return await open_chat_events(request_body)
+    return await single_flight.stream(
+        f"stream:{key}",
+        lambda: open_chat_events(request_body)
+    )
+
+
+async def refresh_cached_answer(key: str, label: str, request_body: bytes, use_azure_search: bool):
+    """Replace a stale answer cache entry in the background."""
+    try:
+        await coalesced_completion(key, label, request_body, use_azure_search)
+        logger.info("Refreshed stale answer cache entry")
+    except Exception as e:
+        logger.error(f"Failed to refresh cached answer: {str(e)}")
+    finally:
+        answer_cache.end_refresh(key)
+
+
+def spawn_background(coro) -> None:
+    """Run a coroutine in the background, keeping a reference until it finishes."""
+    task = asyncio.ensure_future(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+async def summarize_history(dropped: list, previous: str) -> str:
+    """Fold turns that left the history window into the rolling summary."""
+    request_body = codec.dumps({
+        "messages": build_summary_messages(dropped, previous),
+        "max_tokens": config.HISTORY_SUMMARY_MAX_TOKENS,
+        "temperature": 0.2
+    })
+    summary, _, _ = await fetch_chat_completion(request_body)
+    return summary
+
+
+def build_history_policy(policy: str) -> HistoryPolicy:
+    """Create a history policy sharing the worker's token counter and summaries."""
+    return HistoryPolicy(
+        policy,
+        prompt_budget=config.HISTORY_PROMPT_BUDGET,
+        counter=token_counter,
+        summaries=history_summaries,
+        summary_max_tokens=config.HISTORY_SUMMARY_MAX_TOKENS,
+        summarizer=summarize_history,
+        spawn=spawn_background
+    )
+
+
+async def start_session_turn(request: ChatRequest):
+    """
+    Resolve the session of a chat turn and rebuild its full history.
+    
+    Requests without `session_id` and `message` are left untouched. An unknown
+    or expired `session_id` starts a new session, so the client should adopt
+    the id returned with the reply.
+    
+    Args:
+        request: Chat request carrying the new turn
         
-        # Prepare request body for Azure OpenAI
-        request_body = {
-            "messages": [{"role": msg.role, "content": msg.content} for msg in request.messages],
-            "stream": request.stream,
-            "max_tokens": request.max_tokens,
-            "temperature": request.temperature
-        }
-        
-        # Check if Azure Search is configured and should be used
-        use_azure_search = (use_search and 
-                           hasattr(config, 'AZURE_SEARCH_ENDPOINT') and config.AZURE_SEARCH_ENDPOINT and 
-                           hasattr(config, 'AZURE_SEARCH_API_KEY') and config.AZURE_SEARCH_API_KEY and 
-                           hasattr(config, 'AZURE_SEARCH_INDEX_NAME') and config.AZURE_SEARCH_INDEX_NAME)
+    Returns:
+        Tuple of (session or None, new turn messages, request with full history)
         
-        if use_azure_search:
-            logger.info("Adding Azure Search data source")
-            # Правильный формат для Azure Search с векторным семантическим поиском
-            request_body["data_sources"] = [{
-                "type": "azure_search",
-                "parameters": {
-                    "endpoint": config.AZURE_SEARCH_ENDPOINT,
-                    "index_name": config.AZURE_SEARCH_INDEX_NAME,
-                    "authentication": {
-                        "type": "api_key",
-                        "key": config.AZURE_SEARCH_API_KEY
-                    },
-                    "query_type": "vector_semantic_hybrid",
-                    "semantic_configuration": f"{config.AZURE_SEARCH_INDEX_NAME}-semantic-configuration",
-                    "embedding_dependency": {
-                        "type": "deployment_name",
-                        "deployment_name": "text-embedding-ada-002"
-                    },
-                    "in_scope": True,
-                    "top_n_documents": 10,
-                    "strictness": 2
-                }
-            }]
+    Raises:
+        HTTPException: If a session turn carries no new message.
+    """
+    if request.session_id is None and request.message is None:
+        return None, [], request
+    
+    session = await session_store.get(request.session_id) if request.session_id else None
+    if session is None:
+        if request.session_id:
+            logger.info("Chat session expired or unknown, starting a new one")
+        session = await session_store.create()
+    
+    if request.message is not None:
+        new_messages = [{"role": "user", "content": request.message}]
+    else:
+        new_messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
+    if not new_messages:
+        raise HTTPException(status_code=400, detail="Session turn without a new message")
+    
+    # Stored turns were validated when they arrived; skip re-validation
+    history = [ChatMessage.model_construct(**msg) for msg in session.messages + new_messages]
+    return session, new_messages, request.model_copy(update={"messages": history, "message": None})
+
+
+async def finish_session_turn(session: Session, new_messages: list, reply: str) -> None:
+    """Record a completed turn (new user messages plus the reply) in its session."""
+    await session_store.append(session, new_messages + [{"role": "assistant", "content": reply}])
+
+
+# History policy per chat endpoint
+token_counter = TokenCounter()
+history_summaries = SummaryStore(config.HISTORY_MAX_CONVERSATIONS)
+history_policies = {
+    "chat": build_history_policy(config.HISTORY_POLICY_CHAT),
+    "simple-chat": build_history_policy(config.HISTORY_POLICY_SIMPLE_CHAT),
+}
+
+
+def request_deadline(request: ChatRequest, http_request: Optional[Request] = None) -> Deadline:
+    """Deadline of a chat turn from its `deadline_ms` field or `X-Deadline-Ms` header."""
+    return Deadline.from_request(
+        request.deadline_ms,
+        http_request.headers.get(DEADLINE_HEADER) if http_request is not None else None,
+        config.CHAT_DEADLINE_SECONDS,
+        config.CHAT_MAX_DEADLINE_SECONDS
+    )
+
+
+def grounding_ready() -> bool:
+    """Whether the configured retrieval backend can ground answers."""
+    if retrieval_backend == "local":
+        return local_retriever.ready
+    return config_snapshot.search_ready
+
+
+async def retrieve_sources(query: str, top_n: int):
+    """
+    Hybrid search of the local index; the query embedding is best effort.
+    
+    The query is embedded the way the index was built (see the embedder spec
+    in its manifest). Without embeddings in the index, or when the embeddings
+    call fails, the ranking is BM25 only.
+    """
+    vector = None
+    index = local_retriever.index
+    if index is not None and index.dimensions:
+        spec = index.embedder_spec
+        if spec.get("name") == HashingEmbedder.name:
+            vector = HashingEmbedder(index.dimensions).embed([query])[0]
         else:
-            logger.info("Using standard Azure OpenAI API (without Azure Search)")
-            # Добавим системное сообщение в начало
-            system_message = {
-                "role": "system",
-                "content": (config.AZURE_SYSTEM_PROMPT if hasattr(config, 'AZURE_SYSTEM_PROMPT') and config.AZURE_SYSTEM_PROMPT else "Ты юридический помощник фирмы Владимира Миллера.")
-            }
-            request_body["messages"].insert(0, system_message)
+            try:
+                vector = (await embedding_client.embed(upstream_pool.session, config_snapshot.targets, [query],
+                                                       deployment=spec.get("deployment")))[0]
+            except EmbeddingError as e:
+                logger.warning(f"Query embedding failed, using BM25 only: {str(e)}")
+    return local_retriever.search(query, vector, top_n)
+
+
+async def turn_sources(request: ChatRequest, use_search: bool, reduced_search: bool,
+                       conversation_id: Optional[str] = None):
+    """
+    Grounding sources of a turn and how they were obtained.
+    
+    Follow-up questions in a session are grounded on the documents of its
+    previous turns (see citation_cache.py): reused as they are, or merged
+    with a smaller new search of the local index.
+    
+    Returns:
+        Tuple of (sources or None, grounding mode or None). Sources are None
+        on the Azure Search data_sources path and the plain path; the mode is
+        None on the plain path.
+    """
+    if not use_search:
+        return None, None
+    local = retrieval_backend == "local" and local_retriever.ready
+    query = next((msg.content for msg in reversed(request.messages) if msg.role == "user"), "")
+    cached = citation_cache.follow_up(conversation_id, query)
+    if cached and local and citation_cache.policy == MODE_MERGE:
+        fresh = await retrieve_sources(query, SEARCH_REDUCED_TOP_N_DOCUMENTS)
+        citation_cache.remember(conversation_id, fresh)
+        return citation_cache.merge(cached, fresh), MODE_MERGE
+    if cached:
+        logger.info("Grounding follow-up question on %d cached session sources", len(cached),
+                    extra={"event": "chat.route", "route": "session_sources"})
+        return cached[:SEARCH_TOP_N_DOCUMENTS], MODE_REUSE
+    if not local:
+        return None, MODE_SEARCH
+    top_n = SEARCH_REDUCED_TOP_N_DOCUMENTS if reduced_search else SEARCH_TOP_N_DOCUMENTS
+    sources = await retrieve_sources(query, top_n)
+    citation_cache.remember(conversation_id, sources)
+    return sources, MODE_SEARCH
+
+
+def remember_citations(conversation_id: Optional[str]):
+    """Callback storing the Azure Search citations of a session's turn."""
+    return lambda citations: citation_cache.remember_citations(conversation_id, citations)
+
+
+async def within_deadline(deadline: Deadline, use_search: bool, attempt):
+    """
+    Run a chat turn within its deadline, falling back to the plain path when
+    the grounded call does not start responding within its sub-budget.
+    
+    Args:
+        deadline: Deadline of the turn
+        use_search: Whether the turn asked for Azure Search grounding
+        attempt: `attempt(grounded, reduced_search)` returning an awaitable
+            that completes once the turn has its answer (first token when
+            streaming); non-streamed calls report their response headers
+            with `mark_responded`
         
-        # Make request to Azure OpenAI
-        # Используем стандартный API для всех случаев
-        api_url = f"{config.AZURE_OPENAI_ENDPOINT}/openai/deployments/{config.AZURE_OPENAI_DEPLOYMENT}/chat/completions?api-version=2024-10-21"
+    Returns:
+        Tuple of (attempt result, degraded reason or None)
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                api_url,
-                headers={
-                    'api-key': config.AZURE_OPENAI_KEY,
-                    'Content-Type': 'application/json'
-                },
-                json=request_body
-            ) as response:
-                
-                if response.status != 200:
-                    error_text = await response.text()
-                    logger.error(f"Azure OpenAI API error: {response.status} - {error_text}")
-                    raise HTTPException(
-                        status_code=response.status,
-                        detail=f"Azure OpenAI API error: {error_text}"
-                    )
-                
-                response_data = await response.json()
-                
-                # Extract response text
-                if 'choices' in response_data and len(response_data['choices']) > 0:
-                    choice = response_data['choices'][0]
-                    
-                    # For Azure Search Extensions API, the response might be in a different format
-                    if 'message' in choice:
-                        ai_response = choice['message']['content']
-                        
-                        # Log additional info for Azure Search responses
-                        if use_azure_search and 'context' in choice.get('message', {}):
-                            citations = choice['message'].get('context', {}).get('citations', [])
-                            logger.info(f"Azure Search found {len(citations)} citations")
-                            
-                            # Логируем первые несколько цитат для отладки
-                            for i, citation in enumerate(citations[:3]):
-                                logger.info(f"Citation {i+1}: {citation.get('content', '')[:100]}...")
-                                logger.info(f"Citation {i+1} title: {citation.get('title', 'No title')}")
-                            
-                            # Проверяем intent
-                            context = choice['message'].get('context', {})
-                            if 'intent' in context:
-                                logger.info(f"Search intent: {context['intent']}")
-                            
-                            logger.info(f"Full response content: {ai_response[:200]}...")
-                            
-                    else:
-                        # Fallback for other response formats
-                        ai_response = choice.get('text', choice.get('content', ''))
-                    
-                    logger.info(f"Successfully processed chat request. Response length: {len(ai_response)}")
-                    return ChatResponse(response=ai_response, status="success")
-                else:
-                    logger.error("No choices in Azure OpenAI response")
-                    raise HTTPException(
-                        status_code=500,
-                        detail="No response from Azure OpenAI"
-                    )
+    Raises:
+        HTTPException: 504 if the deadline runs out.
+    """
+    grounded = use_search and grounding_ready()
+    set_label("use_search", "true" if grounded else "false")
+    try:
+        if grounded:
+            reduced = search_fallback.active
+            try:
+                result = await deadline.run_to_response(attempt(True, reduced), search_fallback.budget)
+                if reduced:
+                    search_fallback.reduced += 1
+                return result, DEGRADED_REDUCED_SEARCH if reduced else None
+            except ResponseTimeout:
+                search_fallback.trip()
+                set_label("use_search", "false")
+                logger.warning(f"Azure Search grounding took over {search_fallback.budget:.1f}s, "
+                               f"answering without it ({deadline.remaining():.1f}s left)")
+            return await deadline.run(attempt(False, False)), DEGRADED_SEARCH_TIMEOUT
+        return await deadline.run(attempt(False, False)), None
+    except asyncio.TimeoutError:
+        if not deadline.expired:
+            # A client timeout of the upstream call itself, not the turn's deadline
+            logger.warning("Upstream call timed out")
+            raise HTTPException(
+                status_code=504,
+                detail="The assistant took too long to answer, please try again"
+            )
+        search_fallback.exceeded += 1
+        logger.warning(f"Chat turn exceeded its {deadline.timeout:.1f}s deadline")
+        raise HTTPException(
+            status_code=504,
+            detail="The assistant took too long to answer, please try again"
+        )
+
+
+async def open_turn_events(request: ChatRequest, use_search: bool = False,
+                           history_policy: Optional[HistoryPolicy] = None,
+                           conversation_id: Optional[str] = None,
+                           deadline: Optional[Deadline] = None):
+    """
+    Open the upstream event stream of a streamed turn once its first token arrived.
+    
+    Returns:
+        Tuple of (raw SSE events, history_window, degraded reason or None)
+    """
+    async def attempt(grounded: bool, reduced_search: bool):
+        started = time.monotonic()
+        with phase("retrieval"):
+            sources, mode = await turn_sources(request, grounded, reduced_search, conversation_id)
+        with phase("payload_build"):
+            request_body, use_azure_search, history_window = build_upstream_request(
+                request, grounded, history_policy, conversation_id, reduced_search, sources
+            )
+        key = request_key(request, use_azure_search, reduced_search, sources)
+        events = await await_first_token(await coalesced_chat_events(key, request_body))
+        if mode is not None:
+            citation_cache.record(mode, True, time.monotonic() - started)
+        if sources:
+            # Citations go first, as with Azure Search grounding
+            events = prepend_events([context_event([chunk.citation() for chunk in sources])], events)
+        elif use_azure_search and conversation_id and citation_cache.enabled:
+            events = tap_citations(events, remember_citations(conversation_id))
+        return events, history_window
+    
+    (events, history_window), degraded = await within_deadline(
+        deadline or request_deadline(request), use_search, attempt
+    )
+    return events, history_window, degraded
+
+
+async def answer_turn(request: ChatRequest, use_search: bool = False,
+                      history_policy: Optional[HistoryPolicy] = None,
+                      conversation_id: Optional[str] = None,
+                      deadline: Optional[Deadline] = None):
+    """
+    Non-streamed answer of a turn, from the answer cache when possible.
+    
+    Returns:
+        Tuple of (answer text, history_window, degraded reason or None)
+    """
+    async def attempt(grounded: bool, reduced_search: bool):
+        started = time.monotonic()
+        with phase("retrieval"):
+            sources, mode = await turn_sources(request, grounded, reduced_search, conversation_id)
+        with phase("payload_build"):
+            request_body, use_azure_search, history_window = build_upstream_request(
+                request, grounded, history_policy, conversation_id, reduced_search, sources
+            )
+        key = request_key(request, use_azure_search, reduced_search, sources)
+        if answer_cache_enabled:
+            entry, stale = answer_cache.get(key)
+            if entry is None and shared_cache is not None:
+                entry, stale = await shared_answer(key)
+            if entry is not None:
+                # No upstream call, so no deployment label otherwise
+                set_label("deployment", "cache")
+                if stale and answer_cache.begin_refresh(key):
+                    spawn_background(refresh_cached_answer(key, entry.label, request_body, use_azure_search))
+                logger.info("Answer cache %shit. Response length: %d", "stale " if stale else "",
+                            len(entry.response), extra={"event": "chat.answer", "cached": True})
+                return entry.response, history_window
+        
+        label = str(request.messages[-1].content) if request.messages else ""
+        ai_response, citations = await coalesced_completion(key, label, request_body, use_azure_search)
+        logger.info("Successfully processed chat request. Response length: %d", len(ai_response),
+                    extra={"event": "chat.answer", "cached": False})
+        if mode is not None:
+            citation_cache.record(mode, False, time.monotonic() - started)
+        if citations and sources is None:
+            citation_cache.remember_citations(conversation_id, citations)
+        return ai_response, history_window
+    
+    (ai_response, history_window), degraded = await within_deadline(
+        deadline or request_deadline(request), use_search, attempt
+    )
+    return ai_response, history_window, degraded
+
+
+async def process_chat_request(request: ChatRequest, use_search: bool = False,
+                               http_request: Optional[Request] = None,
+                               history_policy: Optional[HistoryPolicy] = None,
+                               conversation_id: Optional[str] = None,
+                               deadline: Optional[Deadline] = None):
+    """
+    Process chat request with Azure OpenAI.
+    
+    Identical concurrent requests share one upstream call, and non-streamed
+    answers are served from the answer cache when possible. The turn runs
+    within its deadline; slow Azure Search grounding falls back to the plain
+    path and marks the response as degraded.
+    
+    Args:
+        request: Chat request with messages and parameters
+        use_search: Whether to use Azure Search integration
+        http_request: Incoming HTTP request, used to stop streaming on disconnect
+        history_policy: Windowing policy for the conversation history
+        conversation_id: Session id keying the rolling history summary
+        deadline: Deadline of the turn (the configured default when omitted)
+        
+    Returns:
+        Chat response with AI-generated text, or a StreamingResponse relaying
+        upstream server-sent events when `request.stream` is set
+    """
+    try:
+        logger.info("Processing chat request with %d messages", len(request.messages),
+                    extra={"event": "chat.request", "messages": len(request.messages)})
+        deadline = deadline or request_deadline(request, http_request)
+        
+        if request.stream:
+            # Relay upstream SSE events as they arrive
+            events, history_window, degraded = await open_turn_events(
+                request, use_search, history_policy, conversation_id, deadline
+            )
+            logger.info("Streaming Azure OpenAI response to client", extra={"event": "chat.stream"})
+            return StreamingResponse(
+                watch_disconnect(events, http_request),
+                media_type=SSE_MEDIA_TYPE,
+                headers=stream_headers(history_window, degraded)
+            )
+        
+        ai_response, history_window, degraded = await answer_turn(
+            request, use_search, history_policy, conversation_id, deadline
+        )
+        metadata = history_window.metadata() if history_window else None
+        return ChatResponse(response=ai_response, status="success", metadata=metadata, degraded=degraded)
     
     except HTTPException:
         raise
@@ -0,0 +1,303 @@
+"""
+Per-phase latency of chat turns: Prometheus histograms and Server-Timing.
+
+`MetricsMiddleware` (pure ASGI, so it adds no task or body copy) starts a
+`PhaseTimer` for each instrumented request and makes it the current timer
+for everything the request runs, including the tasks it spawns. Code on
+the hot path records into it with `phase(...)` / `record_phase(...)`,
+which cost a clock read and a dict update and do nothing outside a
+request:
+
+    validate          request received -> handler entered (body read and
+                      pydantic validation)
+    retrieval         local index search / session document reuse
+    payload_build     upstream request body built from the templates
+    queue_wait        waiting for an upstream gateway slot
+    upstream_connect  upstream call started -> connection ready
+    upstream_ttfb     upstream call started -> response headers
+    upstream_total    upstream call started -> body read / stream ended
+    response_parse    upstream JSON decoded and the answer extracted
+    serialize         handler returned -> response started
+
+When the response starts, the phases known so far go out in a
+`Server-Timing` header (browser devtools show it under Timing). When it
+ends, every phase and the total are observed into histograms labelled by
+endpoint, use_search, deployment (`cache` for answer-cache hits) and status,
+exported on `/metrics` in the Prometheus text format.
+
+Each gunicorn worker keeps its own histograms. With METRICS_MULTIPROCESS_DIR
+set, workers periodically write them to `<dir>/metrics-<pid>.json` and
+`/metrics` sums the files, so a scrape sees the whole host whichever
+worker answers. Clear the directory before starting gunicorn.
+"""
+
+import asyncio
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import os
+from time import perf_counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds in seconds; spans sub-millisecond phases up to slow grounded turns
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LABELS = ("endpoint", "use_search", "deployment", "status")
+
+_current: "contextvars.ContextVar[Optional[PhaseTimer]]" = contextvars.ContextVar("phase_timer", default=None)
+
+
+class PhaseTimer:
+    """Phase durations and labels of one request."""
+
+    __slots__ = ("started", "phases", "labels", "handler_done")
+
+    def __init__(self, endpoint: str):
+        self.started = perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.labels = {"endpoint": endpoint, "use_search": "", "deployment": "", "status": ""}
+        self.handler_done: Optional[float] = None
+
+    def add(self, name: str, seconds: float) -> None:
+        # Retried or hedged upstream attempts add up
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        """Server-Timing header value of the phases so far (durations in ms)."""
+        entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.phases.items()]
+        entries.append(f"total;dur={(perf_counter() - self.started) * 1000:.2f}")
+        return ", ".join(entries)
+
+
+def current_timer() -> Optional[PhaseTimer]:
+    return _current.get()
+
+
+def record_phase(name: str, seconds: float) -> None:
+    """Add to a phase of the current request, if it is instrumented."""
+    timer = _current.get()
+    if timer is not None:
+        timer.add(name, seconds)
+
+
+def set_label(name: str, value: str) -> None:
+    """Set a label of the current request's metrics."""
+    timer = _current.get()
+    if timer is not None:
+        timer.labels[name] = value
+
+
+class phase:
+    """Context manager timing a block into a phase of the current request."""
+
+    __slots__ = ("name", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> "phase":
+        self.started = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        timer = _current.get()
+        if timer is not None:
+            timer.phases[self.name] = timer.phases.get(self.name, 0.0) + perf_counter() - self.started
+
+
+def timed_handler(handler):
+    """
+    Mark where an endpoint's own work starts and ends.
+
+    The time before entry is the `validate` phase; the time from its return
+    to the start of the response is `serialize`.
+    """
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        timer = _current.get()
+        if timer is not None:
+            timer.add("validate", perf_counter() - timer.started)
+        try:
+            return await handler(*args, **kwargs)
+        finally:
+            if timer is not None:
+                timer.handler_done = perf_counter()
+    return wrapper
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Histogram:
+    """Prometheus histogram with per-bucket (non-cumulative) counts per label set."""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str],
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> bucket counts (last one is +Inf) followed by the sum
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def series(self, labels: Tuple[str, ...]) -> List[float]:
+        """Counts of a label set, created empty on first use."""
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        return series
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        series = self.series(labels)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def snapshot(self) -> Dict[str, List[float]]:
+        return {"\x1f".join(labels): list(series) for labels, series in self._series.items()}
+
+    def render(self, snapshots: Iterable[Dict[str, List[float]]] = ()) -> List[str]:
+        """Exposition lines, adding the series of other workers' snapshots."""
+        merged: Dict[Tuple[str, ...], List[float]] = {labels: list(series) for labels, series in self._series.items()}
+        for snapshot in snapshots:
+            for key, series in snapshot.items():
+                labels = tuple(key.split("\x1f"))
+                if len(labels) != len(self.labelnames) or len(series) != len(self.buckets) + 2:
+                    continue
+                current = merged.get(labels)
+                merged[labels] = series if current is None else [a + b for a, b in zip(current, series)]
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels in sorted(merged):
+            series = merged[labels]
+            label_text = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{label_text},le="{le}"}} {int(cumulative)}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{{{label_text}}} {int(cumulative)}")
+        return lines
+
+
+class MetricsRegistry:
+    """Chat turn histograms of this worker, optionally shared through a directory."""
+
+    def __init__(self, multiprocess_dir: Optional[str] = None):
+        self.multiprocess_dir = multiprocess_dir
+        self.phases = Histogram("chat_phase_duration_seconds",
+                                "Time spent in each phase of a chat request.", ("phase",) + LABELS)
+        self.requests = Histogram("chat_request_duration_seconds",
+                                  "Chat request duration, until the response body ended.", LABELS)
+        self.histograms = (self.phases, self.requests)
+        # labels -> phase -> the phase histogram's series, to skip building keys per observation
+        self._phase_series: Dict[Tuple[str, ...], Dict[str, List[float]]] = {}
+        if multiprocess_dir:
+            os.makedirs(multiprocess_dir, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config) -> "MetricsRegistry":
+        """Build the registry from the METRICS_* settings of a config object."""
+        return cls(config.METRICS_MULTIPROCESS_DIR or None)
+
+    def observe(self, timer: PhaseTimer) -> None:
+        """Record a finished request."""
+        values = timer.labels
+        labels = (values["endpoint"], values["use_search"], values["deployment"], values["status"])
+        by_phase = self._phase_series.get(labels)
+        if by_phase is None:
+            by_phase = self._phase_series[labels] = {}
+        buckets = self.phases.buckets
+        for name, seconds in timer.phases.items():
+            series = by_phase.get(name)
+            if series is None:
+                series = by_phase[name] = self.phases.series((name,) + labels)
+            series[bisect.bisect_left(buckets, seconds)] += 1
+            series[-1] += seconds
+        self.requests.observe(labels, perf_counter() - timer.started)
+
+    async def flush_periodically(self, interval: float) -> None:
+        """Flush every `interval` seconds until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            self.flush()
+
+    def _path(self, pid: int) -> str:
+        return os.path.join(self.multiprocess_dir, f"metrics-{pid}.json")
+
+    def flush(self) -> None:
+        """Write this worker's histograms for the other workers' scrapes."""
+        if not self.multiprocess_dir:
+            return
+        data = {histogram.name: histogram.snapshot() for histogram in self.histograms}
+        path = self._path(os.getpid())
+        try:
+            with open(f"{path}.tmp", "w", encoding="utf-8") as handle:
+                json.dump(data, handle)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            logger.warning(f"Could not write metrics to {path}: {str(e)}")
+
+    def _other_workers(self) -> List[Dict[str, Dict[str, List[float]]]]:
+        if not self.multiprocess_dir:
+            return []
+        own = os.path.basename(self._path(os.getpid()))
+        snapshots = []
+        for name in os.listdir(self.multiprocess_dir):
+            if name == own or not name.startswith("metrics-") or not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.multiprocess_dir, name), encoding="utf-8") as handle:
+                    snapshots.append(json.load(handle))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self) -> str:
+        """Prometheus text exposition of every histogram."""
+        others = self._other_workers()
+        lines: List[str] = []
+        for histogram in self.histograms:
+            lines.extend(histogram.render(snapshot.get(histogram.name, {}) for snapshot in others))
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing the requests to `paths` and adding Server-Timing."""
+
+    def __init__(self, app, registry: MetricsRegistry, paths: Iterable[str], server_timing: bool = True):
+        self.app = app
+        self.registry = registry
+        self.paths = frozenset(paths)
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        timer = PhaseTimer(scope["path"])
+        token = _current.set(timer)
+        timer.labels["status"] = "500"
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                timer.labels["status"] = str(message["status"])
+                if timer.handler_done is not None:
+                    timer.add("serialize", perf_counter() - timer.handler_done)
+                if self.server_timing:
+                    message = {**message, "headers": [*message.get("headers", ()),
+                                                      (b"server-timing", timer.server_timing().encode("latin-1"))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            self.registry.observe(timer)
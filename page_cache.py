@@ -0,0 +1,219 @@
+"""
+In-memory cache of the HTML pages with precompressed variants.
+
+Registered pages are read once and kept as identity, gzip and (when the
+`brotli` package is installed) brotli bodies. Responses carry a strong ETag
+per variant and `Last-Modified`, answer conditional GETs with 304, and pick
+the encoding from `Accept-Encoding`.
+
+With `auto_reload` (development) a page is re-read when its mtime changes;
+otherwise pages change only on an explicit `reload()`.
+"""
+
+import gzip
+import hashlib
+import logging
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+from starlette.requests import Request
+from starlette.responses import Response
+
+from config_snapshot import etag_matches
+
+try:
+    import brotli
+except ImportError:  # optional: serve gzip only
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+HTML_MEDIA_TYPE = "text/html"
+
+# Pages may change on deploy: always revalidate (a 304 costs no body)
+PAGE_CACHE_CONTROL = "no-cache"
+
+# Preference order when the client accepts several encodings equally
+ENCODINGS = ("br", "gzip")
+
+
+def accepted_encodings(accept_encoding: Optional[str]) -> Dict[str, float]:
+    """Parse `Accept-Encoding` into {coding: q}."""
+    accepted = {}
+    for item in (accept_encoding or "").split(","):
+        parts = item.strip().split(";")
+        coding = parts[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            name, _, value = param.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def negotiate_encoding(accept_encoding: Optional[str], available: List[str]) -> Optional[str]:
+    """
+    Choose a content coding for a response.
+
+    Args:
+        accept_encoding: Raw `Accept-Encoding` request header
+        available: Codings with a precompressed body, in preference order
+
+    Returns:
+        The chosen coding, or None for the identity body.
+    """
+    accepted = accepted_encodings(accept_encoding)
+    best, best_q = None, 0.0
+    for coding in available:
+        q = accepted.get(coding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+class CachedPage:
+    """One page: its bodies per content coding and validators."""
+
+    __slots__ = ("path", "mtime", "last_modified", "etag", "bodies")
+
+    def __init__(self, path: str, content: bytes, mtime: float):
+        self.path = path
+        self.mtime = mtime
+        self.last_modified = formatdate(mtime, usegmt=True)
+        self.etag = hashlib.sha256(content).hexdigest()[:32]
+        self.bodies: Dict[Optional[str], bytes] = {None: content}
+        gzipped = gzip.compress(content, compresslevel=9, mtime=0)
+        if len(gzipped) < len(content):
+            self.bodies["gzip"] = gzipped
+        if brotli is not None:
+            compressed = brotli.compress(content, quality=11)
+            if len(compressed) < len(content):
+                self.bodies["br"] = compressed
+
+    def etag_for(self, coding: Optional[str]) -> str:
+        # Strong validators must differ between representations
+        return f'"{self.etag}-{coding}"' if coding else f'"{self.etag}"'
+
+
+class PageCache:
+    """Registered HTML pages served from memory."""
+
+    def __init__(self, auto_reload: bool = False,
+                 transform: Optional[Callable[[str, bytes], bytes]] = None):
+        """
+        Args:
+            auto_reload: Re-read a page when its file's mtime changes
+            transform: Optional rewrite applied to a page's content when loaded
+                (path, content) -> content
+        """
+        self.auto_reload = auto_reload
+        self.transform = transform
+        self._pages: Dict[str, Optional[CachedPage]] = {}
+        self.hits = 0
+        self.not_modified = 0
+        self.reloads = 0
+
+    def register(self, path: str) -> None:
+        """Load a page into the cache (a missing file is reported when requested)."""
+        self._pages[path] = self._load(path)
+
+    def _load(self, path: str) -> Optional[CachedPage]:
+        try:
+            mtime = os.stat(path).st_mtime
+            with open(path, "rb") as f:
+                content = f.read()
+        except OSError as e:
+            logger.warning(f"Page {path} could not be loaded: {str(e)}")
+            return None
+        if self.transform is not None:
+            content = self.transform(path, content)
+        return CachedPage(path, content, mtime)
+
+    def reload(self) -> int:
+        """Re-read every registered page. Returns the number of pages loaded."""
+        for path in list(self._pages):
+            self._pages[path] = self._load(path)
+        self.reloads += 1
+        loaded = sum(1 for page in self._pages.values() if page is not None)
+        logger.info(f"Page cache reloaded ({loaded}/{len(self._pages)} pages)")
+        return loaded
+
+    def get(self, path: str) -> Optional[CachedPage]:
+        """Current version of a registered page, or None if it cannot be read."""
+        if path not in self._pages:
+            self.register(path)
+        page = self._pages[path]
+        if self.auto_reload:
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                mtime = None
+            if page is None or mtime != page.mtime:
+                page = self._pages[path] = self._load(path)
+        return page
+
+    def response(self, path: str, request: Request) -> Response:
+        """
+        Serve a page, honouring `If-None-Match`, `If-Modified-Since` and
+        `Accept-Encoding`.
+
+        Raises:
+            HTTPException: 404 if the page file does not exist.
+        """
+        page = self.get(path)
+        if page is None:
+            raise HTTPException(status_code=404, detail="Page not found")
+
+        coding = negotiate_encoding(request.headers.get("accept-encoding"),
+                                    [c for c in ENCODINGS if c in page.bodies])
+        etag = page.etag_for(coding)
+        headers = {
+            "ETag": etag,
+            "Last-Modified": page.last_modified,
+            "Cache-Control": PAGE_CACHE_CONTROL,
+            "Vary": "Accept-Encoding",
+        }
+        if self._not_modified(request, page, etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+
+        self.hits += 1
+        if coding:
+            headers["Content-Encoding"] = coding
+        return Response(content=page.bodies[coding], media_type=HTML_MEDIA_TYPE, headers=headers)
+
+    @staticmethod
+    def _not_modified(request: Request, page: CachedPage, etag: str) -> bool:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            return etag_matches(if_none_match, etag)
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return int(page.mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def stats(self) -> Dict[str, object]:
+        """Cached pages and counters for monitoring."""
+        return {
+            "auto_reload": self.auto_reload,
+            "brotli": brotli is not None,
+            "hits": self.hits,
+            "not_modified": self.not_modified,
+            "reloads": self.reloads,
+            "pages": {
+                path: ({coding or "identity": len(body) for coding, body in page.bodies.items()}
+                       if page is not None else None)
+                for path, page in self._pages.items()
+            },
+        }
@@ -0,0 +1,92 @@
+"""
+Precompiled Azure OpenAI chat completions requests.
+
+Everything in an upstream request body except the conversation and the
+sampling parameters is fixed by the configuration: the Azure Search
+`data_sources` block and the fallback system message. A template encodes
+those parts once per configuration snapshot; a turn only encodes its
+messages and splices them in. URLs and headers are prebuilt per endpoint
+(see `endpoints.UpstreamTarget`), so one body can be sent to any of them.
+"""
+
+from types import MappingProxyType
+from typing import Dict, List, Optional
+
+import codec
+
+# Azure Search retrieval settings of the grounded (/chat) path
+SEARCH_TOP_N_DOCUMENTS = 10
+# Used while grounding is slow (see deadline.SearchFallback)
+SEARCH_REDUCED_TOP_N_DOCUMENTS = 3
+SEARCH_STRICTNESS = 2
+SEARCH_EMBEDDING_DEPLOYMENT = "text-embedding-ada-002"
+
+
+def azure_search_data_source(endpoint: str, api_key: str, index_name: str,
+                             top_n_documents: int = SEARCH_TOP_N_DOCUMENTS) -> Dict[str, object]:
+    """
+    Build the `data_sources` entry for Azure Search grounding.
+
+    Uses vector semantic hybrid search with the index's default semantic
+    configuration name (`<index>-semantic-configuration`).
+    """
+    return {
+        "type": "azure_search",
+        "parameters": {
+            "endpoint": endpoint,
+            "index_name": index_name,
+            "authentication": {
+                "type": "api_key",
+                "key": api_key
+            },
+            "query_type": "vector_semantic_hybrid",
+            "semantic_configuration": f"{index_name}-semantic-configuration",
+            "embedding_dependency": {
+                "type": "deployment_name",
+                "deployment_name": SEARCH_EMBEDDING_DEPLOYMENT
+            },
+            "in_scope": True,
+            "top_n_documents": top_n_documents,
+            "strictness": SEARCH_STRICTNESS
+        }
+    }
+
+
+class RequestTemplate:
+    """Static parts of an upstream request body, with its tail pre-encoded."""
+
+    __slots__ = ("system_message", "grounded", "_tail")
+
+    def __init__(self, data_sources: Optional[List[Dict[str, object]]] = None,
+                 system_message: Optional[Dict[str, str]] = None):
+        self.system_message = MappingProxyType(dict(system_message)) if system_message else None
+        self.grounded = bool(data_sources)
+        self._tail = (b',"data_sources":' + codec.dumps(data_sources) if data_sources else b"") + b"}"
+
+    def prepend_system(self, messages: List[Dict[str, object]]) -> List[Dict[str, object]]:
+        """Add the template's system message in front of a conversation, if it has one."""
+        if self.system_message is None:
+            return messages
+        return [dict(self.system_message)] + messages
+
+    def render(self, messages: List[Dict[str, object]], stream: bool = False,
+               max_tokens: int = 500, temperature: float = 0.7) -> bytes:
+        """
+        Encode a full request body for one turn.
+
+        Args:
+            messages: Final upstream messages (system message and windowing applied)
+            stream: Request server-sent events
+            max_tokens: Completion token limit
+            temperature: Sampling temperature
+
+        Returns:
+            JSON body bytes, ready to post to any upstream target.
+        """
+        return b"".join((
+            b'{"messages":', codec.dumps(messages),
+            b',"stream":', b"true" if stream else b"false",
+            b',"max_tokens":', codec.dumps(max_tokens),
+            b',"temperature":', codec.dumps(temperature),
+            self._tail,
+        ))
@@ -0,0 +1,441 @@
+"""
+Local hybrid retrieval: BM25 over a compact inverted index plus cosine
+similarity over a memory-mapped embedding matrix, fused by reciprocal rank
+fusion (RRF).
+
+An alternative to Azure Search `data_sources` (RETRIEVAL_BACKEND=local):
+no extra network hop or per-query charge for retrieval, and the whole
+pipeline runs offline against a local index. Retrieved chunks are injected
+into the system message as `[docN]` sources, so answers cite them the same
+way Azure Search grounded answers do.
+
+An index is a directory:
+
+    index.json          metadata (chunk count, vocabulary size, dimensions,
+                        embedder spec); may name another directory holding
+                        the files, so replacing it swaps the whole index
+    vocab.json          term -> term id
+    postings_offsets.npy, postings_docs.npy, postings_tf.npy
+                        CSR postings: docs and term frequencies of term i are
+                        at offsets[i]:offsets[i + 1]
+    doc_lengths.npy     tokens per chunk
+    embeddings.npy      float32 (chunks x dim), L2-normalized; optional
+    projection.npy, embeddings_coarse.npy
+                        PCA projection to COARSE_DIMENSIONS and the projected
+                        matrix, for large indexes
+    chunks.jsonl, chunk_offsets.npy
+                        chunk records and their byte offsets
+
+Arrays and the chunk file are memory-mapped, so gunicorn workers share one
+copy through the page cache and a worker only pages in what it reads.
+`ingest.py` builds indexes from documents; a running server notices when
+index.json is replaced and reloads.
+
+A brute-force scan of 30k x 1536 float32 vectors reads ~180 MB per query
+(~15 ms, memory bound). Large indexes therefore scan a PCA-reduced copy
+first and rescore the best RERANK_CANDIDATES rows at full precision, which
+keeps hybrid queries in single-digit milliseconds.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import time
+from typing import Dict, Iterable, List, Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # optional: only needed for RETRIEVAL_BACKEND=local
+    np = None
+
+logger = logging.getLogger(__name__)
+
+INDEX_FORMAT_VERSION = 1
+INDEX_MANIFEST = "index.json"
+
+# BM25 parameters (Robertson/Sparck Jones defaults)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Reciprocal rank fusion constant (Cormack et al.)
+RRF_K = 60
+
+# Candidates taken from each ranking before fusion
+CANDIDATES_PER_RANKING = 50
+
+# Two-stage vector search for indexes of at least COARSE_MIN_CHUNKS chunks
+COARSE_DIMENSIONS = 256
+COARSE_MIN_CHUNKS = 5000
+COARSE_SAMPLE_SIZE = 8000
+RERANK_CANDIDATES = 200
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased word tokens; single characters are dropped."""
+    return [token for token in _TOKEN_RE.findall(text.lower()) if len(token) > 1]
+
+
+class RetrievedChunk:
+    """One retrieved chunk with its fused score."""
+
+    __slots__ = ("chunk_id", "title", "filepath", "url", "content", "score")
+
+    def __init__(self, chunk_id: str, title: str, filepath: str, url: str, content: str, score: float):
+        self.chunk_id = chunk_id
+        self.title = title
+        self.filepath = filepath
+        self.url = url
+        self.content = content
+        self.score = score
+
+    def citation(self) -> Dict[str, object]:
+        """Azure Search style citation (see the `context.citations` of grounded answers)."""
+        return {
+            "content": self.content,
+            "title": self.title,
+            "filepath": self.filepath,
+            "url": self.url,
+            "chunk_id": self.chunk_id,
+        }
+
+
+def format_sources(chunks: Sequence[RetrievedChunk]) -> str:
+    """Render retrieved chunks as numbered sources for the system message."""
+    parts = ["Answer using only the sources below and cite them as [docN]. "
+             "If they do not contain the answer, say so."]
+    for i, chunk in enumerate(chunks, start=1):
+        heading = f"[doc{i}] {chunk.title}" + (f" ({chunk.filepath})" if chunk.filepath else "")
+        parts.append(f"{heading}\n{chunk.content}")
+    return "\n\n".join(parts)
+
+
+def reciprocal_rank_fusion(rankings: Iterable[Sequence[int]], k: int = RRF_K) -> Dict[int, float]:
+    """Fuse ranked lists of doc ids: score(d) = sum of 1 / (k + rank(d))."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            fused[doc] = fused.get(doc, 0.0) + 1.0 / (k + rank)
+    return fused
+
+
+def _top_k(scores: "np.ndarray", k: int) -> "np.ndarray":
+    """Indices of the k highest positive scores, best first."""
+    candidates = np.flatnonzero(scores > 0)
+    if len(candidates) > k:
+        candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class LocalIndex:
+    """A loaded, read-only retrieval index."""
+
+    def __init__(self, path: str):
+        if np is None:
+            raise RuntimeError("numpy is required for the local retrieval backend")
+        self.path = path
+        with open(os.path.join(path, INDEX_MANIFEST), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("version") != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported index version {self.manifest.get('version')}")
+        # The manifest may point at the directory holding the data files
+        self.directory = os.path.join(path, self.manifest.get("directory", "."))
+        self.embedder_spec: Dict[str, object] = self.manifest.get("embedder") or {}
+        with open(self._file("vocab.json"), "r", encoding="utf-8") as f:
+            self.vocab: Dict[str, int] = json.load(f)
+        self.offsets = self._array("postings_offsets.npy")
+        self.postings_docs = self._array("postings_docs.npy")
+        self.postings_tf = self._array("postings_tf.npy")
+        self.chunk_count = int(self.manifest["chunks"])
+        # Per-chunk BM25 length normalisation, precomputed once
+        doc_lengths = self._array("doc_lengths.npy").astype(np.float32)
+        avgdl = float(doc_lengths.mean()) if self.chunk_count else 1.0
+        self.length_norm = (BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths / max(avgdl, 1.0))).astype(np.float32)
+        embeddings_path = self._file("embeddings.npy")
+        self.embeddings = np.load(embeddings_path, mmap_mode="r") if os.path.exists(embeddings_path) else None
+        coarse_path = self._file("embeddings_coarse.npy")
+        if self.embeddings is not None and os.path.exists(coarse_path):
+            self.projection = self._array("projection.npy")
+            self.coarse = np.load(coarse_path, mmap_mode="r")
+        else:
+            self.projection = self.coarse = None
+        self.chunk_offsets = self._array("chunk_offsets.npy")
+        self._chunks_file = open(self._file("chunks.jsonl"), "rb")
+        self._chunks = mmap.mmap(self._chunks_file.fileno(), 0, access=mmap.ACCESS_READ) \
+            if os.fstat(self._chunks_file.fileno()).st_size else b""
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _array(self, name: str) -> "np.ndarray":
+        return np.load(self._file(name), mmap_mode="r")
+
+    @property
+    def dimensions(self) -> int:
+        return 0 if self.embeddings is None else int(self.embeddings.shape[1])
+
+    def close(self) -> None:
+        if isinstance(self._chunks, mmap.mmap):
+            self._chunks.close()
+        self._chunks_file.close()
+
+    def chunk(self, doc: int) -> Dict[str, object]:
+        start, end = int(self.chunk_offsets[doc]), int(self.chunk_offsets[doc + 1])
+        return json.loads(self._chunks[start:end])
+
+    def bm25(self, query: str, k: int = CANDIDATES_PER_RANKING) -> "np.ndarray":
+        """Chunk ids ranked by BM25 for a query."""
+        scores = np.zeros(self.chunk_count, dtype=np.float32)
+        n = self.chunk_count
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = int(self.offsets[term_id]), int(self.offsets[term_id + 1])
+            docs = self.postings_docs[start:end]
+            tf = self.postings_tf[start:end].astype(np.float32)
+            df = end - start
+            idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tf * (BM25_K1 + 1) / (tf + self.length_norm[docs])
+        return _top_k(scores, k)
+
+    def nearest(self, vector: Sequence[float], k: int = CANDIDATES_PER_RANKING) -> "np.ndarray":
+        """Chunk ids ranked by cosine similarity to a query embedding."""
+        if self.embeddings is None:
+            return np.empty(0, dtype=np.int64)
+        query = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(query))
+        if norm == 0 or query.shape[0] != self.dimensions:
+            return np.empty(0, dtype=np.int64)
+        query /= norm
+        k = min(k, self.chunk_count)
+        if self.coarse is not None and self.chunk_count > RERANK_CANDIDATES:
+            # Coarse scan in the PCA subspace, exact rescoring of the best rows
+            coarse_scores = self.coarse @ (query @ self.projection)
+            candidates = np.argpartition(-coarse_scores, RERANK_CANDIDATES - 1)[:RERANK_CANDIDATES]
+            candidates.sort()
+            scores = self.embeddings[candidates] @ query
+            top = np.argsort(-scores, kind="stable")[:k]
+            return candidates[top]
+        # Rows are normalized at build time: the dot product is the cosine
+        scores = self.embeddings @ query
+        top = np.argpartition(-scores, k - 1)[:k] if k < self.chunk_count else np.arange(self.chunk_count)
+        return top[np.argsort(-scores[top], kind="stable")]
+
+    def search(self, query: str, vector: Optional[Sequence[float]] = None, top_n: int = 10,
+               rrf_k: int = RRF_K) -> List[RetrievedChunk]:
+        """
+        Hybrid search: BM25 and (when a query vector is given) vector
+        rankings fused with RRF.
+
+        Args:
+            query: Query text
+            vector: Query embedding, or None for BM25 only
+            top_n: Number of chunks to return
+            rrf_k: RRF constant
+
+        Returns:
+            Best chunks first.
+        """
+        if not self.chunk_count:
+            return []
+        rankings = [self.bm25(query).tolist()]
+        if vector is not None:
+            rankings.append(self.nearest(vector).tolist())
+        fused = reciprocal_rank_fusion(rankings, rrf_k)
+        best = sorted(fused.items(), key=lambda item: -item[1])[:top_n]
+        results = []
+        for doc, score in best:
+            record = self.chunk(doc)
+            results.append(RetrievedChunk(
+                chunk_id=str(record.get("id", doc)),
+                title=str(record.get("title") or ""),
+                filepath=str(record.get("filepath") or ""),
+                url=str(record.get("url") or ""),
+                content=str(record.get("content") or ""),
+                score=round(score, 6),
+            ))
+        return results
+
+
+def write_index(path: str, chunks: Sequence[Dict[str, object]],
+                embeddings: Optional[Sequence[Sequence[float]]] = None,
+                embedder: Optional[Dict[str, object]] = None) -> Dict[str, object]:
+    """
+    Write an index directory for chunk records (`id`, `title`, `filepath`,
+    `url`, `content`) and, optionally, their embeddings in the same order.
+    `embedder` is the spec of the embedder that produced them (see
+    embeddings.create_embedder); queries must be embedded the same way.
+
+    Returns:
+        The manifest written to index.json.
+    """
+    if np is None:
+        raise RuntimeError("numpy is required to build a retrieval index")
+    os.makedirs(path, exist_ok=True)
+
+    vocab: Dict[str, int] = {}
+    postings: List[Dict[int, int]] = []
+    doc_lengths = np.zeros(len(chunks), dtype=np.int32)
+    chunk_offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+    with open(os.path.join(path, "chunks.jsonl"), "wb") as f:
+        for doc, chunk in enumerate(chunks):
+            tokens = tokenize(f"{chunk.get('title') or ''} {chunk.get('content') or ''}")
+            doc_lengths[doc] = len(tokens)
+            counts: Dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                term_id = vocab.setdefault(token, len(vocab))
+                if term_id == len(postings):
+                    postings.append({})
+                postings[term_id][doc] = count
+            f.write(json.dumps(chunk, ensure_ascii=False).encode("utf-8") + b"\n")
+            chunk_offsets[doc + 1] = f.tell()
+
+    offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(docs) for docs in postings])
+    postings_docs = np.fromiter((doc for docs in postings for doc in docs), dtype=np.int32, count=int(offsets[-1]))
+    postings_tf = np.fromiter((min(tf, 65535) for docs in postings for tf in docs.values()),
+                              dtype=np.uint16, count=int(offsets[-1]))
+    np.save(os.path.join(path, "postings_offsets.npy"), offsets)
+    np.save(os.path.join(path, "postings_docs.npy"), postings_docs)
+    np.save(os.path.join(path, "postings_tf.npy"), postings_tf)
+    np.save(os.path.join(path, "doc_lengths.npy"), doc_lengths)
+    np.save(os.path.join(path, "chunk_offsets.npy"), chunk_offsets)
+    with open(os.path.join(path, "vocab.json"), "w", encoding="utf-8") as f:
+        json.dump(vocab, f, ensure_ascii=False)
+
+    dimensions = 0
+    if embeddings is not None and len(embeddings):
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1.0, norms)
+        np.save(os.path.join(path, "embeddings.npy"), matrix)
+        dimensions = int(matrix.shape[1])
+        if len(matrix) >= COARSE_MIN_CHUNKS and dimensions > COARSE_DIMENSIONS:
+            # Uncentered PCA keeps the most dot-product energy in few dimensions
+            sample = matrix[np.random.default_rng(0).choice(len(matrix), min(len(matrix), COARSE_SAMPLE_SIZE),
+                                                            replace=False)]
+            _, _, components = np.linalg.svd(sample, full_matrices=False)
+            projection = np.ascontiguousarray(components[:COARSE_DIMENSIONS].T)
+            np.save(os.path.join(path, "projection.npy"), projection)
+            np.save(os.path.join(path, "embeddings_coarse.npy"), matrix @ projection)
+        else:
+            _remove(path, "projection.npy", "embeddings_coarse.npy")
+    else:
+        _remove(path, "embeddings.npy", "projection.npy", "embeddings_coarse.npy")
+
+    manifest = {
+        "version": INDEX_FORMAT_VERSION,
+        "chunks": len(chunks),
+        "terms": len(vocab),
+        "postings": int(offsets[-1]),
+        "dimensions": dimensions,
+        "embedder": embedder if dimensions else None,
+        "created_at": time.time(),
+    }
+    with open(os.path.join(path, INDEX_MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def _remove(path: str, *names: str) -> None:
+    for name in names:
+        if os.path.exists(os.path.join(path, name)):
+            os.remove(os.path.join(path, name))
+
+
+class LocalRetriever:
+    """The worker's local index, loaded lazily and reloadable."""
+
+    def __init__(self, path: str, rrf_k: int = RRF_K):
+        self.path = path
+        self.rrf_k = rrf_k
+        self.index: Optional[LocalIndex] = None
+        self.error: Optional[str] = None
+        self.loaded_version: Optional[int] = None
+        self.loads = 0
+        self.searches = 0
+        self.hybrid_searches = 0
+        self.search_seconds = 0.0
+
+    @classmethod
+    def from_config(cls, config) -> "LocalRetriever":
+        """Build a retriever from the RETRIEVAL_* settings of a config object."""
+        return cls(config.RETRIEVAL_INDEX_PATH, config.RETRIEVAL_RRF_K)
+
+    @property
+    def ready(self) -> bool:
+        return self.index is not None
+
+    def _version(self) -> Optional[int]:
+        """Modification time of index.json; changes whenever an index is swapped in."""
+        try:
+            return os.stat(os.path.join(self.path, INDEX_MANIFEST)).st_mtime_ns
+        except OSError:
+            return None
+
+    def load(self) -> bool:
+        """(Re)open the index; the previous one stays in use if loading fails."""
+        version = self._version()
+        try:
+            index = LocalIndex(self.path)
+        except (OSError, ValueError, KeyError, RuntimeError) as e:
+            self.error = str(e)
+            self.loaded_version = version
+            logger.error(f"Local retrieval index at {self.path} not loaded: {str(e)}")
+            return False
+        previous, self.index, self.error = self.index, index, None
+        self.loaded_version = version
+        self.loads += 1
+        if previous is not None:
+            previous.close()
+        logger.info(f"Local retrieval index loaded: {index.chunk_count} chunks, "
+                    f"{len(index.vocab)} terms, {index.dimensions} dimensions")
+        return True
+
+    async def watch(self, interval: float) -> None:
+        """Reload whenever index.json is replaced (atomic swaps by ingest.py), polling every `interval` seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            version = self._version()
+            if version is not None and version != self.loaded_version:
+                logger.info(f"Local retrieval index at {self.path} changed, reloading")
+                self.load()
+
+    def search(self, query: str, vector: Optional[Sequence[float]] = None, top_n: int = 10) -> List[RetrievedChunk]:
+        """Hybrid search on the current index (empty if none is loaded)."""
+        index = self.index
+        if index is None:
+            return []
+        started = time.perf_counter()
+        results = index.search(query, vector, top_n, self.rrf_k)
+        self.search_seconds += time.perf_counter() - started
+        self.searches += 1
+        if vector is not None:
+            self.hybrid_searches += 1
+        return results
+
+    def stats(self) -> Dict[str, object]:
+        """Index size and search timings for monitoring."""
+        index = self.index
+        return {
+            "path": self.path,
+            "loaded": index is not None,
+            "error": self.error,
+            "chunks": index.chunk_count if index else 0,
+            "terms": len(index.vocab) if index else 0,
+            "dimensions": index.dimensions if index else 0,
+            "embedder": index.embedder_spec if index else None,
+            "created_at": index.manifest.get("created_at") if index else None,
+            "loads": self.loads,
+            "searches": self.searches,
+            "hybrid_searches": self.hybrid_searches,
+            "avg_search_ms": round(1000 * self.search_seconds / self.searches, 3) if self.searches else None,
+        }
@@ -0,0 +1,272 @@
+"""
+Server-side conversation sessions.
+
+With a session, the browser sends only the new user turn and a
+`session_id`; the history lives on the server. Sessions are kept in a
+bounded in-memory LRU ordered by last activity, optionally backed by a
+SQLite database in WAL mode so they survive worker restarts and are shared
+by all gunicorn workers on the host. With several workers the in-memory
+store alone loses history whenever a turn lands on another worker, so the
+config defaults to SQLite then (see SESSION_SQLITE_PATH). Database calls
+run on a dedicated thread, keeping lock waits off the event loop.
+
+Sessions expire after `idle_timeout` seconds without activity. The default
+matches the avatar idle disconnect in `checkLastSpeak` (js/chat.js).
+"""
+
+import asyncio
+import json
+import logging
+import secrets
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# How often expired rows are purged from SQLite
+PURGE_INTERVAL = 60.0
+
+
+class Session:
+    """One conversation: its messages and last activity time."""
+
+    __slots__ = ("id", "messages", "last_seen", "version")
+
+    def __init__(self, session_id: str, messages: Optional[List[Dict[str, object]]] = None,
+                 last_seen: Optional[float] = None, version: int = 0):
+        self.id = session_id
+        self.messages = messages if messages is not None else []
+        self.last_seen = last_seen if last_seen is not None else time.time()
+        self.version = version
+
+
+class SessionStore:
+    """Bounded LRU of sessions with idle expiry and optional SQLite persistence."""
+
+    def __init__(self, max_sessions: int = 1000, idle_timeout: float = 15.0,
+                 max_messages: int = 200, sqlite_path: Optional[str] = None):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_messages = max_messages
+        self.sqlite_path = sqlite_path
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        # One thread owns the connection, so its calls never run concurrently
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._last_purge = 0.0
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+        if sqlite_path:
+            self._open_db(sqlite_path)
+
+    @classmethod
+    def from_config(cls, config) -> "SessionStore":
+        """Build a store from the SESSION_* settings of a config object."""
+        workers = getattr(config, "WEB_CONCURRENCY", 1)
+        if workers > 1 and not config.SESSION_SQLITE_PATH:
+            logger.warning(f"In-memory sessions with {workers} workers: turns served by another worker "
+                           f"start a new session. Set SESSION_SQLITE_PATH to share them.")
+        return cls(
+            max_sessions=config.SESSION_MAX_SESSIONS,
+            idle_timeout=config.SESSION_IDLE_TIMEOUT,
+            max_messages=config.SESSION_MAX_MESSAGES,
+            sqlite_path=config.SESSION_SQLITE_PATH or None,
+        )
+
+    def _open_db(self, path: str) -> None:
+        self._db = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=5.0)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "id TEXT PRIMARY KEY, messages TEXT NOT NULL, "
+            "last_seen REAL NOT NULL, version INTEGER NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS sessions_last_seen ON sessions (last_seen)")
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sessions")
+        logger.info(f"Session store persisted to {path}")
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    async def _run(self, fn, *args):
+        """Run a database call on the store's thread."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def create(self) -> Session:
+        """Start a new, empty session."""
+        session = Session(secrets.token_urlsafe(16))
+        self._remember(session)
+        self.created += 1
+        if self._db is not None:
+            await self._run(self._write, session.id, session.messages, session.last_seen, session.version)
+            await self._purge()
+        return session
+
+    async def get(self, session_id: str) -> Optional[Session]:
+        """
+        Return a live session, or None if it is unknown or idle too long.
+
+        With SQLite enabled, the in-memory copy is used only while its
+        version matches the database, so turns served by other workers are
+        picked up.
+        """
+        session = self._sessions.get(session_id)
+        if self._db is not None:
+            row = await self._run(self._load, session_id, session.version if session is not None else None)
+            if row is None:
+                self._sessions.pop(session_id, None)
+                return None
+            version, last_seen, messages = row
+            if messages is not None:
+                session = Session(session_id, messages, last_seen, version)
+                self._remember(session)
+            else:
+                # Another worker may have touched it since
+                session.last_seen = max(session.last_seen, last_seen)
+        if session is None:
+            return None
+        if time.time() - session.last_seen > self.idle_timeout:
+            await self.delete(session_id)
+            self.expired += 1
+            return None
+        if session_id in self._sessions:
+            self._sessions.move_to_end(session_id)
+        return session
+
+    async def append(self, session: Session, messages: List[Dict[str, object]]) -> None:
+        """
+        Add turns to a session and mark it active.
+
+        With SQLite the read-modify-write runs in one immediate transaction,
+        so turns appended meanwhile by another worker are not lost.
+        """
+        if self._db is None:
+            session.messages = self._extended(session.messages, messages)
+            session.last_seen = time.time()
+            session.version += 1
+        else:
+            session.messages, session.version, session.last_seen = await self._run(
+                self._append, session.id, session.version, list(session.messages), messages
+            )
+        self._remember(session)
+
+    def _extended(self, history: List[Dict[str, object]],
+                  messages: List[Dict[str, object]]) -> List[Dict[str, object]]:
+        history = history + messages
+        if len(history) > self.max_messages:
+            del history[:len(history) - self.max_messages]
+        return history
+
+    async def touch(self, session: Session) -> None:
+        """Mark a session active without changing its history."""
+        session.last_seen = time.time()
+        if session.id in self._sessions:
+            self._sessions.move_to_end(session.id)
+        if self._db is not None:
+            await self._run(self._touch, session.id, session.last_seen)
+
+    async def delete(self, session_id: str) -> bool:
+        """Forget a session. Returns True if it existed."""
+        existed = self._sessions.pop(session_id, None) is not None
+        if self._db is not None:
+            existed = await self._run(self._delete, session_id) or existed
+        return existed
+
+    def _remember(self, session: Session) -> None:
+        self._sessions[session.id] = session
+        self._sessions.move_to_end(session.id)
+        # Oldest activity first: drop idle sessions, then enforce the bound
+        cutoff = time.time() - self.idle_timeout
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if oldest.last_seen >= cutoff and len(self._sessions) <= self.max_sessions:
+                break
+            self._sessions.popitem(last=False)
+            if oldest.last_seen < cutoff:
+                self.expired += 1
+            else:
+                self.evicted += 1
+
+    async def _purge(self) -> None:
+        now = time.time()
+        if now - self._last_purge < PURGE_INTERVAL:
+            return
+        self._last_purge = now
+        removed = await self._run(self._delete_idle, now - self.idle_timeout)
+        if removed:
+            logger.info(f"Purged {removed} idle sessions")
+
+    # Database calls below run on the store's thread
+
+    def _load(self, session_id: str,
+              known_version: Optional[int]) -> Optional[Tuple[int, float, Optional[List[Dict[str, object]]]]]:
+        """(version, last_seen, messages or None if `known_version` is current), or None."""
+        row = self._db.execute(
+            "SELECT version, last_seen FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        if row[0] == known_version:
+            return row[0], row[1], None
+        messages = self._db.execute(
+            "SELECT messages FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()[0]
+        return row[0], row[1], json.loads(messages)
+
+    def _append(self, session_id: str, version: int, history: List[Dict[str, object]],
+                messages: List[Dict[str, object]]) -> Tuple[List[Dict[str, object]], int, float]:
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._db.execute(
+                "SELECT messages, version FROM sessions WHERE id = ?", (session_id,)
+            ).fetchone()
+            if row is not None and row[1] != version:
+                history, version = json.loads(row[0]), row[1]
+            history = self._extended(history, messages)
+            version += 1
+            last_seen = time.time()
+            self._write(session_id, history, last_seen, version)
+            self._db.execute("COMMIT")
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+        return history, version, last_seen
+
+    def _write(self, session_id: str, messages: List[Dict[str, object]], last_seen: float, version: int) -> None:
+        self._db.execute(
+            "INSERT INTO sessions (id, messages, last_seen, version) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET messages = excluded.messages, "
+            "last_seen = excluded.last_seen, version = excluded.version",
+            (session_id, json.dumps(messages, ensure_ascii=False), last_seen, version),
+        )
+
+    def _touch(self, session_id: str, last_seen: float) -> None:
+        self._db.execute("UPDATE sessions SET last_seen = ? WHERE id = ?", (last_seen, session_id))
+
+    def _delete(self, session_id: str) -> bool:
+        return self._db.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount > 0
+
+    def _delete_idle(self, cutoff: float) -> int:
+        return self._db.execute("DELETE FROM sessions WHERE last_seen < ?", (cutoff,)).rowcount
+
+    def stats(self) -> Dict[str, object]:
+        """Occupancy and counters for monitoring."""
+        return {
+            "active": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "idle_timeout": self.idle_timeout,
+            "persistent": self._db is not None,
+            "created": self.created,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
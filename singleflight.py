@@ -0,0 +1,190 @@
+"""
+Single-flight coalescing of identical in-flight upstream calls.
+
+When a kiosk group or a page reload sends the same question at the same
+moment, only the first request (the leader) goes upstream; the others wait
+on the leader's result. Streamed calls are fanned out: every subscriber gets
+the events already received followed by the live ones.
+
+The upstream work runs in its own task, so a disconnecting leader does not
+fail its followers. The task is cancelled only once nobody is waiting for it.
+"""
+
+import asyncio
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_END = object()
+
+
+class _Call:
+    """A coalesced non-streamed call."""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Future"):
+        self.task = task
+        self.waiters = 0
+
+
+class _StreamFlight:
+    """A coalesced streamed call with replay buffer and subscriber queues."""
+
+    def __init__(self):
+        self.ready: "asyncio.Future" = asyncio.get_running_loop().create_future()
+        self.events: List[bytes] = []
+        self.subscribers: List[asyncio.Queue] = []
+        self.task: Optional["asyncio.Future"] = None
+        self.finished = False
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        for event in self.events:
+            queue.put_nowait(event)
+        if self.finished:
+            queue.put_nowait(_END)
+        self.subscribers.append(queue)
+        return queue
+
+    def publish(self, item) -> None:
+        if item is not _END and not isinstance(item, BaseException):
+            self.events.append(item)
+        for queue in self.subscribers:
+            queue.put_nowait(item)
+
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key."""
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._streams: Dict[str, _StreamFlight] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.cancelled = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run `fn` once for all concurrent callers with the same key.
+
+        Args:
+            key: Identity of the call (e.g. the answer cache key)
+            fn: Coroutine function performing the upstream call
+
+        Returns:
+            The shared result. Exceptions raised by `fn` propagate to every
+            waiter.
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(self._calls, key, call))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Every waiter went away (client disconnects): stop the upstream call
+                call.task.cancel()
+                self.cancelled += 1
+
+    async def stream(
+        self,
+        key: str,
+        opener: Callable[[], Awaitable[AsyncIterator[bytes]]],
+    ) -> AsyncIterator[bytes]:
+        """
+        Subscribe to a shared upstream event stream.
+
+        Waits until the upstream stream is open, so errors before the first
+        byte (HTTP status errors) are raised here for every subscriber.
+
+        Args:
+            key: Identity of the call
+            opener: Coroutine function that opens the upstream call and
+                returns an async iterator over its events
+
+        Returns:
+            Async iterator over every event of the stream, from the start.
+        """
+        flight = self._streams.get(key)
+        if flight is None:
+            flight = _StreamFlight()
+            self._streams[key] = flight
+            flight.task = asyncio.ensure_future(self._pump(key, flight, opener))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+        queue = flight.subscribe()
+        try:
+            await asyncio.shield(flight.ready)
+        except BaseException:
+            self._unsubscribe(flight, queue)
+            raise
+        return self._iterate(flight, queue)
+
+    async def _pump(self, key: str, flight: _StreamFlight, opener) -> None:
+        source = None
+        try:
+            source = await opener()
+            flight.ready.set_result(True)
+            async for event in source:
+                flight.publish(event)
+            flight.finished = True
+            flight.publish(_END)
+        except asyncio.CancelledError:
+            if not flight.ready.done():
+                flight.ready.cancel()
+            raise
+        except Exception as e:
+            if not flight.ready.done():
+                flight.ready.set_exception(e)
+            else:
+                logger.error(f"Shared upstream stream failed: {str(e)}")
+                flight.publish(e)
+        finally:
+            if source is not None and hasattr(source, "aclose"):
+                await source.aclose()
+            self._forget(self._streams, key, flight)
+
+    async def _iterate(self, flight: _StreamFlight, queue: asyncio.Queue) -> AsyncIterator[bytes]:
+        try:
+            while True:
+                item = await queue.get()
+                if item is _END:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            self._unsubscribe(flight, queue)
+
+    def _unsubscribe(self, flight: _StreamFlight, queue: asyncio.Queue) -> None:
+        if queue in flight.subscribers:
+            flight.subscribers.remove(queue)
+        if not flight.subscribers and flight.task is not None and not flight.task.done():
+            flight.task.cancel()
+            self.cancelled += 1
+
+    @staticmethod
+    def _forget(registry: Dict[str, object], key: str, value: object) -> None:
+        if registry.get(key) is value:
+            del registry[key]
+
+    def stats(self) -> Dict[str, int]:
+        """Coalescing counters for monitoring."""
+        return {
+            "in_flight": len(self._calls) + len(self._streams),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "cancelled": self.cancelled,
+        }
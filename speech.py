@@ -0,0 +1,236 @@
+"""
+Speech-ready sentence segmentation for the avatar.
+
+The browser used to split raw token deltas into sentences itself, strip
+`[docN]` citation markers and wrap every sentence in SSML before calling
+`speakSsmlAsync`. This module moves that work to the server: upstream
+deltas are fed into a `SentenceSegmenter`, and every completed sentence is
+cleaned of citations and markdown and optionally wrapped in SSML for the
+configured voice. `speech_stream` encodes the events as SSE for
+/chat/speech-stream; `speech_events` yields them as (name, payload) pairs
+for the /ws/chat WebSocket.
+"""
+
+import json
+import logging
+import re
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+from starlette.requests import Request
+
+from streaming import delta_of, format_sse, parse_sse_event
+
+logger = logging.getLogger(__name__)
+
+# Latin punctuation needs trailing whitespace (so "3.5" stays whole); full-width does not
+_BOUNDARY_RE = re.compile(r"[.?!:;]+[\"'»”)\]]*(?=\s)|[。？！：；]+|\n+")
+_DOC_MARKER_RE = re.compile(r"\[doc\d+\]")
+_LINK_RE = re.compile(r"!?\[([^\]]*)\]\([^)]*\)")
+_HEADING_RE = re.compile(r"^\s{0,3}#{1,6}\s+", re.MULTILINE)
+_BULLET_RE = re.compile(r"^\s*[-*+•]\s+", re.MULTILINE)
+_EMPHASIS_RE = re.compile(r"(\*\*|__|\*|`+|~~)")
+_WHITESPACE_RE = re.compile(r"\s+")
+_SPACE_BEFORE_PUNCT_RE = re.compile(r"\s+([.,?!:;])")
+_LETTER_RE = re.compile(r"[^\W\d_]")
+
+# Citation fields forwarded to the client; chunk content is left out
+CITATION_FIELDS = ("title", "filepath", "url", "chunk_id")
+
+
+def clean_speech_text(text: str) -> str:
+    """
+    Remove citation markers and markdown so text can be spoken.
+
+    Args:
+        text: Raw assistant text
+
+    Returns:
+        Plain text with collapsed whitespace.
+    """
+    text = _DOC_MARKER_RE.sub("", text)
+    text = _LINK_RE.sub(r"\1", text)
+    text = _HEADING_RE.sub("", text)
+    text = _BULLET_RE.sub("", text)
+    text = _EMPHASIS_RE.sub("", text)
+    text = _SPACE_BEFORE_PUNCT_RE.sub(r"\1", text)
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def locale_from_voice(voice_name: str, default: str = "en-US") -> str:
+    """Derive `xx-YY` from a voice name such as `ru-RU-DmitryNeural`."""
+    parts = voice_name.split("-")
+    if len(parts) >= 3:
+        return f"{parts[0]}-{parts[1]}"
+    return default
+
+
+def build_ssml(text: str, voice_name: str, locale: Optional[str] = None, rate: str = "1.1") -> str:
+    """
+    Wrap a sentence in SSML for the avatar synthesizer.
+
+    Args:
+        text: Cleaned sentence
+        voice_name: Azure TTS voice (VOICE_NAME)
+        locale: `xml:lang` value; derived from the voice when omitted
+        rate: Prosody rate, matching the pages' default of 1.1
+
+    Returns:
+        SSML document ready for `speakSsmlAsync`.
+    """
+    lang = locale or locale_from_voice(voice_name)
+    return (
+        "<speak version='1.0' xmlns='http://www.w3.org/2001/10/synthesis' "
+        f"xmlns:mstts='http://www.w3.org/2001/mstts' xml:lang='{escape(lang)}'>"
+        f"<voice name='{escape(voice_name)}'>"
+        "<mstts:leadingsilence-exact value='0'/>"
+        f"<prosody rate='{escape(rate)}'>{escape(text)}</prosody>"
+        "</voice></speak>"
+    )
+
+
+class SentenceSegmenter:
+    """Incrementally split streamed tokens into speakable sentences."""
+
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, token: str) -> List[str]:
+        """
+        Add a token and return any sentences it completed.
+
+        A boundary is sentence punctuation followed by whitespace, or a line
+        break. Fragments without letters (list numbers such as "1.") are kept
+        and joined with the following text.
+        """
+        self._buffer += token
+        sentences = []
+        start = 0
+        for match in _BOUNDARY_RE.finditer(self._buffer):
+            candidate = clean_speech_text(self._buffer[start:match.end()])
+            if not _LETTER_RE.search(candidate):
+                continue
+            sentences.append(candidate)
+            start = match.end()
+        if start:
+            self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self) -> List[str]:
+        """Return whatever is left once the stream has ended."""
+        remainder = clean_speech_text(self._buffer)
+        self._buffer = ""
+        return [remainder] if _LETTER_RE.search(remainder) else []
+
+
+def compact_citations(citations: list) -> list:
+    """Keep only the citation fields the client displays."""
+    return [
+        {field: citation.get(field) for field in CITATION_FIELDS if citation.get(field) is not None}
+        for citation in citations
+    ]
+
+
+async def speech_events(
+    events: AsyncIterator[bytes],
+    voice_name: Optional[str] = None,
+    locale: Optional[str] = None,
+    rate: str = "1.1",
+    tokens: bool = False,
+) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    Turn an upstream token stream into (event name, payload) pairs.
+
+    Yields `citations` when Azure Search returns context, `sentence`
+    (`index`, `text`, optional `ssml`) as soon as each sentence completes,
+    `token` (`text`) for every raw delta when `tokens` is set, and finally
+    `done` with the raw assistant reply, or `error` if the upstream failed.
+
+    Args:
+        events: Raw upstream SSE events (see `streaming.relay_chat_stream`)
+        voice_name: When set, every sentence carries pre-built SSML
+        locale: `xml:lang` for the SSML
+        rate: Prosody rate for the SSML
+        tokens: Also yield the raw token deltas (for displaying the reply)
+    """
+    segmenter = SentenceSegmenter()
+    reply = []
+    index = 0
+
+    def sentence_payload(text: str) -> dict:
+        payload = {"index": index, "text": text}
+        if voice_name:
+            payload["ssml"] = build_ssml(text, voice_name, locale, rate)
+        return payload
+
+    try:
+        async for event in events:
+            chunk = parse_sse_event(event)
+            if chunk is None:
+                continue
+            if "error" in chunk:
+                yield "error", chunk
+                return
+            delta = delta_of(chunk)
+            context = delta.get("context")
+            if context and context.get("citations"):
+                yield "citations", {"citations": compact_citations(context["citations"])}
+            token = delta.get("content")
+            if not token:
+                continue
+            reply.append(token)
+            if tokens:
+                yield "token", {"text": token}
+            for sentence in segmenter.feed(token):
+                yield "sentence", sentence_payload(sentence)
+                index += 1
+        for sentence in segmenter.flush():
+            yield "sentence", sentence_payload(sentence)
+            index += 1
+        yield "done", {"response": "".join(reply), "sentences": index}
+    finally:
+        if hasattr(events, "aclose"):
+            await events.aclose()
+
+
+async def speech_stream(
+    events: AsyncIterator[bytes],
+    http_request: Optional[Request] = None,
+    voice_name: Optional[str] = None,
+    locale: Optional[str] = None,
+    rate: str = "1.1",
+    on_complete: Optional[Callable[[str], Awaitable[None]]] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Turn an upstream token stream into sentence events.
+
+    Emits `sentence` events (`index`, `text`, optional `ssml`), a `citations`
+    event when Azure Search returns context, and a final `done` event with the
+    raw assistant reply for the client's history.
+
+    Args:
+        events: Raw upstream SSE events (see `streaming.relay_chat_stream`)
+        http_request: Incoming request, used to detect client disconnects
+        voice_name: When set, every sentence carries pre-built SSML
+        locale: `xml:lang` for the SSML
+        rate: Prosody rate for the SSML
+        on_complete: Awaited with the full reply once the stream finished
+            (not on errors or disconnects), e.g. to store it in a session
+
+    Yields:
+        SSE-encoded bytes for the client.
+    """
+    frames = speech_events(events, voice_name, locale, rate)
+    try:
+        async for name, payload in frames:
+            if name == "sentence" and http_request is not None and await http_request.is_disconnected():
+                logger.info("Client disconnected, aborting speech stream")
+                return
+            if name == "error":
+                yield format_sse(json.dumps(payload), event="error")
+                return
+            if name == "done" and on_complete is not None:
+                await on_complete(payload["response"])
+            yield format_sse(json.dumps(payload, ensure_ascii=False), event=name)
+    finally:
+        await frames.aclose()
@@ -6,14 +6,21 @@ echo "Starting Azure AI Avatar application..."
 # Set working directory
 cd /tmp/*/
 
-# Install dependencies
-echo "Installing dependencies..."
-python -m pip install --upgrade pip
-python -m pip install -r requirements.txt
+# Dependencies are installed when the app is built (SCM_DO_BUILD_DURING_DEPLOYMENT),
+# not on every start: a restart or scale-out must not wait for pip
 
 # Set environment to production
 export ENVIRONMENT=production
 
+# Worker count, also read by config.py: several workers share sessions through SQLite
+export WEB_CONCURRENCY=${WEB_CONCURRENCY:-4}
+
+# Workers share /metrics through this directory; drop the previous run's files
+if [ -n "$METRICS_MULTIPROCESS_DIR" ]; then
+    mkdir -p "$METRICS_MULTIPROCESS_DIR"
+    rm -f "$METRICS_MULTIPROCESS_DIR"/metrics-*.json
+fi
+
 # Start the application with gunicorn for better performance
 echo "Starting application with gunicorn on port $PORT..."
-python -m gunicorn -w 4 -k uvicorn.workers.UvicornWorker main:app --bind 0.0.0.0:$PORT --timeout 600
+python -m gunicorn -w "$WEB_CONCURRENCY" -k uvicorn.workers.UvicornWorker main:app --bind 0.0.0.0:$PORT --timeout 600
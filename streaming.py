@@ -0,0 +1,313 @@
+"""
+Server-sent events relay for streamed Azure OpenAI chat completions.
+
+Azure OpenAI streams `data: {...}` events separated by blank lines and ends
+the stream with `data: [DONE]`. When Azure Search grounding is enabled, the
+first delta also carries a `context` object with citations and intent. The
+helpers here split the upstream body into complete events so they can be
+forwarded to the browser one by one, and parse them for server-side consumers.
+"""
+
+import json
+import logging
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+import aiohttp
+from starlette.requests import Request
+
+import codec
+
+logger = logging.getLogger(__name__)
+
+SSE_MEDIA_TYPE = "text/event-stream"
+
+# Headers that keep proxies (App Service front ends, nginx) from buffering
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
+
+DONE_EVENT = b"data: [DONE]\n\n"
+
+
+def format_sse(data: str, event: Optional[str] = None) -> bytes:
+    """
+    Encode a single server-sent event.
+
+    Args:
+        data: Event payload (must not contain blank lines)
+        event: Optional event name
+
+    Returns:
+        Encoded event terminated by a blank line.
+    """
+    if event:
+        return f"event: {event}\ndata: {data}\n\n".encode("utf-8")
+    return f"data: {data}\n\n".encode("utf-8")
+
+
+async def iter_sse_events(response: aiohttp.ClientResponse) -> AsyncIterator[bytes]:
+    """
+    Split an upstream SSE body into complete events.
+
+    Args:
+        response: Open aiohttp response with a `text/event-stream` body
+
+    Yields:
+        Each event as bytes, including its terminating blank line.
+    """
+    lines = []
+    async for line in response.content:
+        if line in (b"\n", b"\r\n"):
+            if lines:
+                lines.append(b"\n")
+                yield b"".join(lines)
+                lines = []
+            continue
+        lines.append(line if line.endswith(b"\n") else line + b"\n")
+    if lines:
+        lines.append(b"\n")
+        yield b"".join(lines)
+
+
+def parse_sse_event(event: bytes) -> Optional[dict]:
+    """
+    Decode the JSON payload of an upstream chat completion event.
+
+    Args:
+        event: Raw event bytes as produced by `iter_sse_events`
+
+    Returns:
+        The decoded chunk, or None for `[DONE]`, comments and empty events.
+    """
+    data = b"".join(
+        line[5:].strip()
+        for line in event.splitlines()
+        if line.startswith(b"data:")
+    )
+    if not data or data == b"[DONE]":
+        return None
+    return codec.loads(data)
+
+
+def delta_of(chunk: dict) -> dict:
+    """Return the first choice delta of a streamed chunk (empty if absent)."""
+    choices = chunk.get("choices") or []
+    if not choices:
+        return {}
+    return choices[0].get("delta") or {}
+
+
+async def relay_chat_stream(
+    response: aiohttp.ClientResponse,
+    http_request: Optional[Request] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Forward upstream chat completion events unchanged.
+
+    Every complete event (token deltas as well as the Azure Search `context`
+    delta) is yielded as soon as it arrives so Starlette flushes it
+    immediately. The upstream connection is released back to the pool when
+    the stream finishes and closed outright if the consumer stops early.
+
+    Args:
+        response: Open upstream response with status 200
+        http_request: Incoming request, used to detect client disconnects
+
+    Yields:
+        SSE-encoded bytes for the client.
+    """
+    completed = False
+    try:
+        async for event in iter_sse_events(response):
+            if http_request is not None and await http_request.is_disconnected():
+                logger.info("Client disconnected, aborting upstream stream")
+                return
+            yield event
+        completed = True
+    except aiohttp.ClientError as e:
+        logger.error(f"Upstream stream failed: {str(e)}")
+        yield format_sse(json.dumps({"error": "Upstream stream interrupted"}), event="error")
+    finally:
+        if completed:
+            response.release()
+        else:
+            # Unread body: the connection cannot be reused safely
+            response.close()
+
+
+async def watch_disconnect(events: AsyncIterator[bytes], http_request: Optional[Request]) -> AsyncIterator[bytes]:
+    """
+    Pass events through until the client disconnects.
+
+    Used for streams that may be shared between several clients, where the
+    source itself must not look at any single request.
+    """
+    try:
+        async for event in events:
+            if http_request is not None and await http_request.is_disconnected():
+                logger.info("Client disconnected, leaving upstream stream")
+                return
+            yield event
+    finally:
+        if hasattr(events, "aclose"):
+            await events.aclose()
+
+
+async def collect_reply(events: AsyncIterator[bytes],
+                        on_complete: Callable[[str], Awaitable[None]]) -> AsyncIterator[bytes]:
+    """
+    Pass chat completion events through while assembling the assistant reply.
+
+    `on_complete` is awaited with the reply only when the upstream `[DONE]`
+    event arrives, so interrupted or abandoned streams are not recorded.
+
+    Args:
+        events: Raw upstream SSE events
+        on_complete: Callback receiving the full reply text
+
+    Yields:
+        The events unchanged.
+    """
+    parts = []
+    try:
+        async for event in events:
+            if event.strip() == DONE_EVENT.strip():
+                await on_complete("".join(parts))
+            else:
+                chunk = parse_sse_event(event)
+                if chunk is not None:
+                    content = delta_of(chunk).get("content")
+                    if content:
+                        parts.append(content)
+            yield event
+    finally:
+        if hasattr(events, "aclose"):
+            await events.aclose()
+
+
+async def tap_citations(events: AsyncIterator[bytes], on_citations: Callable[[list], None]) -> AsyncIterator[bytes]:
+    """
+    Pass chat completion events through, calling `on_citations` with the
+    citations of the first delta that carries a grounding `context`.
+
+    Args:
+        events: Raw upstream SSE events
+        on_citations: Callback receiving the list of citation objects
+
+    Yields:
+        The events unchanged.
+    """
+    seen = False
+    try:
+        async for event in events:
+            if not seen:
+                try:
+                    chunk = parse_sse_event(event)
+                except ValueError:
+                    chunk = None
+                context = delta_of(chunk).get("context") if chunk is not None else None
+                if context:
+                    seen = True
+                    on_citations(context.get("citations") or [])
+            yield event
+    finally:
+        if hasattr(events, "aclose"):
+            await events.aclose()
+
+
+def context_event(citations: list) -> bytes:
+    """A chat completion delta carrying citations, shaped like Azure Search grounding's first event."""
+    chunk = {"choices": [{"index": 0, "delta": {"role": "assistant", "context": {"citations": citations}}}]}
+    return format_sse(codec.dumps(chunk).decode("utf-8"))
+
+
+def starts_answer(event: bytes) -> bool:
+    """Whether an upstream event carries answer content (tokens or citations) or ends the stream."""
+    if event.strip() == DONE_EVENT.strip():
+        return True
+    try:
+        chunk = parse_sse_event(event)
+    except ValueError:
+        return True
+    if chunk is None:
+        return False
+    delta = delta_of(chunk)
+    return bool(delta.get("content") or delta.get("context"))
+
+
+async def await_first_token(events: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Read ahead until the first answer event arrives.
+
+    Events before it (role-only deltas, content filter results) are kept.
+    Used to put a deadline on the time to first token: if this is cancelled,
+    the upstream stream is closed.
+
+    Returns:
+        Async iterator over every event of the stream, from the start.
+    """
+    buffered = []
+    try:
+        async for event in events:
+            buffered.append(event)
+            if starts_answer(event):
+                break
+    except BaseException:
+        if hasattr(events, "aclose"):
+            await events.aclose()
+        raise
+    return prepend_events(buffered, events)
+
+
+async def prepend_events(buffered: list, events: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Yield `buffered` events, then the rest of `events`."""
+    try:
+        for event in buffered:
+            yield event
+        async for event in events:
+            yield event
+    finally:
+        if hasattr(events, "aclose"):
+            await events.aclose()
+
+
+class ReleasingStream:
+    """
+    Async iterator over events that runs `release` exactly once when the
+    stream is exhausted, closed, or garbage collected without being read.
+
+    Used to hold an upstream concurrency slot for the lifetime of a stream.
+    """
+
+    def __init__(self, events: AsyncIterator[bytes], release: Callable[[], None]):
+        self._events = events
+        self._release = release
+        self._released = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        try:
+            return await self._events.__anext__()
+        except BaseException:
+            # Exhausted, failed or cancelled: the upstream call is over
+            await self.aclose()
+            raise
+
+    async def aclose(self) -> None:
+        try:
+            if hasattr(self._events, "aclose"):
+                await self._events.aclose()
+        finally:
+            self._done()
+
+    def _done(self) -> None:
+        if not self._released:
+            self._released = True
+            self._release()
+
+    def __del__(self):
+        self._done()
@@ -0,0 +1,275 @@
+"""
+Non-blocking, structured and sampled logging.
+
+`configure_logging` replaces `logging.basicConfig`: records are put on an
+in-memory queue by a `QueueHandler` on the event loop and written by a
+`QueueListener` thread, so a slow stdout (App Service log streaming, a
+full pipe) never stalls a request. The message is not formatted on the
+loop either: records keep their `%`-style template and arguments, and the
+listener thread renders them. Pass immutable arguments (strings, numbers),
+as a mutable one could change before the record is written.
+
+Each record carries the id of the request it was logged for
+(`X-Request-ID` from the client, or a generated one, echoed back in the
+response), and with LOG_JSON it is written as one JSON object per line:
+
+    {"ts": "...", "level": "INFO", "logger": "main", "request_id": "9f1c...",
+     "event": "chat.request", "message": "Processing chat request with 3 messages", "messages": 3}
+
+Hot-path messages are tagged with an event name (`extra={"event": ...}`).
+LOG_SAMPLE_RATES keeps a share of the records of an event (below WARNING
+only), and LOG_RATE_LIMIT caps how many records of one message type
+(event, or logger and template) are written per second; the number
+dropped is reported on the next record of that type that gets through.
+"""
+
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+from typing import Dict, Optional
+
+REQUEST_ID_HEADER = b"x-request-id"
+
+SERVER_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access", "gunicorn.error", "gunicorn.access")
+
+_request_id: "contextvars.ContextVar[str]" = contextvars.ContextVar("request_id", default="")
+
+# Attributes every LogRecord has; anything else came in through `extra`
+# (uvicorn adds an ANSI-coloured copy of its messages)
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message", "asctime", "color_message"}
+
+
+def current_request_id() -> str:
+    return _request_id.get()
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """Sampling rates from `event=rate,...` (rates between 0 and 1)."""
+    rates = {}
+    for part in spec.split(","):
+        event, _, rate = part.strip().partition("=")
+        if event:
+            rates[event] = min(1.0, max(0.0, float(rate or 1)))
+    return rates
+
+
+class ContextFilter(logging.Filter):
+    """Stamp the current request id on records, on the thread that logs them."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Per-event sampling and a per-message-type rate limit."""
+
+    def __init__(self, sample_rates: Optional[Dict[str, float]] = None, rate_limit: float = 0.0):
+        super().__init__()
+        self.sample_rates = sample_rates or {}
+        self.rate_limit = rate_limit
+        # message type -> [window start, records in the window, records dropped]
+        self._windows: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        self.sampled_out = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        event = getattr(record, "event", None)
+        if event is not None and record.levelno < logging.WARNING:
+            rate = self.sample_rates.get(event)
+            if rate is not None and rate < 1.0 and random.random() >= rate:
+                self.sampled_out += 1
+                return False
+        if self.rate_limit <= 0:
+            return True
+        # The unformatted template identifies the message type
+        key = (event,) if event is not None else (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None:
+                if len(self._windows) > 10000:
+                    self._windows.clear()
+                window = self._windows[key] = [now, 0, 0]
+            elif now - window[0] >= 1.0:
+                if window[2]:
+                    record.suppressed = window[2]
+                window[0], window[1], window[2] = now, 0, 0
+            if window[1] >= self.rate_limit:
+                window[2] += 1
+                return False
+            window[1] += 1
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the `extra` fields as keys."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "") or None,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The LOG_FORMAT line, with the request id and dropped-record count appended."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        request_id = getattr(record, "request_id", "")
+        if request_id:
+            line = f"{line} [request_id={request_id}]"
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            line = f"{line} [{suppressed} similar messages suppressed]"
+        return line
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock handler renders the message here, on the event loop
+        return record
+
+
+class LoggingPipeline:
+    """The queue listener of this process and the sampling counters."""
+
+    def __init__(self, handler: logging.Handler, output: logging.Handler,
+                 listener: Optional[logging.handlers.QueueListener], sampling: SamplingFilter):
+        self.handler = handler
+        self.output = output
+        self.listener = listener
+        self.sampling = sampling
+
+    def stop(self) -> None:
+        """Write the queued records and stop the listener thread."""
+        if self.listener is None:
+            return
+        # Whatever is logged during the rest of the shutdown is written directly
+        root = logging.getLogger()
+        for log_filter in self.handler.filters:
+            self.output.addFilter(log_filter)
+        root.addHandler(self.output)
+        root.removeHandler(self.handler)
+        self.listener.stop()
+        self.listener = None
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "queued": self.listener is not None,
+            "sampled_out": self.sampling.sampled_out,
+            "sample_rates": dict(self.sampling.sample_rates),
+            "rate_limit": self.sampling.rate_limit,
+        }
+
+
+def skip_unused_record_fields(log_format: Optional[str]) -> None:
+    """
+    Stop collecting LogRecord fields the output never shows (the stdlib's
+    documented logging optimizations): the caller lookup walks the stack,
+    the thread and process fields cost a few calls each per record.
+    """
+    shown = log_format or ""
+    if not any(f"%({name})" in shown for name in ("pathname", "filename", "module", "funcName", "lineno")):
+        logging._srcfile = None
+    if "%(thread" not in shown:
+        logging.logThreads = False
+    if "%(process)" not in shown:
+        logging.logProcesses = False
+    if "%(processName)" not in shown:
+        logging.logMultiprocessing = False
+    if "%(taskName)" not in shown:
+        logging.logAsyncioTasks = False
+
+
+def configure_logging(config) -> LoggingPipeline:
+    """
+    Install the handlers on the root logger from the LOG_* settings.
+
+    Replaces handlers installed before (a previous call or basicConfig).
+    Call `stop()` on the result at shutdown to flush the queue.
+    """
+    output = logging.StreamHandler()
+    output.setFormatter(JsonFormatter() if config.LOG_JSON else TextFormatter(config.LOG_FORMAT))
+    skip_unused_record_fields(None if config.LOG_JSON else config.LOG_FORMAT)
+
+    sampling = SamplingFilter(parse_sample_rates(config.LOG_SAMPLE_RATES), config.LOG_RATE_LIMIT)
+    listener = None
+    if config.LOG_QUEUE:
+        handler = DeferredQueueHandler(queue.SimpleQueue())
+        listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    else:
+        handler = output
+    handler.addFilter(ContextFilter())
+    handler.addFilter(sampling)
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+        if isinstance(existing, DeferredQueueHandler):
+            existing.close()
+    root.addHandler(handler)
+    root.setLevel(getattr(logging, config.LOG_LEVEL))
+    # Server loggers (configured by uvicorn/gunicorn before the app is imported)
+    # go through the same queue and format
+    for name in SERVER_LOGGERS:
+        server_logger = logging.getLogger(name)
+        for existing in list(server_logger.handlers):
+            server_logger.removeHandler(existing)
+        server_logger.propagate = True
+    if listener is not None:
+        listener.start()
+    return LoggingPipeline(handler, output, listener, sampling)
+
+
+class RequestIdMiddleware:
+    """ASGI middleware binding a request id to everything a request logs."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        request_id = ""
+        for name, value in scope.get("headers", ()):
+            if name == REQUEST_ID_HEADER:
+                # Client-supplied ids end up in log lines: keep them short and printable
+                request_id = value.decode("latin-1")[:64]
+                if not request_id.isprintable():
+                    request_id = ""
+                break
+        if not request_id:
+            request_id = os.urandom(8).hex()
+        token = _request_id.set(request_id)
+        encoded = request_id.encode("latin-1")
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", ()), (REQUEST_ID_HEADER, encoded)]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _request_id.reset(token)
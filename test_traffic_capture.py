@@ -0,0 +1,82 @@
+"""
+Test that sanitized traffic captures stay replayable
+"""
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from traffic_capture import REDACTED, sanitize  # noqa: E402
+from bench_load import server_command, server_env, stop, wait_until_up  # noqa: E402
+from loadgen import ScenarioResult  # noqa: E402
+from replay import Replayer, load_capture  # noqa: E402
+
+# What chat-auto.html sends on every turn
+CHAT_AUTO_BODY = {
+    "messages": [{"role": "user", "content": "Какой срок принятия наследства? Пишите на ivan@example.com"}],
+    "stream": False,
+    "max_tokens": 500,
+    "temperature": 0.7,
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_sanitize_keeps_request_parameters():
+    """Secrets are redacted by whole key name; parameters like max_tokens survive"""
+    body = sanitize({**CHAT_AUTO_BODY, "api_key": "k", "accessToken": "t", "client_secret": "s"})
+    assert body["max_tokens"] == 500
+    assert body["temperature"] == 0.7
+    assert body["api_key"] == body["accessToken"] == body["client_secret"] == REDACTED
+    assert "ivan@example.com" not in body["messages"][0]["content"]
+
+
+def test_captured_chat_request_replays():
+    """A /chat request captured by the running app replays against it with status 200"""
+    mock_port, port = free_port(), free_port()
+    with tempfile.TemporaryDirectory() as directory:
+        mock = subprocess.Popen([sys.executable, os.path.join(ROOT, "benchmarks", "mock_upstream.py"),
+                                 "--port", str(mock_port), "--latency", "fixed:10"],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        env = server_env(mock_port, "")
+        env.update({"CAPTURE_ENABLED": "true", "CAPTURE_DIR": os.path.join(directory, "captures"),
+                    "CAPTURE_SAMPLE_RATE": "1", "WARMUP_ENABLED": "false", "LOG_JSON": "false"})
+        server = subprocess.Popen(server_command("uvicorn", 1, port), cwd=ROOT, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        base_url = f"http://127.0.0.1:{port}"
+        try:
+            wait_until_up(f"http://127.0.0.1:{mock_port}/stats", 30, mock)
+            wait_until_up(f"{base_url}/ready", 60, server)
+
+            async def send_and_replay():
+                async with aiohttp.ClientSession() as session:
+                    async with session.post(f"{base_url}/chat", json=CHAT_AUTO_BODY) as response:
+                        assert response.status == 200
+                    records = []
+                    for _ in range(50):  # the capture writer flushes every second
+                        records = load_capture([os.path.join(directory, "captures")])
+                        if records:
+                            break
+                        await asyncio.sleep(0.1)
+                    assert len(records) == 1
+                    assert records[0]["body"]["max_tokens"] == 500
+                    result = ScenarioResult("/chat")
+                    await Replayer(base_url).one(session, records[0], time.perf_counter(), result)
+                    return result.statuses
+
+            assert asyncio.run(send_and_replay()) == {"200": 1}
+        finally:
+            stop(server)
+            stop(mock)
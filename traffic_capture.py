@@ -0,0 +1,311 @@
+"""
+Opt-in capture of production chat traffic for offline replay.
+
+`CaptureMiddleware` (pure ASGI) records a sample of the requests to the
+captured paths: the arrival time, method, path, a whitelist of headers and
+the JSON body, plus the status, time to first byte, duration and size of
+the response. Bodies are sanitized before they are written: values of
+secret keys (`api_key`, `access_token`, `password`, ...) are replaced,
+and e-mail addresses, phone and card numbers in the text are masked.
+Keys are matched by whole name, so request parameters such as
+`max_tokens` survive and the capture stays replayable.
+
+Records are queued without blocking and a single writer task decodes,
+sanitizes and appends them in batches to
+`<dir>/capture-<pid>-<timestamp>.jsonl` on a worker thread.
+Files rotate at CAPTURE_MAX_BYTES and only the newest CAPTURE_MAX_FILES
+per worker are kept. When the queue is full (the disk cannot keep up),
+records are dropped and counted rather than delaying requests.
+
+Replay a capture with `python benchmarks/replay.py captures/`.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Headers kept in a capture; everything else (cookies, authorization) is dropped
+CAPTURED_HEADERS = frozenset({"content-type", "accept", "x-deadline-ms", "user-agent"})
+
+REDACTED = "[REDACTED]"
+
+# Whole key names in snake_case: `key`, `api_key`, `client_secret`, `access_token`...
+# but not `max_tokens` or `keywords`
+SECRET_KEY_PATTERN = re.compile(
+    r"(?:^|_)(?:api_?key|key|secret|token|password|passwd|authorization|credentials?|signature)$"
+)
+_CAMEL_RE = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+
+
+def is_secret_key(key: str) -> bool:
+    """Whether a JSON key names a secret (`apiKey`, `Ocp-Apim-Subscription-Key`, `password`...)."""
+    return bool(SECRET_KEY_PATTERN.search(_CAMEL_RE.sub("_", key).lower().replace("-", "_")))
+
+TEXT_PATTERNS = (
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"), "[EMAIL]"),
+    # Card numbers, phone numbers and other long digit runs (passport, INN, SNILS)
+    (re.compile(r"\+?\d[\d\s().-]{8,}\d"), "[NUMBER]"),
+)
+
+
+def scrub_text(text: str) -> str:
+    for pattern, replacement in TEXT_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def sanitize(value: Any) -> Any:
+    """Copy of a decoded JSON body with secrets redacted and personal data masked."""
+    if isinstance(value, dict):
+        return {key: REDACTED if isinstance(key, str) and is_secret_key(key) else sanitize(item)
+                for key, item in value.items()}
+    if isinstance(value, list):
+        return [sanitize(item) for item in value]
+    if isinstance(value, str):
+        return scrub_text(value)
+    return value
+
+
+class CaptureWriter:
+    """Batched appends of capture records to rotating JSONL files."""
+
+    def __init__(self, directory: str, max_bytes: int = 50 * 1024 * 1024, max_files: int = 20,
+                 batch_size: int = 200, flush_interval: float = 1.0, max_queue: int = 10000):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._path: Optional[str] = None
+        self._size = 0
+        self.written = 0
+        self.dropped = 0
+        self.skipped = 0
+        self.files = 0
+
+    def start(self) -> None:
+        """Start the writer task on the running loop."""
+        os.makedirs(self.directory, exist_ok=True)
+        self._queue = asyncio.Queue(self.max_queue)
+        self._task = asyncio.ensure_future(self._run())
+
+    def put(self, record: Dict[str, Any]) -> None:
+        """Queue a record; dropped when the writer is not running or falls behind."""
+        if self._queue is None:
+            return
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            record = await self._queue.get()
+            if record is None:
+                return
+            batch = [record]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    record = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if record is None:
+                    stopping = True
+                    break
+                batch.append(record)
+            await loop.run_in_executor(None, self._write, batch)
+
+    async def close(self) -> None:
+        """Write what is still queued and stop the writer task."""
+        if self._task is None:
+            return
+        queue, self._queue = self._queue, None
+        # Records put after this point are dropped; the sentinel ends the task
+        await queue.put(None)
+        await self._task
+        self._task = None
+
+    def _encode(self, record: Dict[str, Any]) -> Optional[str]:
+        # Decoding and sanitizing happen here, on the writer thread
+        body = record["body"]
+        try:
+            record["body"] = sanitize(json.loads(body)) if body else None
+        except ValueError:
+            self.skipped += 1
+            return None
+        return json.dumps(record, ensure_ascii=False) + "\n"
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        lines = [line for line in map(self._encode, batch) if line is not None]
+        if not lines:
+            return
+        data = "".join(lines).encode("utf-8")
+        try:
+            if self._path is None or self._size + len(data) > self.max_bytes:
+                self._rotate()
+            with open(self._path, "ab") as handle:
+                handle.write(data)
+            self._size += len(data)
+            self.written += len(lines)
+        except OSError as e:
+            self.dropped += len(lines)
+            logger.warning(f"Could not write traffic capture to {self._path}: {str(e)}")
+
+    def _rotate(self) -> None:
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        prefix = f"capture-{os.getpid()}-"
+        path = os.path.join(self.directory, f"{prefix}{stamp}.jsonl")
+        if path == self._path or os.path.exists(path):
+            path = os.path.join(self.directory, f"{prefix}{stamp}-{self.files}.jsonl")
+        self._path = path
+        self._size = 0
+        self.files += 1
+        own = sorted(name for name in os.listdir(self.directory) if name.startswith(prefix))
+        for name in own[:max(0, len(own) - self.max_files + 1)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "directory": self.directory,
+            "file": self._path,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "written": self.written,
+            "dropped": self.dropped,
+            "skipped": self.skipped,
+            "files": self.files,
+        }
+
+
+class TrafficCapture:
+    """Sampling decision, record construction and the writer of one worker."""
+
+    def __init__(self, writer: CaptureWriter, paths: Iterable[str], sample_rate: float = 1.0,
+                 max_body_bytes: int = 256 * 1024):
+        self.writer = writer
+        self.paths = frozenset(paths)
+        self.sample_rate = sample_rate
+        self.max_body_bytes = max_body_bytes
+        self.seen = 0
+        self.sampled = 0
+        self.oversized = 0
+
+    @classmethod
+    def from_config(cls, config) -> Optional["TrafficCapture"]:
+        """Build the capture from the CAPTURE_* settings, or None when disabled."""
+        if not config.CAPTURE_ENABLED:
+            return None
+        writer = CaptureWriter(config.CAPTURE_DIR, config.CAPTURE_MAX_BYTES, config.CAPTURE_MAX_FILES)
+        paths = [path.strip() for path in config.CAPTURE_PATHS.split(",") if path.strip()]
+        logger.info(f"Capturing {config.CAPTURE_SAMPLE_RATE:.0%} of {', '.join(paths)} requests "
+                    f"to {config.CAPTURE_DIR}")
+        return cls(writer, paths, config.CAPTURE_SAMPLE_RATE)
+
+    def should_capture(self, path: str) -> bool:
+        if path not in self.paths:
+            return False
+        self.seen += 1
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return False
+        self.sampled += 1
+        return True
+
+    def record(self, scope, body: bytes, arrived: float, started: float, first_byte: Optional[float],
+               finished: float, status: int, response_bytes: int) -> None:
+        """Build and queue the record of a finished request (the body is sanitized by the writer)."""
+        headers = {}
+        for name, value in scope.get("headers", ()):
+            name = name.decode("latin-1").lower()
+            if name in CAPTURED_HEADERS:
+                headers[name] = value.decode("latin-1")
+        self.writer.put({
+            "ts": round(arrived, 6),
+            "method": scope["method"],
+            "path": scope["path"],
+            "query": scope.get("query_string", b"").decode("latin-1"),
+            "headers": headers,
+            "body": body,
+            "status": status,
+            "ttfb_ms": round((first_byte - started) * 1000, 2) if first_byte is not None else None,
+            "duration_ms": round((finished - started) * 1000, 2),
+            "response_bytes": response_bytes,
+        })
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "paths": sorted(self.paths),
+            "sample_rate": self.sample_rate,
+            "seen": self.seen,
+            "sampled": self.sampled,
+            "oversized": self.oversized,
+            **self.writer.stats(),
+        }
+
+
+class CaptureMiddleware:
+    """ASGI middleware feeding sampled requests to a `TrafficCapture`."""
+
+    def __init__(self, app, capture: TrafficCapture):
+        self.app = app
+        self.capture = capture
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.capture.should_capture(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        arrived = time.time()
+        started = time.perf_counter()
+        chunks = []
+        size = 0
+        first_byte = None
+        status = 500
+        response_bytes = 0
+        max_body = self.capture.max_body_bytes
+
+        async def receive_and_keep():
+            nonlocal size
+            message = await receive()
+            if message["type"] == "http.request":
+                body = message.get("body", b"")
+                size += len(body)
+                if size <= max_body:
+                    chunks.append(body)
+            return message
+
+        async def send_and_time(message):
+            nonlocal first_byte, status, response_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                body = message.get("body", b"")
+                if body and first_byte is None:
+                    first_byte = time.perf_counter()
+                response_bytes += len(body)
+            await send(message)
+
+        try:
+            await self.app(scope, receive_and_keep, send_and_time)
+        finally:
+            if size > max_body:
+                self.capture.oversized += 1
+            else:
+                self.capture.record(scope, b"".join(chunks), arrived, started, first_byte,
+                                    time.perf_counter(), status, response_bytes)
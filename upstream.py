@@ -0,0 +1,139 @@
+"""
+Shared upstream HTTP connection pool for Azure OpenAI calls.
+
+Each worker process owns exactly one pool. It is opened in the FastAPI
+lifespan and closed on shutdown, so chat turns reuse warm keep-alive
+connections instead of paying for DNS, TCP and TLS on every request.
+"""
+
+import logging
+import time
+from typing import Dict, Optional
+
+import aiohttp
+
+from metrics import record_phase
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamPool:
+    """Per-worker aiohttp session with a tuned, observable connector."""
+
+    def __init__(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 20,
+        keepalive_timeout: float = 60.0,
+        dns_cache_ttl: int = 300,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 120.0,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._connector: Optional[aiohttp.TCPConnector] = None
+        self.connections_created = 0
+        self.connections_reused = 0
+
+    @classmethod
+    def from_config(cls, config) -> "UpstreamPool":
+        """Build a pool from the UPSTREAM_* settings of a config object."""
+        return cls(
+            limit=config.UPSTREAM_POOL_LIMIT,
+            limit_per_host=config.UPSTREAM_POOL_LIMIT_PER_HOST,
+            keepalive_timeout=config.UPSTREAM_KEEPALIVE_TIMEOUT,
+            dns_cache_ttl=config.UPSTREAM_DNS_CACHE_TTL,
+            connect_timeout=config.UPSTREAM_CONNECT_TIMEOUT,
+            read_timeout=config.UPSTREAM_READ_TIMEOUT,
+        )
+
+    async def start(self) -> None:
+        """Open the connector and session. Must run inside the event loop."""
+        if self._session is not None:
+            return
+        self._connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_cache_ttl,
+            use_dns_cache=True,
+        )
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_connection_create_end.append(self._on_connection_created)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reused)
+        self._session = aiohttp.ClientSession(
+            connector=self._connector,
+            timeout=aiohttp.ClientTimeout(
+                total=None,
+                connect=self.connect_timeout,
+                sock_read=self.read_timeout,
+            ),
+            trace_configs=[trace_config],
+        )
+        logger.info(
+            "Upstream pool opened (limit=%s, per_host=%s, keepalive=%ss, dns_ttl=%ss)",
+            self.limit, self.limit_per_host, self.keepalive_timeout, self.dns_cache_ttl,
+        )
+
+    async def close(self) -> None:
+        """Close the session and every pooled connection."""
+        if self._session is None:
+            return
+        await self._session.close()
+        self._session = None
+        self._connector = None
+        logger.info("Upstream pool closed")
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """The shared session; raises if the pool has not been started."""
+        if self._session is None:
+            raise RuntimeError("Upstream pool is not started")
+        return self._session
+
+    async def _on_request_start(self, session, ctx, params) -> None:
+        ctx.started = time.perf_counter()
+
+    async def _on_connection_created(self, session, ctx, params) -> None:
+        self.connections_created += 1
+        # Pool wait, DNS, TCP and TLS of a new connection
+        record_phase("upstream_connect", time.perf_counter() - ctx.started)
+
+    async def _on_connection_reused(self, session, ctx, params) -> None:
+        self.connections_reused += 1
+        record_phase("upstream_connect", time.perf_counter() - ctx.started)
+
+    def stats(self) -> Dict[str, object]:
+        """
+        Report pool occupancy for sizing.
+
+        Returns:
+            Dict with open, idle and in-use connection counts plus limits.
+        """
+        idle = 0
+        in_use = 0
+        if self._connector is not None:
+            # aiohttp keeps idle connections per host key and a set of
+            # acquired protocols; neither is exposed publicly.
+            idle = sum(len(conns) for conns in getattr(self._connector, "_conns", {}).values())
+            in_use = len(getattr(self._connector, "_acquired", ()))
+        return {
+            "started": self._session is not None,
+            "open": idle + in_use,
+            "idle": idle,
+            "in_use": in_use,
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+            "keepalive_timeout": self.keepalive_timeout,
+            "dns_cache_ttl": self.dns_cache_ttl,
+            "connect_timeout": self.connect_timeout,
+            "read_timeout": self.read_timeout,
+            "connections_created": self.connections_created,
+            "connections_reused": self.connections_reused,
+        }
@@ -0,0 +1,255 @@
+"""
+Worker warm-up, readiness and cached upstream health probes.
+
+The lifespan runs the warm-up before the worker accepts traffic (uvicorn
+and gunicorn's UvicornWorker only start serving once the lifespan startup
+has finished), so the first users after a deploy or scale-out do not pay
+for cold connections:
+
+    upstream  resolve DNS and open WARMUP_CONNECTIONS TLS connections per
+              Azure OpenAI endpoint through the shared pool; probe Azure
+              Search (chat turns reach it through Azure OpenAI, so only
+              its health matters here)
+    caches    check the page, asset and config caches, render the request
+              templates once and touch the local retrieval index
+
+`UpstreamProber` repeats the probes every HEALTH_PROBE_INTERVAL seconds,
+which also keeps a pooled connection per endpoint from idling out, and
+`/health/deep` reports its cached results instead of probing per call.
+The probes are cheap, free reads: the model list of Azure OpenAI and a
+zero-document query of the search index.
+
+`WarmupState` backs `/ready` and records the worker's cold start: from
+process start (fork, for gunicorn workers) to the lifespan, and from there
+to ready.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote, urlsplit
+
+import aiohttp
+
+from endpoints import AZURE_OPENAI_API_VERSION
+
+logger = logging.getLogger(__name__)
+
+AZURE_SEARCH_API_VERSION = "2023-11-01"
+
+# Fallback start time when /proc is not available
+_IMPORTED_AT = time.time()
+
+
+def process_start_time() -> float:
+    """Wall-clock start time of this process (its fork, for a gunicorn worker)."""
+    try:
+        with open(f"/proc/{os.getpid()}/stat", encoding="ascii") as handle:
+            # The command name may contain spaces; fields restart after its ")"
+            fields = handle.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime", encoding="ascii") as handle:
+            uptime = float(handle.read().split()[0])
+        started_after_boot = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+        return time.time() - uptime + started_after_boot
+    except (OSError, ValueError, IndexError):
+        return _IMPORTED_AT
+
+
+class ProbeResult:
+    """Outcome of the latest probe of one upstream."""
+
+    __slots__ = ("name", "kind", "host", "ok", "status", "latency", "error", "checked_at")
+
+    def __init__(self, name: str, kind: str, host: str, ok: bool, status: Optional[int],
+                 latency: float, error: Optional[str] = None):
+        self.name = name
+        self.kind = kind
+        self.host = host
+        self.ok = ok
+        self.status = status
+        self.latency = latency
+        self.error = error
+        self.checked_at = time.time()
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "kind": self.kind,
+            "host": self.host,
+            "ok": self.ok,
+            "status": self.status,
+            "latency_ms": round(self.latency * 1000, 1),
+            "error": self.error,
+            "age_seconds": round(time.time() - self.checked_at, 1),
+        }
+
+
+def probe_requests(snapshot) -> List[Tuple[str, str, str, Dict[str, str]]]:
+    """(name, kind, url, headers) of every configured upstream of a config snapshot."""
+    probes = []
+    for target in snapshot.targets:
+        if target.ready:
+            probes.append((f"openai:{target.name}", "openai",
+                           f"{target.endpoint.rstrip('/')}/openai/models?api-version={AZURE_OPENAI_API_VERSION}",
+                           {"api-key": target.headers["api-key"]}))
+    if snapshot.search_ready:
+        probes.append(("search", "search",
+                       f"{snapshot.search_endpoint.rstrip('/')}/indexes/{quote(snapshot.search_index_name)}/docs"
+                       f"?search=*&$top=0&api-version={AZURE_SEARCH_API_VERSION}",
+                       {"api-key": snapshot.search_api_key}))
+    return probes
+
+
+class UpstreamProber:
+    """Probes the configured upstreams and keeps the latest results."""
+
+    def __init__(self, timeout: float = 5.0):
+        self.timeout = timeout
+        self.results: Dict[str, ProbeResult] = {}
+        self.last_probe: Optional[float] = None
+        self.probes = 0
+
+    @classmethod
+    def from_config(cls, config) -> "UpstreamProber":
+        """Build the prober from the HEALTH_* settings of a config object."""
+        return cls(timeout=config.HEALTH_PROBE_TIMEOUT)
+
+    async def _probe_one(self, session: aiohttp.ClientSession, name: str, kind: str, url: str,
+                         headers: Dict[str, str]) -> ProbeResult:
+        host = urlsplit(url).netloc
+        started = time.perf_counter()
+        try:
+            async with session.get(url, headers=headers,
+                                   timeout=aiohttp.ClientTimeout(total=self.timeout)) as response:
+                # Read the body so the connection goes back to the pool
+                await response.read()
+                status = response.status
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return ProbeResult(name, kind, host, False, None, time.perf_counter() - started,
+                               str(e) or type(e).__name__)
+        # 401/403 mean the key is wrong, which breaks chat turns as much as an outage
+        ok = status < 400
+        return ProbeResult(name, kind, host, ok, status, time.perf_counter() - started,
+                           None if ok else f"HTTP {status}")
+
+    async def probe(self, session: aiohttp.ClientSession, snapshot, connections: int = 1) -> Dict[str, ProbeResult]:
+        """
+        Probe every upstream of `snapshot`, `connections` times in parallel
+        per Azure OpenAI endpoint so that many connections end up pooled.
+        """
+        calls = []
+        for name, kind, url, headers in probe_requests(snapshot):
+            for _ in range(connections if kind == "openai" else 1):
+                calls.append((name, self._probe_one(session, name, kind, url, headers)))
+        outcomes = await asyncio.gather(*(call for _, call in calls))
+        results: Dict[str, ProbeResult] = {}
+        for (name, _), result in zip(calls, outcomes):
+            # One successful connection is enough for the endpoint to count as up
+            if name not in results or (result.ok and not results[name].ok):
+                results[name] = result
+        self.results = results
+        self.last_probe = time.time()
+        self.probes += 1
+        for result in results.values():
+            if not result.ok:
+                logger.warning(f"Upstream probe {result.name} ({result.host}) failed: {result.error}")
+        return results
+
+    async def run_periodically(self, session_getter, snapshot_getter, interval: float) -> None:
+        """Probe every `interval` seconds until cancelled (the config may be reloaded in between)."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.probe(session_getter(), snapshot_getter())
+            except Exception as e:
+                logger.error(f"Upstream probe failed: {str(e)}")
+
+    def status(self) -> str:
+        """`healthy`, `degraded` (some upstream failing), `unhealthy` (no Azure OpenAI) or `unknown`."""
+        if not self.results:
+            return "unknown"
+        openai = [result for result in self.results.values() if result.kind == "openai"]
+        if openai and not any(result.ok for result in openai):
+            return "unhealthy"
+        return "healthy" if all(result.ok for result in self.results.values()) else "degraded"
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "status": self.status(),
+            "last_probe_age_seconds": round(time.time() - self.last_probe, 1) if self.last_probe else None,
+            "probes": self.probes,
+            "upstreams": {name: result.to_dict() for name, result in self.results.items()},
+        }
+
+
+class _Step:
+    """Times one warm-up step; failures are recorded, not raised."""
+
+    __slots__ = ("state", "name", "started")
+
+    def __init__(self, state: "WarmupState", name: str):
+        self.state = state
+        self.name = name
+
+    def __enter__(self) -> "_Step":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> bool:
+        entry = {"ok": exc is None, "ms": round((time.perf_counter() - self.started) * 1000, 1)}
+        if exc is not None:
+            if not isinstance(exc, Exception):
+                return False  # cancellation and exit propagate
+            entry["error"] = str(exc) or exc_type.__name__
+            logger.warning(f"Warm-up step {self.name} failed: {entry['error']}")
+        self.state.steps[self.name] = entry
+        return True
+
+
+class WarmupState:
+    """Warm-up progress and cold-start timing of this worker."""
+
+    def __init__(self):
+        self.process_started = process_start_time()
+        self.lifespan_started: Optional[float] = None
+        self.ready_at: Optional[float] = None
+        self.timed_out = False
+        self.steps: Dict[str, Dict[str, object]] = {}
+
+    def begin(self) -> None:
+        self.lifespan_started = time.time()
+
+    def step(self, name: str) -> _Step:
+        """Context manager timing a warm-up step: `with warmup.step("caches"): ...`."""
+        return _Step(self, name)
+
+    def finish(self, timed_out: bool = False) -> None:
+        self.ready_at = time.time()
+        self.timed_out = timed_out
+        logger.info(f"Worker ready: cold start {self.ready_at - self.process_started:.2f}s "
+                    f"(start-up {self.lifespan_started - self.process_started:.2f}s, "
+                    f"warm-up {self.ready_at - self.lifespan_started:.2f}s)")
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_at is not None
+
+    @property
+    def warm(self) -> bool:
+        """Ready, and every step completed in time."""
+        return self.ready and not self.timed_out and all(step["ok"] for step in self.steps.values())
+
+    def stats(self) -> Dict[str, object]:
+        stats: Dict[str, object] = {
+            "status": "ready" if self.ready else "warming",
+            "warm": self.warm,
+            "timed_out": self.timed_out,
+            "steps": dict(self.steps),
+        }
+        if self.lifespan_started is not None:
+            stats["startup_seconds"] = round(self.lifespan_started - self.process_started, 3)
+        if self.ready_at is not None:
+            stats["warmup_seconds"] = round(self.ready_at - self.lifespan_started, 3)
+            stats["cold_start_seconds"] = round(self.ready_at - self.process_started, 3)
+        return stats